@@ -6,14 +6,36 @@
 #### НИЦ СтаДиО 2017
 
 import fnmatch
+import gzip
+import zipfile
 import os
 import os.path
 import re
 import argparse
+import asyncio
 import concurrent.futures as confu
+import cProfile
+import json
+import tracemalloc
+import hashlib
+import io
+import html
+import mmap
+import array
+import sys
+import pickle
+import tempfile
+import threading
+import collections
+import functools
+import itertools
 import multiprocessing
 import time
+import urllib.parse
 import logging
+import logging.handlers
+import queue
+import atexit
 
 # TODO Сделать однократную печать шапки (имя проекта, название объекта и пр.) в начале объединенного документа
 # TODO Поправить документацию функций
@@ -23,118 +45,2084 @@ import logging
 LOG_FILE_NAME = 'log/html_merger.log'    # Путь к файлу для печати логов
 LOGGER_NAME = 'logger'                   # Общее имя логгера
 BREAKING_LINE = '='*50                   # Строка-разделитель для форматирования
+LOG_SUMMARY = 25                         # Уровень итоговых сообщений (между INFO и WARNING, см. configure_logging)
+LOG_FILES_LIMIT = 20                     # Количество имен файлов, выводимых в журнал при запуске объединения
 DEFAULT_DEBUG_MODE = True                # Режим дебага по умолчанию (для вывода исключений, возникших при парсинге аргументов)
+EXECUTOR_TYPES = ('thread', 'process', 'serial')    # Способы параллельной обработки документов: потоки, процессы, последовательно
+STREAM_INFLIGHT_FACTOR = 2               # Количество одновременно обрабатываемых документов на один поток (процесс) в потоковом режиме
+CACHE_DIR_NAME = 'html_merger'           # Директория кэша в пользовательской директории кэшей (см. default_cache_dir)
+DEFAULT_CACHE_SIZE_MB = 512              # Максимальный размер кэша обработанных документов, МБ
+CACHE_FORMAT_VERSION = 2                 # Версия формата записей кэша (увеличивается при изменении результата parse_document)
+CACHE_ENTRY_SUFFIX = '.pickle'           # Расширение файлов записей кэша
+PROFILE_TOP_ALLOCATIONS = 20             # Количество мест наибольшего выделения памяти в отчете профилирования
+MB = 1024*1024                           # Байт в мегабайте
+DEFAULT_POLL_INTERVAL = 1.0              # Период проверки изменений входных файлов в режиме наблюдения, сек
+DEFAULT_DEBOUNCE = 0.5                   # Время без изменений, после которого серия изменений считается завершенной, сек
+VOLUME_PATH_FORMAT = '%s_%03d%s'         # Имя тома выходного документа: <имя выходного файла>_<номер тома><расширение>
+SCAN_WORKERS_FACTOR = 4                  # Количество потоков просмотра документов на одно ядро (см. scan_directory)
+SCAN_INDEX_FILE_NAME = '.html_merger_index.json'    # Имя файла индекса в рабочей директории по умолчанию (для запуска из командной строки)
+SCAN_INDEX_ZIP_SUFFIX = '.index.json'    # Расширение индекса zip-архива по умолчанию: индекс хранится рядом с архивом (<архив>.index.json)
+SCAN_INDEX_VERSION = 1                   # Версия формата индекса директории (см. scan_directory)
+INPUT_PATTERNS = ('*.html', '*.htm', '*.txt')    # Шаблоны имен входных документов (также сжатых gzip: *.html.gz, ...)
+GZIP_SUFFIX = '.gz'                      # Расширение документов и выходного файла, сжатых gzip
+GZIP_LEVEL = 6                           # Степень сжатия выходного файла (9 заметно медленнее при близком размере)
+ZIP_SUFFIX = '.zip'                      # Расширение zip-архива с документами (передается вместо рабочей директории)
+DOCUMENT_PHASES = {'styles': 'считывание стилей', 'split': 'разбиение на части', 'parse': 'обработка', 'write': 'запись'}  # Этапы обработки документа (см. DocumentException)
+DEFAULT_SPLIT_MB = 64                    # Размер документа, начиная с которого он обрабатывается по частям (для запуска из командной строки), МБ
+
+# Шапка и окончание выходного документа
+HTML_HEADER = ('<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN">\n'
+               '<html>\n'
+               '<head>\n'
+               '<meta http-equiv="Content-Type" content="text/html; charset=UTF-8">\n'
+               '<meta name="Generator" content="FastReport 5.0 http://www.fast-report.com">\n'
+               '<title></title>\n'
+               '<style type="text/css">\n')
+HTML_BODY_START = ('</style>\n'
+                   '</head>\n'
+                   '<body text="#000000" bgcolor="#FFFFFF">\n')
+HTML_FOOTER = ('</body>\n'
+               '</html>\n')
+
+# Регулярные выражения
+STYLE_BLOCK_RE = re.compile(r'<style\s+type\s*=\s*"text/css">(.+)</style>', flags=re.DOTALL)     # Блок стилей документа
+CSS_RULE_RE = re.compile(r'\.(-?[_a-zA-Z]+[_a-zA-Z0-9-]*)\s*\{([^{]+)\}', flags=re.DOTALL)        # Описание класса стилей
+TABLE_RE = re.compile(r'(<table[^<]+>.+?</table>)', flags=re.DOTALL)                             # HTML-таблица (Not greedy match '+?')
+TABLE_TAG_RE = re.compile(r'<table[^<]+>')                                                       # Открывающий тег таблицы (начало TABLE_RE)
+CLASS_ATTR_RE = re.compile(r'class\s*=\s*"([^"]*)"')                                              # Атрибут class="..." в HTML-коде таблицы
+TABLE_LABEL_RE = re.compile(r'Т\d+-\d+')                                                         # Номер таблицы вида Т<документ>-<таблица>
+TABLE_SPACE_PATTERN = r'>[ \t\n\r\f]+(?=</?(?:t(?:able|body|head|foot|r|d|h)|colgroup|col|caption)\b)'
+TABLE_SPACE_RE = re.compile(TABLE_SPACE_PATTERN)                                                  # Пробельные символы перед тегом структуры таблицы
+
+# Пробельные символы, удаляемые str.strip(), для обработки документа в байтах (см. scan_document_bytes)
+ASCII_SPACES_BYTES = b' \t\x0b\x0c\x1c\x1d\x1e\x1f'                                             # Кроме переводов строк
+UNICODE_SPACES_BYTES = tuple(space.encode('utf8') for space in '\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006'
+                                                                 '\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000')
+UNICODE_SPACES_LEAD_BYTES = tuple(sorted(set(space[:1] for space in UNICODE_SPACES_BYTES)))         # Первые байты многобайтных пробельных символов
+SPACE_BYTES_PATTERN = rb'(?:[\s\x1c-\x1f]|' + b'|'.join(UNICODE_SPACES_BYTES) + rb')'              # Аналог \s для текста в UTF-8
+
+# Регулярные выражения для документа в байтах (UTF-8), совпадения те же, что и у выражений для текста
+UNICODE_SPACE_BYTES_RE = re.compile(b'|'.join(UNICODE_SPACES_BYTES))                             # Многобайтный пробельный символ
+TABLE_BYTES_RE = re.compile(rb'(<table[^<]+>.+?</table>)', flags=re.DOTALL)                      # См. TABLE_RE
+TABLE_TAG_BYTES_RE = re.compile(rb'<table[^<]+>')                                                # См. TABLE_TAG_RE
+CLASS_ATTR_BYTES_RE = re.compile(rb'class' + SPACE_BYTES_PATTERN + rb'*=' + SPACE_BYTES_PATTERN + rb'*"([^"]*)"')   # См. CLASS_ATTR_RE
+TABLE_LABEL_BYTES_RE = re.compile('Т'.encode('utf8') + rb'\d+-\d+')                             # См. TABLE_LABEL_RE (только цифры ASCII)
+TABLE_SPACE_BYTES_RE = re.compile(TABLE_SPACE_PATTERN.encode('ascii'))                          # См. TABLE_SPACE_RE
+
+CLASS_NUM_MAX = 2**32 - 1     # Наибольший номер класса, хранимый в массиве (см. StyleTable)
+CLASS_NAME_FIRST_CHARS = 'abcdefghijklmnopqrstuvwxyz'                   # Символы коротких имен классов (см. iter_class_names)
+CLASS_NAME_CHARS = '0123456789abcdefghijklmnopqrstuvwxyz'
+LABEL_SLOT = -1      # Метка места подстановки номера таблицы в шаблоне таблицы
 
 # Глобальные параметры
-log = None           # Объект-логгер
+log = logging.getLogger(LOGGER_NAME)    # Объект-логгер (обработчики добавляются в configure_logging)
+_log_listener = None                     # Поток записи журнала из очереди (см. configure_logging)
+logging.addLevelName(LOG_SUMMARY, 'SUMMARY')
+_zip_archives = {}                       # Открытые zip-архивы с документами (см. get_zip_archive)
+_zip_archives_lock = threading.Lock()
+
+def is_zip_input(input_dir):
+    """
+    Проверка, что документы берутся из zip-архива: вместо рабочей директории передан путь к файлу *.zip
+    """
+    return input_dir.lower().endswith(ZIP_SUFFIX) and os.path.isfile(input_dir)
+
+def is_compressed_input(file_name, input_dir):
+    """
+    Проверка, что документ распаковывается при чтении (член zip-архива или файл *.gz):
+    отображение в память и чтение с произвольного места для него недоступны
+    """
+    return is_zip_input(input_dir) or file_name.lower().endswith(GZIP_SUFFIX)
+
+def get_zip_archive(archive_path):
+    """
+    Открытый zip-архив с документами. Архив открывается один раз в каждом процессе (оглавление считывается однократно)
+    и повторно - при изменении; члены архива можно читать одновременно из нескольких потоков
+    """
+    file_stat = os.stat(archive_path)
+    key = (os.getpid(), os.path.abspath(archive_path))
+    signature = (file_stat.st_size, file_stat.st_mtime_ns)
+    with _zip_archives_lock:
+        entry = _zip_archives.get(key)
+        if entry == None or entry[0] != signature:
+            if entry != None:
+                entry[1].close()
+            entry = (signature, zipfile.ZipFile(archive_path))
+            _zip_archives[key] = entry
+    return entry[1]
+
+def open_input(file_name, input_dir):
+    """
+    Открытие входного документа для чтения в двоичном режиме: файла в рабочей директории, файла *.gz
+    (распаковывается по мере чтения) или члена zip-архива (см. is_zip_input)
+    
+    Args:
+        file_name: имя файла (для zip-архива - имя члена архива)
+        input_dir: рабочая директория или путь к zip-архиву
+    """
+    if is_zip_input(input_dir):
+        return get_zip_archive(input_dir).open(file_name)
+    if file_name.lower().endswith(GZIP_SUFFIX):
+        return gzip.open(input_dir + '/' + file_name, 'rb')
+    return open(input_dir + '/' + file_name, 'rb')
+
+def open_input_text(file_name, input_dir):
+    """
+    Открытие входного документа для чтения в текстовом режиме (см. open_input)
+    """
+    if is_compressed_input(file_name, input_dir):
+        return io.TextIOWrapper(open_input(file_name, input_dir), encoding="utf8")
+    return open(input_dir + '/' + file_name, 'r', encoding="utf8")
+
+def input_signature(file_name, input_dir):
+    """
+    Размер и время изменения входного документа. Для файла *.gz - размер сжатого файла,
+    для члена zip-архива - размер после распаковки и число из времени изменения члена и его CRC-32
+    (изменение других членов архива не делает член измененным)
+    
+    Raises:
+        FileNotFoundError: документа нет
+    """
+    if is_zip_input(input_dir):
+        try:
+            info = get_zip_archive(input_dir).getinfo(file_name)
+        except KeyError:
+            raise FileNotFoundError('В архиве \'%s\' нет файла \'%s\'' % (input_dir, file_name))
+        return info.file_size, int('%04d%02d%02d%02d%02d%02d' % info.date_time)*2**32 + info.CRC
+    file_stat = os.stat(input_dir + '/' + file_name)
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+def open_output(target_path):
+    """
+    Открытие выходного файла для записи текста; файл *.gz сжимается gzip по мере записи
+    """
+    if target_path.lower().endswith(GZIP_SUFFIX):
+        return gzip.open(target_path, 'wt', encoding="utf8", compresslevel=GZIP_LEVEL)
+    return open(target_path, 'w', encoding="utf8")
+
+def read_content(file_name, input_dir):
+    """
+    Считывание документа с удалением пробельных символов в начале и конце строк
+    
+    Args:
+        file_name: имя файла
+        input_dir: рабочая директория
+        
+    Returns:
+        content: содержимое документа, строки объединены через '\\n'
+    """
+    with open_input_text(file_name, input_dir) as file:
+        return join_lines(file)
+
+def join_lines(file):
+    """
+    Объединение всех строк, считанных из файла, с удалением пробельных символов в начале и конце строк
+    
+    Args:
+        file: файл, открытый в текстовом режиме
+        
+    Returns:
+        content: строки файла, объединенные через '\\n'
+    """
+    return '\n'.join([line.strip() for line in file.readlines()])
+
+def extract_styles(content, file_name):
+    """
+    Извлечение классов css-стилей из содержимого документа
+    
+    Args:
+        content: содержимое документа (см. read_content)
+        file_name: имя файла (для сообщений об ошибках)
+        
+    Returns:
+        css_styles (StyleTable): стили документа, ведут себя как список кортежей (class_label, properties_text)
+    """
+    m = STYLE_BLOCK_RE.search(content)
+    if m == None:
+        raise TablesComposerException('Ошибка при считывании стилей для файла \'%s\'' % (file_name))
+    return parse_css_rules(m.group(1))
+
+class StyleTable:
+    """
+    Компактное представление стилей документа (см. extract_styles)
+    
+    Тексты свойств интернируются: одинаковые свойства стилей разных документов хранятся в одном экземпляре.
+    Имена классов FastReport s0, s1, ... по порядку не хранятся, другие имена вида s<N> хранятся номерами
+    в массиве, прочие - строками. Описание стилей CSS формируется только при записи (см. render_styles).
+    Для совместимости таблица ведет себя как список кортежей (class_label, properties_text)
+    """
+    __slots__ = ('bodies', 'labels')
+    
+    def __init__(self, labels, bodies):
+        """
+        Args:
+            labels: имена классов (список) или None - s0, s1, ... по порядку
+            bodies: свойства стилей
+        """
+        self.bodies = tuple(map(sys.intern, bodies))
+        self.labels = None if labels == None else _pack_labels(labels)
+    
+    def label(self, idx):
+        """
+        Имя класса с порядковым номером idx
+        """
+        if self.labels == None:
+            return 's%d' % (idx)
+        if isinstance(self.labels, array.array):
+            return 's%d' % (self.labels[idx])
+        return self.labels[idx]
+    
+    def class_index(self):
+        """
+        Returns:
+            class_index: {имя класса: порядковый номер класса в документе}, при повторном объявлении
+                класса - последний номер (см. compile_table)
+        """
+        return {self.label(idx): idx for idx in range(len(self.bodies))}
+    
+    def __len__(self):
+        return len(self.bodies)
+    
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self.bodies)
+        return self.label(idx), self.bodies[idx]
+    
+    def __iter__(self):
+        return ((self.label(idx), body) for idx, body in enumerate(self.bodies))
+    
+    def __eq__(self, other):
+        if isinstance(other, StyleTable):
+            return self.bodies == other.bodies and list(self) == list(other)
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+    
+    def __repr__(self):
+        return 'StyleTable(%r)' % (list(self))
+    
+    def __getstate__(self):
+        return self.labels, self.bodies
+    
+    def __setstate__(self, state):
+        # После передачи между процессами или чтения из кэша одинаковые свойства снова хранятся в одном экземпляре
+        labels, bodies = state
+        self.labels = labels
+        self.bodies = tuple(map(sys.intern, bodies))
+
+def _pack_labels(labels):
+    """
+    Компактное хранение имен классов (см. StyleTable)
+    
+    Returns:
+        None (имена s0, s1, ... по порядку), массив номеров (имена s<N>) или кортеж имен
+    """
+    if labels == list(map('s%d'.__mod__, range(len(labels)))):
+        return None
+    nums = array.array('L')
+    for label in labels:
+        digits = label[1:]
+        # Номер должен однозначно восстанавливаться в имя (без ведущих нулей)
+        if label[:1] != 's' or not (digits.isascii() and digits.isdigit()) or str(int(digits)) != digits or int(digits) > CLASS_NUM_MAX:
+            return tuple(labels)
+        nums.append(int(digits))
+    return nums
+
+def parse_css_rules(styles_content):
+    """
+    Выделение классов из блока стилей (служебный класс page_break пропускается)
+    
+    Args:
+        styles_content: содержимое блока <style>
+        
+    Returns:
+        css_styles (StyleTable): стили документа, ведут себя как список кортежей (class_label, properties_text)
+    """
+    rules = [rule for rule in CSS_RULE_RE.findall(styles_content) if rule[0] != 'page_break']
+    return StyleTable([class_label for class_label, _ in rules], [properties_text for _, properties_text in rules])
+
+def _append_text(parts, text, label_re=TABLE_LABEL_RE):
+    """
+    Добавление фрагмента текста в шаблон таблицы с выделением номеров таблиц в отдельные подстановки
+    """
+    pos = 0
+    for m in label_re.finditer(text):
+        parts.append(text[pos:m.start()])
+        parts.append(LABEL_SLOT)
+        pos = m.end()
+    parts.append(text[pos:])
+
+def compile_table(table_content, class_index):
+    """
+    Преобразование HTML-кода таблицы в шаблон, не зависящий от нумерации классов и таблиц
+    
+    Атрибуты class с известными именами классов и номера таблиц находятся за один проход по тексту
+    и заменяются подстановками, значения которых определяются при сборке документа (см. render_table).
+    
+    Args:
+        table_content: HTML-код таблицы, строка или байты в UTF-8 (тогда и текст шаблона - байты)
+        class_index: {имя класса: порядковый номер класса в документе}
+        
+    Returns:
+        parts (list): [текст, подстановка, текст, ..., подстановка, текст]
+            подстановка - номер класса в документе либо LABEL_SLOT
+    """
+    if isinstance(table_content, bytes):
+        class_attr_re, label_re = CLASS_ATTR_BYTES_RE, TABLE_LABEL_BYTES_RE
+    else:
+        class_attr_re, label_re = CLASS_ATTR_RE, TABLE_LABEL_RE
+    parts = []
+    pos = 0
+    for m in class_attr_re.finditer(table_content):
+        class_idx = class_index.get(m.group(1))
+        # Атрибуты с неизвестными классами оставляем без изменений
+        if class_idx == None:
+            continue
+        _append_text(parts, table_content[pos:m.start()], label_re)
+        parts.append(class_idx)
+        pos = m.end()
+    _append_text(parts, table_content[pos:], label_re)
+    return parts
+
+def extract_tables(content, css_styles, metrics=None):
+    """
+    Извлечение HTML-таблиц из содержимого документа в виде шаблонов (см. compile_table)
+    
+    Args:
+        content: содержимое документа (см. read_content)
+        css_styles: список стилей документа (см. extract_styles)
+        metrics: словарь метрик документа, в который записывается время замены классов (rewrite_time), или None
+        
+    Returns:
+        tables (list): список шаблонов таблиц
+    """
+    return compile_tables((m.group(1) for m in TABLE_RE.finditer(content)), css_styles, metrics)
+
+def compile_tables(tables_contents, css_styles, metrics=None):
+    """
+    Преобразование HTML-кода таблиц документа в шаблоны (см. compile_table)
+    
+    Args:
+        tables_contents: HTML-код таблиц (итерируемый объект)
+        css_styles: список стилей документа (см. extract_styles)
+        metrics: словарь метрик документа, в который записывается время замены классов (rewrite_time), или None
+        
+    Returns:
+        tables (list): список шаблонов таблиц
+    """
+    # При повторном объявлении класса используется последний номер (как и при поочередной замене с конца списка)
+    class_index = css_styles.class_index()
+    # Имена классов в байтах для таблиц, считанных без декодирования (см. scan_document_bytes)
+    class_index.update({label.encode('utf8'): i for label, i in list(class_index.items())})
+    if metrics == None:
+        return [compile_table(table_content, class_index) for table_content in tables_contents]
+    tables = []
+    rewrite_time = 0.0
+    for table_content in tables_contents:
+        start = time.perf_counter()
+        tables.append(compile_table(table_content, class_index))
+        rewrite_time += time.perf_counter() - start
+    metrics['rewrite_time'] = rewrite_time
+    return tables
+
+class DocumentScanner:
+    """
+    Разбор HTML-документа за один проход по строкам файла без сборки всего содержимого в одну строку:
+    сначала выделяется блок стилей (read_styles), затем по одной выдаются таблицы (iter_tables).
+    В памяти хранится только текст текущей таблицы
+    
+    Результат совпадает с поиском STYLE_BLOCK_RE и TABLE_RE по содержимому read_content. Если это нельзя
+    гарантировать (таблица до окончания блока стилей, несколько закрывающих тегов </style> - жадное
+    выражение для стилей захватывает текст до последнего из них), флаг exact сбрасывается и разбор
+    прекращается; документ в этом случае разбирается целиком (см. scan_document)
+    """
+    def __init__(self, file, file_name):
+        """
+        Args:
+            file: файл, открытый в текстовом режиме
+            file_name: имя файла (для сообщений об ошибках)
+        """
+        self.lines = (line.strip() for line in file)
+        self.file_name = file_name
+        self.exact = True
+    
+    def read_styles(self):
+        """
+        Выделение классов из блока стилей. Чтение прекращается на строке с закрывающим тегом блока
+        
+        Returns:
+            css_styles (list): список стилей (см. extract_styles) или None, если флаг exact сброшен
+        """
+        head = []
+        for line in self.lines:
+            if line.find('<table') != -1:
+                self.exact = False
+                return None
+            head.append(line)
+            if line.find('</style>') != -1:
+                m = STYLE_BLOCK_RE.search('\n'.join(head))
+                if m != None:
+                    return parse_css_rules(m.group(1))
+        # Документ прочитан целиком, таблиц и блока стилей в нем нет
+        raise TablesComposerException('Ошибка при считывании стилей для файла \'%s\'' % (self.file_name))
+    
+    def iter_tables(self):
+        """
+        Поиск таблиц в оставшейся после блока стилей части документа
+        
+        Yields:
+            table_content: HTML-код очередной таблицы
+        """
+        pending = None    # Строки, начиная с возможного начала таблицы
+        for line in self.lines:
+            if line.find('</style>') != -1:
+                self.exact = False
+                return
+            if pending == None:
+                pos = line.find('<table')
+                if pos == -1:
+                    continue
+                pending = [line[pos:]]
+            else:
+                pending.append(line)
+            # Закрывающий тег не может быть разбит между строками
+            if line.find('</table>') == -1:
+                continue
+            text = '\n'.join(pending)
+            pos = 0
+            while pos != -1:
+                # Границы открывающего тега известны только после следующего символа '<'
+                if text.find('<', pos + 1) == -1:
+                    break
+                tag = TABLE_TAG_RE.match(text, pos)
+                if tag == None:
+                    pos = text.find('<table', pos + 1)
+                    continue
+                end = text.find('</table>', tag.end() + 1)
+                if end == -1:
+                    break
+                yield text[pos:end + len('</table>')]
+                pos = text.find('<table', end + len('</table>'))
+            pending = None if pos == -1 else [text[pos:]]
+        if pending != None:
+            # Незавершенная таблица в конце документа разбирается так же, как в extract_tables
+            for m in TABLE_RE.finditer('\n'.join(pending)):
+                yield m.group(1)
+
+def scan_document(file, file_name, metrics=None):
+    """
+    Разбор документа: выделение стилей и таблиц за один проход по файлу (см. DocumentScanner)
+    
+    Args:
+        file: файл, открытый в текстовом режиме (с возможностью перемещения в начало)
+        file_name: имя файла (для сообщений об ошибках)
+        metrics: словарь метрик документа (время выделения стилей и таблиц) или None
+        
+    Returns:
+        tuple (css_styles, tables)
+        css_styles: список стилей (см. extract_styles)
+        tables: список шаблонов таблиц (см. compile_tables)
+    """
+    if metrics == None:
+        metrics = {}
+    start = time.perf_counter()
+    scanner = DocumentScanner(file, file_name)
+    css_styles = scanner.read_styles()
+    metrics['styles_time'] = time.perf_counter() - start
+    start = time.perf_counter()
+    if css_styles != None:
+        tables = compile_tables(scanner.iter_tables(), css_styles, metrics)
+    if not scanner.exact:
+        # Структура документа требует поиска по всему содержимому
+        file.seek(0)
+        content = join_lines(file)
+        css_styles = extract_styles(content, file_name)
+        tables = extract_tables(content, css_styles, metrics)
+    metrics['tables_time'] = time.perf_counter() - start - metrics.get('rewrite_time', 0.0)
+    return css_styles, tables
+
+def _strip_bytes(line):
+    """
+    Удаление пробельных символов в начале и конце строки в UTF-8 (аналог str.strip())
+    """
+    line = line.strip(ASCII_SPACES_BYTES)
+    while line.startswith(UNICODE_SPACES_BYTES) or line.endswith(UNICODE_SPACES_BYTES):
+        for space in UNICODE_SPACES_BYTES:
+            if line.startswith(space):
+                line = line[len(space):]
+            if line.endswith(space):
+                line = line[:-len(space)]
+        line = line.strip(ASCII_SPACES_BYTES)
+    return line
+
+def join_lines_bytes(data, unicode_spaces=True):
+    """
+    Объединение строк фрагмента документа в UTF-8 с удалением пробельных символов в начале и конце строк (см. join_lines)
+    
+    Args:
+        data: фрагмент документа (bytes)
+        unicode_spaces (boolean): во фрагменте могут быть многобайтные пробельные символы (см. has_unicode_spaces)
+        
+    Returns:
+        content: строки фрагмента, объединенные через b'\\n'
+    """
+    lines = [line.strip(ASCII_SPACES_BYTES) for line in data.replace(b'\r\n', b'\n').replace(b'\r', b'\n').split(b'\n')]
+    if unicode_spaces:
+        lines = [_strip_bytes(line) for line in lines]
+    return b'\n'.join(lines)
+
+def has_unicode_spaces(data):
+    """
+    Проверка наличия в документе многобайтных пробельных символов (например, неразрывного пробела).
+    Они встречаются редко, без них строки обрабатываются быстрее (см. join_lines_bytes)
+    
+    Args:
+        data: содержимое документа (bytes или mmap.mmap)
+    """
+    if all(data.find(lead) == -1 for lead in UNICODE_SPACES_LEAD_BYTES):
+        return False
+    return UNICODE_SPACE_BYTES_RE.search(data) != None
+
+def map_file(file):
+    """
+    Отображение файла в память только для чтения
+    
+    Args:
+        file: файл, открытый в двоичном режиме
+        
+    Returns:
+        data: mmap.mmap (для пустого файла - b'', т.к. его нельзя отобразить)
+    """
+    if os.fstat(file.fileno()).st_size == 0:
+        return b''
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def iter_table_spans(data):
+    """
+    Поиск таблиц в документе в байтах (совпадения те же, что у TABLE_RE, см. DocumentScanner.iter_tables)
+    
+    Args:
+        data: содержимое документа (bytes или mmap.mmap)
+        
+    Yields:
+        tuple (start, end): границы HTML-кода очередной таблицы в байтах
+    """
+    pos = data.find(b'<table')
+    while pos != -1:
+        tag = TABLE_TAG_BYTES_RE.match(data, pos)
+        if tag == None:
+            pos = data.find(b'<table', pos + 1)
+            continue
+        end = data.find(b'</table>', tag.end() + 1)
+        if end == -1:
+            # Незавершенная таблица в конце документа разбирается регулярным выражением
+            for m in TABLE_BYTES_RE.finditer(data, pos):
+                yield m.span(1)
+            return
+        yield pos, end + len(b'</table>')
+        pos = data.find(b'<table', end + len(b'</table>'))
+
+def iter_tables_bytes(data):
+    """
+    Поиск таблиц в документе в байтах (см. iter_table_spans)
+    
+    Yields:
+        table_content: HTML-код очередной таблицы (bytes, без обработки переводов строк)
+    """
+    for start, end in iter_table_spans(data):
+        yield data[start:end]
+
+def read_styles_bytes(data, file_name, head_end=None):
+    """
+    Выделение классов из блока стилей документа в байтах, декодируется только блок стилей
+    
+    Args:
+        data: содержимое документа (bytes или mmap.mmap)
+        file_name: имя файла (для сообщений об ошибках)
+        head_end: конец блока стилей в байтах (после '</style>'), если известен (см. scan_file); 0 - блока стилей нет
+        
+    Returns:
+        css_styles (list): список стилей (см. extract_styles)
+    """
+    if head_end == None:
+        # Блок стилей заканчивается последним '</style>' в документе (см. STYLE_BLOCK_RE)
+        style_end = data.rfind(b'</style>')
+        head_end = 0 if style_end == -1 else style_end + len(b'</style>')
+    head = '' if head_end == 0 else join_lines_bytes(data[:head_end]).decode('utf8')
+    return extract_styles(head, file_name)
+
+def compile_tables_bytes(data, css_styles, metrics=None):
+    """
+    Выделение таблиц документа (или его части, см. parse_document_chunk) в байтах и преобразование их в шаблоны
+    
+    Args:
+        data: содержимое документа (bytes или mmap.mmap)
+        css_styles: список стилей документа (см. extract_styles)
+        metrics: словарь метрик документа или None
+        
+    Returns:
+        tables (list): список шаблонов таблиц с текстом в байтах (см. compile_tables)
+    """
+    unicode_spaces = has_unicode_spaces(data)
+    return compile_tables((join_lines_bytes(table_content, unicode_spaces) for table_content in iter_tables_bytes(data)), css_styles, metrics)
+
+def scan_document_bytes(data, file_name, metrics=None):
+    """
+    Разбор документа в UTF-8 без декодирования всего содержимого (результат тот же, что у scan_document).
+    Декодируется только блок стилей, таблицы выделяются и преобразуются в шаблоны в байтах:
+    переводы строк и пробельные символы по краям строк обрабатываются так же, как при чтении
+    в текстовом режиме, а границы таблиц и блока стилей от этой обработки не зависят
+    
+    Args:
+        data: содержимое документа (bytes или mmap.mmap, см. map_file)
+        file_name: имя файла (для сообщений об ошибках)
+        metrics: словарь метрик документа (время выделения стилей и таблиц) или None
+        
+    Returns:
+        tuple (css_styles, tables)
+        css_styles: список стилей (см. extract_styles)
+        tables: список шаблонов таблиц с текстом в байтах (см. compile_tables)
+    """
+    if metrics == None:
+        metrics = {}
+    start = time.perf_counter()
+    css_styles = read_styles_bytes(data, file_name)
+    metrics['styles_time'] = time.perf_counter() - start
+    start = time.perf_counter()
+    tables = compile_tables_bytes(data, css_styles, metrics)
+    metrics['tables_time'] = time.perf_counter() - start - metrics.get('rewrite_time', 0.0)
+    return css_styles, tables
+
+def render_styles(css_styles, class_num_start):
+    """
+    Формирование описания стилей CSS документа для вставки в общий документ
+    
+    Args:
+        css_styles: список стилей документа (см. extract_styles)
+        class_num_start: номер класса стилей, с которого начинать нумерацию
+        
+    Returns:
+        styles_content: строка с описанием стилей CSS
+    """
+    # Корректируем имена классов (продолжаем нумерацию относительно предыдущего документа)
+    # Формат имен классов: s1, s2, ...
+    return ''.join(['.s%d {%s}\n' % (class_num_start + i, css_props) for i, css_props in enumerate(css_styles.bodies)])
+
+def render_table(parts, slot_values):
+    """
+    Сборка HTML-кода таблицы по шаблону
+    
+    Args:
+        parts: шаблон таблицы (см. compile_table)
+        slot_values: значения подстановок; номер таблицы - последний элемент списка (индекс LABEL_SLOT)
+        
+    Returns:
+        table_content: HTML-код таблицы
+    """
+    output = [parts[0]]
+    for i in range(1, len(parts), 2):
+        output.append(slot_values[parts[i]])
+        output.append(parts[i+1])
+    # Текст шаблона может быть в байтах (см. scan_document_bytes)
+    return parts[0][:0].join(output)
+
+def render_tables(tables, class_nums, document_num, class_names=None, table_num_start=1):
+    """
+    Сборка HTML-кода таблиц документа для вставки в общий документ
+    
+    Args:
+        tables: список шаблонов таблиц (см. extract_tables)
+        class_nums: номера классов в общем документе для каждого класса стилей документа
+            (например, range(class_num_start, class_num_start + classes_count))
+        document_num: номер документа (используется для нумерации таблиц)
+        class_names: имена классов в общем документе по номерам (см. minify_styles) или None - имена s<номер>
+        table_num_start: номер первой таблицы (для документа, таблицы которого записываются в несколько томов, см. write_volume)
+        
+    Returns:
+        tables_content: строка с HTML-кодом таблиц с исправленными номерами стилей и таблиц
+            (байты в UTF-8, если шаблоны получены без декодирования, см. scan_document_bytes)
+    """
+    if class_names == None:
+        slot_values = ['class="s%d"' % (class_num) for class_num in class_nums]
+    else:
+        # Классы, не используемые в таблицах документа, в общем документе не объявляются
+        slot_values = ['class="%s"' % (class_names.get(class_num, '')) for class_num in class_nums]
+    slot_values.append('')
+    as_bytes = len(tables) > 0 and isinstance(tables[0][0], bytes)
+    if as_bytes:
+        slot_values = [slot_value.encode('utf8') for slot_value in slot_values]
+    tables_content = []
+    for table_num, parts in enumerate(tables, table_num_start):
+        # Исправление номера таблицы
+        label = 'T%d-%d' % (document_num, table_num)
+        slot_values[LABEL_SLOT] = label.encode('utf8') if as_bytes else label
+        tables_content.append(render_table(parts, slot_values))
+    return b''.join(tables_content) if as_bytes else ''.join(tables_content)
+
+def iter_class_names():
+    """
+    Короткие имена классов для сжатого выходного документа в порядке увеличения длины: a, ..., z, a0, ..., zz, a00, ...
+    Используются только строчные буквы, т.к. в режиме совместимости (quirks mode, см. HTML_HEADER)
+    имена классов не чувствительны к регистру
+    
+    Yields:
+        class_name: имя класса
+    """
+    for length in itertools.count():
+        for first_char in CLASS_NAME_FIRST_CHARS:
+            for chars in itertools.product(CLASS_NAME_CHARS, repeat=length):
+                yield first_char + ''.join(chars)
+
+def minify_css_properties(properties_text):
+    """
+    Сокращенная запись свойств стиля: без пробелов вокруг ':' и ';' (см. normalize_css_properties)
+    """
+    return normalize_css_properties(properties_text).replace(': ', ':').replace('; ', ';')
+
+def document_class_usage(tables):
+    """
+    Подсчет использования классов документа по подстановкам шаблонов таблиц без сборки текста
+    
+    Args:
+        tables: шаблоны таблиц документа (см. compile_table)
+        
+    Returns:
+        usage (collections.Counter): {порядковый номер класса в документе: количество использований}
+    """
+    slots = collections.Counter(itertools.chain.from_iterable(parts[1::2] for parts in tables))
+    slots.pop(LABEL_SLOT, None)
+    return slots
+
+def count_class_usage(all_css_styles, documents, all_class_nums, class_usage=None):
+    """
+    Подсчет использования классов общего документа в таблицах документов
+    
+    Args:
+        all_css_styles, all_class_nums: см. minify_styles
+        documents: результаты обработки документов (используются только шаблоны таблиц, tables)
+        class_usage: использование классов каждого документа, подсчитанное заранее (см. read_class_usage),
+            или None - подсчет по шаблонам таблиц documents (см. document_class_usage)
+        
+    Returns:
+        tuple (usage, properties, documents_usage)
+        usage (collections.Counter): {номер класса в общем документе: количество использований}
+        properties: {номер используемого класса: свойства стиля}
+        documents_usage: для каждого документа - {номер класса: количество использований в документе}
+    """
+    if class_usage == None:
+        class_usage = (document_class_usage(document['tables']) for document in documents)
+    usage = collections.Counter()
+    properties = {}
+    documents_usage = []
+    for idx, slots in enumerate(class_usage):
+        document_usage = {}
+        for class_idx, count in slots.items():
+            class_num = all_class_nums[idx][class_idx]
+            document_usage[class_num] = document_usage.get(class_num, 0) + count
+            properties.setdefault(class_num, all_css_styles[idx].bodies[class_idx])
+        usage.update(document_usage)
+        documents_usage.append(document_usage)
+    return usage, properties, documents_usage
+
+def minify_styles(all_css_styles, documents, all_class_nums, class_usage=None):
+    """
+    Подготовка блока стилей сжатого выходного документа: объявляются только классы, используемые в таблицах,
+    классам назначаются короткие имена (самым используемым - самые короткие, см. iter_class_names)
+    
+    Args:
+        all_css_styles: списки стилей документов (см. extract_styles)
+        documents: результаты обработки документов (см. parse_document)
+        all_class_nums: для каждого документа - номера классов в общем документе для каждого класса стилей документа
+        class_usage: использование классов каждого документа или None (см. count_class_usage)
+        
+    Returns:
+        dict {styles_content, class_names, names_saved, keep_spaces}
+        styles_content: описание используемых классов CSS
+        class_names: {номер класса в общем документе: короткое имя} (см. iter_class_names)
+        names_saved: для каждого документа - сокращение объема таблиц за счет коротких имен, символов
+        keep_spaces: в стилях задано свойство white-space, пробельные символы в таблицах не удаляются (см. minify_tables)
+    """
+    usage, properties, documents_usage = count_class_usage(all_css_styles, documents, all_class_nums, class_usage)
+    class_names = {class_num: class_name for (class_num, _), class_name in zip(usage.most_common(), iter_class_names())}
+    minified_properties = {}    # Свойства стилей интернированы, одинаковые тексты сокращаются один раз
+    for body in set(properties.values()):
+        minified_properties[body] = minify_css_properties(body)
+    styles_content = ''.join(['.%s{%s}' % (class_names[class_num], minified_properties[properties[class_num]]) for class_num in sorted(class_names)])
+    name_saved = {class_num: len('s%d' % (class_num)) - len(class_name) for class_num, class_name in class_names.items()}
+    names_saved = [sum(count*name_saved[class_num] for class_num, count in document_usage.items()) for document_usage in documents_usage]
+    return {'styles_content': styles_content, 'class_names': class_names, 'names_saved': names_saved,
+            'keep_spaces': any('white-space' in body for body in minified_properties.values())}
+
+def minify_tables(tables_content):
+    """
+    Удаление пробельных символов между тегом и следующим за ним тегом структуры таблицы (ячейки, строки и т.п.).
+    Такие символы находятся либо между ячейками и строками, либо в конце ячейки и не отображаются.
+    Если в HTML-коде задано свойство white-space (пробелы могут отображаться), код не изменяется
+    
+    Args:
+        tables_content: HTML-код таблиц, строка или байты в UTF-8 (см. render_tables)
+        
+    Returns:
+        tables_content: HTML-код таблиц без лишних пробельных символов
+    """
+    if isinstance(tables_content, bytes):
+        return tables_content if b'white-space' in tables_content else TABLE_SPACE_BYTES_RE.sub(b'>', tables_content)
+    return tables_content if 'white-space' in tables_content else TABLE_SPACE_RE.sub('>', tables_content)
+
+def normalize_css_properties(properties_text):
+    """
+    Приведение описания свойств стиля к каноническому виду для сравнения стилей разных документов:
+    имена свойств в нижнем регистре, лишние пробелы и пустые объявления удаляются.
+    Порядок свойств сохраняется, т.к. от него зависит результат для сокращенных свойств
+    
+    Args:
+        properties_text: свойства стиля
+        
+    Returns:
+        normalized_text: свойства стиля в каноническом виде
+    """
+    declarations = []
+    for declaration in properties_text.split(';'):
+        name, _, value = declaration.partition(':')
+        name = name.strip().lower()
+        if name:
+            declarations.append('%s: %s' % (name, ' '.join(value.split())))
+    return '; '.join(declarations)
+
+def dedup_styles(all_css_styles, class_num_start=1):
+    """
+    Объединение одинаковых стилей всех документов: стилям с совпадающими (после нормализации, см.
+    normalize_css_properties) свойствами назначается один общий класс
+    
+    Args:
+        all_css_styles: списки стилей всех документов (см. extract_styles)
+        class_num_start: номер первого класса
+        
+    Returns:
+        tuple (unique_styles, all_class_nums)
+        unique_styles (StyleTable): уникальные стили в порядке первого появления
+        all_class_nums: для каждого документа - номера общих классов для каждого класса стилей документа
+    """
+    class_num_by_properties = {}
+    class_num_by_body = {}    # Нормализация выполняется один раз для каждого текста свойств (тексты интернированы, см. StyleTable)
+    unique_labels = []
+    unique_bodies = []
+    all_class_nums = []
+    for css_styles in all_css_styles:
+        class_nums = []
+        for idx, body in enumerate(css_styles.bodies):
+            class_num = class_num_by_body.get(body)
+            if class_num == None:
+                key = normalize_css_properties(body)
+                class_num = class_num_by_properties.get(key)
+                if class_num == None:
+                    class_num = class_num_start + len(unique_bodies)
+                    class_num_by_properties[key] = class_num
+                    unique_labels.append(css_styles.label(idx))
+                    unique_bodies.append(body)
+                class_num_by_body[body] = class_num
+            class_nums.append(class_num)
+        all_class_nums.append(class_nums)
+    return StyleTable(unique_labels, unique_bodies), all_class_nums
+
+def read_styles(file_name, input_dir):
+    """
+        Извлечение названий классов css-стилей из документа
+        
+        Args:
+            file_name: имя файла
+            input_dir: рабочая директория
+            
+        Returns:
+            css_styles (tuple): список стилей, содержит
+                class_label: имя класса
+                properties_text: свойства стиля
+    """
+    
+    log.info('чтение стилей из файла \'%s\'', file_name)
+    css_styles = extract_styles(read_content(file_name, input_dir), file_name)
+    log.info('файл \'%s\' обработан', file_name)
+    return css_styles 
+
+def read_style_block(file_name, input_dir):
+    """
+    Извлечение классов css-стилей из начала документа без чтения таблиц.
+    Чтение файла прекращается на первом закрывающем теге </style> после блока стилей
+    
+    Args:
+        file_name: имя файла
+        input_dir: рабочая директория
+        
+    Returns:
+        css_styles (list): список стилей, см. extract_styles
+    """
+    with open_input_text(file_name, input_dir) as file:
+        css_styles = DocumentScanner(file, file_name).read_styles()
+        if css_styles == None:
+            file.seek(0)
+            css_styles = extract_styles(join_lines(file), file_name)
+    return css_styles
+
+def read_class_usage(file_name, input_dir):
+    """
+    Считывание стилей документа и подсчет использования классов в таблицах без построения шаблонов таблиц
+    (результат тот же, что у document_class_usage для шаблонов parse_document). Используется в потоковом режиме
+    со сжатием вместо read_style_block: используемые классы нужны для шапки до обработки документов
+    
+    Args:
+        file_name: имя файла
+        input_dir: рабочая директория
+        
+    Returns:
+        tuple (css_styles, usage)
+        css_styles: список стилей (см. extract_styles)
+        usage (collections.Counter): {порядковый номер класса в документе: количество использований}
+    """
+    with open_input(file_name, input_dir) as file:
+        # Документ отображается в память (кроме сжатых), таблицы просматриваются в байтах (см. iter_table_spans)
+        data = file.read() if is_compressed_input(file_name, input_dir) else map_file(file)
+        try:
+            css_styles = read_styles_bytes(data, file_name)
+            # Атрибуты class находятся тем же регулярным выражением, что и при построении шаблонов (см. compile_table);
+            # обработка пробельных символов по краям строк на совпадения с именами классов не влияет
+            class_index = {label.encode('utf8'): idx for label, idx in css_styles.class_index().items()}
+            usage = collections.Counter()
+            for start, end in iter_table_spans(data):
+                for m in CLASS_ATTR_BYTES_RE.finditer(data, start, end):
+                    class_idx = class_index.get(m.group(1))
+                    if class_idx != None:
+                        usage[class_idx] += 1
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+    return css_styles, usage
+
+def parse_document(file_name, input_dir, cache=None, submit_time=None, use_mmap=False):
+    """
+    Обработка одного HTML-документа за один проход: выделение стилей и таблиц.
+    Результат не зависит от положения документа в общем документе, номера классов
+    и таблиц подставляются при сборке (см. render_document)
+    
+    Args:
+        file_name: имя файла
+        input_dir: рабочая директория
+        cache: кэш обработанных документов (DocumentCache) или None
+        submit_time: время передачи задачи исполнителю (time.time()) для расчета времени ожидания в очереди
+        use_mmap (boolean): отображать файл в память и разбирать его без декодирования (см. scan_document_bytes);
+            сжатые документы (см. is_compressed_input) всегда распаковываются и разбираются по мере чтения
+        
+    Returns:
+        dict {file_name, css_styles, tables, cached, metrics}
+        file_name: имя файла
+        css_styles: список стилей документа (см. extract_styles)
+        tables: список шаблонов таблиц (см. extract_tables)
+        cached: флаг получения результата из кэша
+        metrics: метрики обработки документа (время этапов в секундах, объем в байтах)
+    """
+    
+    metrics = {'file_name': file_name,
+               'queue_wait': 0.0 if submit_time == None else max(0.0, time.time() - submit_time),
+               'read_time': 0.0, 'styles_time': 0.0, 'tables_time': 0.0, 'rewrite_time': 0.0, 'cache_time': 0.0}
+    log.info('Начало обработки файла \'%s\'', file_name)
+    signature = input_signature(file_name, input_dir)
+    metrics['bytes_in'] = signature[0]
+    use_mmap = use_mmap and not is_compressed_input(file_name, input_dir)
+    if cache == None and not use_mmap:
+        # Чтение файла совмещено с разбором (время чтения входит в styles_time и tables_time)
+        with open_input_text(file_name, input_dir) as file:
+            css_styles, tables = scan_document(file, file_name, metrics)
+    else:
+        with open_input(file_name, input_dir) as file:
+            start = time.perf_counter()
+            data = map_file(file) if use_mmap else file.read()
+            metrics['read_time'] = time.perf_counter() - start
+            try:
+                if cache != None:
+                    start = time.perf_counter()
+                    cache_key = cache.make_key(data, signature)
+                    entry = cache.load(cache_key)
+                    metrics['cache_time'] = time.perf_counter() - start
+                    if entry != None:
+                        metrics.update({'tables': len(entry['tables']), 'classes': len(entry['css_styles']), 'cached': True})
+                        log.info('Файл \'%s\' взят из кэша. Стилей: %d, таблиц: %d', file_name, len(entry['css_styles']), len(entry['tables']))
+                        return {'file_name': file_name, 'css_styles': entry['css_styles'], 'tables': entry['tables'], 'cached': True, 'metrics': metrics}
+                # Содержимое уже считано для расчета хэша, повторно файл не открывается
+                if use_mmap:
+                    css_styles, tables = scan_document_bytes(data, file_name, metrics)
+                else:
+                    css_styles, tables = scan_document(io.TextIOWrapper(io.BytesIO(data), encoding="utf8"), file_name, metrics)
+            finally:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+    if cache != None:
+        start = time.perf_counter()
+        cache.store(cache_key, {'css_styles': css_styles, 'tables': tables})
+        metrics['cache_time'] += time.perf_counter() - start
+    metrics.update({'tables': len(tables), 'classes': len(css_styles), 'cached': False})
+    log.info('Завершение обработки файла \'%s\'. Стилей: %d, таблиц: %d', file_name, len(css_styles), len(tables))
+    
+    return {'file_name': file_name, 'css_styles': css_styles, 'tables': tables, 'cached': False, 'metrics': metrics}
+
+def split_document(file_name, input_dir, chunk_bytes, scan_entry=None):
+    """
+    Разбиение документа на части по границам таблиц для параллельной обработки (см. parse_document_chunk).
+    Выполняется только поиск границ таблиц без преобразования их текста
+    
+    Args:
+        file_name: имя файла
+        input_dir: рабочая директория
+        chunk_bytes: примерный размер части, байт
+        scan_entry: результат просмотра документа (см. scan_file) - границы блока стилей и таблиц берутся из него без поиска
+        
+    Returns:
+        dict {file_name, css_styles, chunks, bytes_in, split_time}
+        css_styles: список стилей документа (см. extract_styles)
+        chunks: границы частей в байтах, список кортежей (start, end); каждая часть содержит целые таблицы
+        bytes_in: размер файла, байт
+        split_time: время разбиения, сек
+    """
+    start_time = time.perf_counter()
+    chunks = []
+    with open(input_dir + '/' + file_name, 'rb') as file:
+        data = map_file(file)
+        try:
+            if scan_entry == None:
+                css_styles = read_styles_bytes(data, file_name)
+                table_spans = iter_table_spans(data)
+            else:
+                css_styles = read_styles_bytes(data, file_name, 0 if scan_entry['style_span'] == None else scan_entry['style_span'][1])
+                table_spans = scan_entry['tables']
+            chunk_start = None
+            for start, end in table_spans:
+                if chunk_start == None:
+                    chunk_start = start
+                if end - chunk_start >= chunk_bytes:
+                    chunks.append((chunk_start, end))
+                    chunk_start = None
+            if chunk_start != None:
+                chunks.append((chunk_start, end))
+            bytes_in = len(data)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+    return {'file_name': file_name, 'css_styles': css_styles, 'chunks': chunks, 'bytes_in': bytes_in,
+            'split_time': time.perf_counter() - start_time}
+
+def parse_document_chunk(file_name, input_dir, start, end, css_styles, submit_time=None):
+    """
+    Обработка части документа (см. split_document): преобразование таблиц в шаблоны.
+    Таблицы обрабатываются в байтах (см. scan_document_bytes), номера таблиц подставляются
+    при сборке всего документа, поэтому от положения части в документе результат не зависит
+    
+    Args:
+        file_name: имя файла
+        input_dir: рабочая директория
+        start, end: границы части в байтах
+        css_styles: список стилей документа
+        submit_time: время передачи задачи исполнителю (time.time())
+        
+    Returns:
+        dict {file_name, tables, metrics}
+    """
+    metrics = {'queue_wait': 0.0 if submit_time == None else max(0.0, time.time() - submit_time)}
+    log.debug('Обработка части файла \'%s\' (байты %d-%d)', file_name, start, end)
+    start_time = time.perf_counter()
+    with open(input_dir + '/' + file_name, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    metrics['read_time'] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    tables = compile_tables_bytes(data, css_styles, metrics)
+    metrics['tables_time'] = time.perf_counter() - start_time - metrics['rewrite_time']
+    return {'file_name': file_name, 'tables': tables, 'metrics': metrics}
+
+def join_document_chunks(split, chunk_results):
+    """
+    Объединение результатов обработки частей документа в результат обработки документа (см. parse_document)
+    
+    Args:
+        split: результат разбиения документа (см. split_document)
+        chunk_results: результаты обработки частей в порядке их следования (см. parse_document_chunk)
+        
+    Returns:
+        dict {file_name, css_styles, tables, cached, metrics}
+    """
+    tables = []
+    metrics = {'file_name': split['file_name'], 'styles_time': split['split_time'], 'cache_time': 0.0}
+    for key in ('queue_wait', 'read_time', 'tables_time', 'rewrite_time'):
+        metrics[key] = sum(chunk_result['metrics'][key] for chunk_result in chunk_results)
+    for chunk_result in chunk_results:
+        tables += chunk_result['tables']
+    metrics.update({'bytes_in': split['bytes_in'], 'tables': len(tables), 'classes': len(split['css_styles']),
+                    'cached': False, 'chunks': len(chunk_results)})
+    log.info('Завершение обработки файла \'%s\' (частей: %d). Стилей: %d, таблиц: %d', split['file_name'], len(chunk_results), len(split['css_styles']), len(tables))
+    return {'file_name': split['file_name'], 'css_styles': split['css_styles'], 'tables': tables, 'cached': False, 'metrics': metrics}
+
+def run_document_task(phase, fn, *args, **kwargs):
+    """
+    Выполнение задачи обработки документа (fn, первый аргумент - имя файла): любая ошибка
+    передается как DocumentException с именем файла и этапом обработки
+    """
+    try:
+        return fn(*args, **kwargs)
+    except DocumentException:
+        raise
+    except Exception as exc:
+        raise DocumentException(args[0], phase, exc if isinstance(exc, TablesComposerException) else '%s: %s' % (type(exc).__name__, exc))
+
+def failed_document(exc, css_styles=None):
+    """
+    Результат обработки документа, пропущенного из-за ошибки (см. compose_astra_html_tables, skip_bad):
+    таблиц нет, номер документа и известные стили сохраняются, поэтому номера таблиц и классов остальных документов не меняются
+    
+    Args:
+        exc: ошибка обработки документа (DocumentException)
+        css_styles: стили документа, если они считаны, или None
+        
+    Returns:
+        dict {file_name, css_styles, tables, cached, error, metrics}, error - {phase, message}
+    """
+    css_styles = StyleTable(None, []) if css_styles == None else css_styles
+    error = {'phase': exc.phase, 'message': exc.message}
+    return {'file_name': exc.file_name, 'css_styles': css_styles, 'tables': [], 'cached': False, 'error': error,
+            'metrics': {'file_name': exc.file_name, 'bytes_in': 0, 'tables': 0, 'classes': len(css_styles), 'cached': False, 'error': error}}
+
+def iter_documents(task_results, splits):
+    """
+    Сборка результатов обработки документов из результатов задач (целых документов и частей документов)
+    
+    Args:
+        task_results: результаты задач в порядке следования документов и их частей (для пропущенных - см. failed_document)
+        splits: для каждого документа - результат разбиения (см. split_document) или None, если документ не разбивался
+        
+    Yields:
+        document: результат обработки очередного документа (см. parse_document)
+    """
+    task_results = iter(task_results)
+    for split in splits:
+        if split == None:
+            yield next(task_results)
+            continue
+        chunk_results = [next(task_results) for _ in split['chunks']]
+        failed = [chunk_result for chunk_result in chunk_results if 'error' in chunk_result]
+        if len(failed) > 0:
+            # Документ пропускается целиком, стили известны после разбиения
+            yield failed_document(DocumentException(split['file_name'], failed[0]['error']['phase'], failed[0]['error']['message']), split['css_styles'])
+        else:
+            yield join_document_chunks(split, chunk_results)
+
+def render_document(document, class_num_start, document_num=1):
+    """
+    Сборка фрагментов общего документа из результата parse_document
+    
+    Args:
+        document: результат parse_document
+        class_num_start: номер класса стилей, с которого начинать нумерацию
+        document_num: номер документа (используется для нумерации таблиц)
+        
+    Returns:
+        dict {styles_content, tables_content, tables_count}, см. parse_file
+    """
+    css_styles = document['css_styles']
+    tables = document['tables']
+    return {'styles_content': render_styles(css_styles, class_num_start),
+            'tables_content': render_tables(tables, range(class_num_start, class_num_start + len(css_styles)), document_num),
+            'tables_count': len(tables)}
+
+def parse_file(file_name, input_dir, css_styles, class_num_start, document_num=1):
+    """
+    Обработка одного HTML-документа. Выделение стилей и таблиц
+    
+    Args:
+        file_name: имя файла
+        input_dir: рабочая директория
+        css_styles: список стилей документа (см. read_styles)
+        class_num_start: номер класса стилей, с которого начинать нумерацию
+        document_num: номер документа (используется для нумерации таблиц)        
+        
+    Returns:
+        dict {styles_content, tables_content, tables_count}
+        styles_content: строка с описанием стилей CSS, подготовленная для вставки в общий документ
+        tables_content: строка с описанием HTML-таблиц из текущего документа с исправленными номерами стилей для вставки в общий документ
+        tables_count: количество таблиц в данном документе
+    """
+    
+    log.info('Начало обработки файла \'%s\'', file_name)
+    content = read_content(file_name, input_dir)
+    extract_styles(content, file_name)    # Проверка наличия блока стилей
+    document = {'file_name': file_name, 'css_styles': css_styles, 'tables': extract_tables(content, css_styles)}
+    data = render_document(document, class_num_start, document_num)
+    log.info('Завершение обработки файла \'%s\'. Стилей: %d, таблиц: %d', file_name, len(css_styles), data['tables_count'])
+    
+    return data
+    
+class DocumentCache:
+    """
+    Дисковый кэш результатов обработки документов (см. parse_document)
+    
+    Ключ записи - хэш содержимого, размер и время изменения файла. Записи не зависят от номеров
+    классов и положения документа, поэтому при повторном объединении заново обрабатываются только
+    измененные файлы. Размер кэша ограничивается удалением давно не использованных записей (см. evict).
+    Записи сохраняются атомарно, кэш можно использовать из нескольких потоков и процессов
+    """
+    def __init__(self, cache_dir, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+        """
+        Args:
+            cache_dir: директория кэша (создается при необходимости)
+            max_size_mb: максимальный размер кэша, МБ
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb*1024*1024
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+    
+    def make_key(self, data, signature):
+        """
+        Формирование ключа записи
+        
+        Args:
+            data: содержимое файла (bytes)
+            signature: размер и время изменения файла (см. input_signature)
+            
+        Returns:
+            key: строка-ключ, используется как имя файла записи
+        """
+        return '%s-%d-%d-v%d' % (hashlib.sha1(data).hexdigest(), signature[0], signature[1], CACHE_FORMAT_VERSION)
+    
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_ENTRY_SUFFIX)
+    
+    def load(self, key):
+        """
+        Чтение записи кэша
+        
+        Returns:
+            entry (dict) или None, если запись отсутствует или повреждена
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as file:
+                entry = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            log.warning('Поврежденная запись кэша \'%s\' пропущена: %s', entry_path, exc)
+            return None
+        # Время изменения записи используется для вытеснения давно не использованных записей
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return entry
+    
+    def store(self, key, entry):
+        """
+        Сохранение записи кэша. Запись не обязательна: при ошибке (нет места на диске, директория
+        недоступна для записи) выводится предупреждение, обработка документа продолжается
+        
+        Args:
+            key: ключ записи (см. make_key)
+            entry: сохраняемые данные
+        """
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._entry_path(key))
+        except Exception as exc:
+            log.warning('Запись кэша \'%s\' не сохранена: %s', key, exc)
+            if tmp_path != None and os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+    
+    def evict(self):
+        """
+        Удаление давно не использованных записей при превышении максимального размера кэша
+        
+        Returns:
+            removed: количество удаленных записей
+        """
+        entries = []
+        total_size = 0
+        try:
+            dir_entries = list(os.scandir(self.cache_dir))
+        except OSError as exc:
+            log.warning('Директория кэша \'%s\' недоступна: %s', self.cache_dir, exc)
+            return 0
+        for entry in dir_entries:
+            if not entry.name.endswith(CACHE_ENTRY_SUFFIX):
+                continue
+            try:
+                entry_stat = entry.stat()
+            except OSError:
+                # Запись удалена другим процессом
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+            total_size += entry_stat.st_size
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            removed += 1
+        return removed
+
+def default_cache_dir():
+    """
+    Директория кэша обработанных документов по умолчанию (для запуска из командной строки с --cache):
+    %LOCALAPPDATA% в Windows, $XDG_CACHE_HOME или ~/.cache в остальных системах
+    """
+    if os.name == 'nt' and os.environ.get('LOCALAPPDATA'):
+        base_dir = os.environ['LOCALAPPDATA']
+    else:
+        base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base_dir, CACHE_DIR_NAME)
+
+def open_cache(cache_dir, cache_size_mb=DEFAULT_CACHE_SIZE_MB):
+    """
+    Открытие кэша обработанных документов (см. DocumentCache); если директорию кэша не удалось создать,
+    выводится предупреждение и объединение выполняется без кэша
+    
+    Returns:
+        cache: DocumentCache или None
+    """
+    if cache_dir == None:
+        return None
+    try:
+        cache = DocumentCache(cache_dir, cache_size_mb)
+    except OSError as exc:
+        log.warning('Кэш обработанных документов не используется: %s', exc)
+        return None
+    log.info('Кэш обработанных документов: %s', cache_dir)
+    return cache
+
+class SerialExecutor(confu.Executor):
+    """
+    Исполнитель, выполняющий задачи последовательно в вызывающем потоке
+    """
+    def submit(self, fn, *args, **kwargs):
+        future = confu.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+def _init_worker_process():
+    """
+    Инициализация дочернего процесса пула: обработчики журнала, унаследованные при запуске через fork, выводят записи напрямую
+    """
+    if _log_listener != None:
+        # Поток записи журнала в дочерний процесс не переносится, записи выводятся напрямую
+        for handler in list(log.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler):
+                log.removeHandler(handler)
+        for handler in _log_listener.handlers:
+            log.addHandler(handler)
+
+def resolve_executor(multithread=True, executor_type=None, workers=None):
+    """
+    Способ обработки документов и количество используемых ядер по параметрам объединения
+    
+    Args:
+        multithread, executor_type, workers: см. compose_astra_html_tables
+        
+    Returns:
+        tuple (executor_type, cores_used): способ обработки (по умолчанию 'thread') и количество потоков (процессов):
+            по умолчанию - число ядер, 1 без многопоточности и при последовательной обработке
+    """
+    if executor_type == None:
+        executor_type = 'thread'
+        if not multithread and workers == None:
+            workers = 1
+    if workers == None:
+        workers = 1 if executor_type == 'serial' else multiprocessing.cpu_count()
+    return executor_type, 1 if executor_type == 'serial' else workers
+
+def create_executor(executor_type, workers):
+    """
+    Создание исполнителя для параллельной обработки документов
+    
+    Args:
+        executor_type: способ обработки, один из EXECUTOR_TYPES
+        workers: количество потоков (процессов)
+        
+    Returns:
+        executor (concurrent.futures.Executor)
+    """
+    if executor_type == 'thread':
+        return confu.ThreadPoolExecutor(max_workers = workers)
+    if executor_type == 'process':
+        return confu.ProcessPoolExecutor(max_workers = workers, initializer = _init_worker_process)
+    if executor_type == 'serial':
+        return SerialExecutor()
+    raise TablesComposerException('Неизвестный способ обработки \'%s\'' % (executor_type))
+
+def write_header(out_file, styles_contents):
+    """
+    Запись шапки выходного документа с общим блоком стилей
+    
+    Args:
+        out_file: выходной файл
+        styles_contents: строки с описанием стилей всех документов (см. render_styles), итерируемый объект
+    """
+    out_file.write(HTML_HEADER)
+    for style_content in styles_contents:
+        out_file.write(style_content)
+        out_file.write('\n')
+    out_file.write(HTML_BODY_START)
+
+def write_document_tables(out_file, tables_content):
+    """
+    Запись таблиц одного документа в выходной документ
+    
+    Args:
+        out_file: выходной файл, открытый в текстовом режиме (или текстовый поток в памяти)
+        tables_content: HTML-код таблиц документа, строка или байты в UTF-8 (см. render_tables)
+    """
+    if isinstance(tables_content, bytes) and not hasattr(out_file, 'buffer'):
+        # Текстовый поток в памяти (например, io.StringIO)
+        out_file.write(tables_content.decode('utf8'))
+    elif isinstance(tables_content, bytes):
+        # Шаблоны в байтах (см. scan_document_bytes) записываются в файл без кодирования,
+        # переводы строк преобразуются так же, как при записи текста
+        out_file.flush()
+        if os.linesep != '\n':
+            tables_content = tables_content.replace(b'\n', os.linesep.encode('ascii'))
+        out_file.buffer.write(tables_content)
+    else:
+        out_file.write(tables_content)
+    out_file.write('<br>\n')
+
+def class_num_starts(styles_counts, class_num_start=1):
+    """
+    Расчет начальных номеров классов стилей для каждого документа
+    
+    Args:
+        styles_counts: количество классов в каждом документе
+        class_num_start: номер первого класса
+        
+    Returns:
+        starts (list): номер класса, с которого начинается нумерация в каждом документе
+    """
+    starts = []
+    for count in styles_counts:
+        starts.append(class_num_start)
+        class_num_start += count
+    return starts
+
+def iter_ordered(submit, args_list, max_inflight, max_buffer=None, costs=None, stats=None, on_error=None, groups=None):
+    """
+    Выполнение задач на исполнителе с ограничением количества одновременно выполняемых задач
+    и суммарного объема их результатов. Результаты возвращаются в порядке следования аргументов
+    по мере готовности; готовые результаты, ожидающие более ранних задач, тоже учитываются в ограничениях,
+    поэтому объем памяти не зависит от количества задач
+    
+    Args:
+        submit: функция передачи задачи исполнителю, принимает аргументы задачи и возвращает Future
+            (например, executor.submit с зафиксированной функцией)
+        args_list: список кортежей аргументов задач
+        max_inflight: максимальное количество задач, переданных исполнителю, результат которых еще не выдан
+        max_buffer: максимальный суммарный объем (см. costs) таких задач или None - без ограничения;
+            если других задач нет, задача передается независимо от объема
+        costs: оценка объема результата каждой задачи (например, размер документа в байтах) или None
+        stats: словарь, в который записываются наибольшие количество (peak_inflight) и объем (peak_buffer)
+            переданных задач, или None
+        on_error: функция, возвращающая результат задачи по ее исключению (или повторно вызывающая исключение), или None -
+            исключение передается вызывающему. При ошибке или досрочном завершении перебора задачи, еще не начатые
+            исполнителем, отменяются
+        groups: номер группы каждой задачи или None. Результаты группы из нескольких задач (например, частей одного документа,
+            см. iter_documents) используются вместе, поэтому их объем учитывается в ограничениях, пока не выдан последний
+            результат группы и перебор не продолжен (т.е. пока группа не обработана вызывающим)
+        
+    Yields:
+        результат очередной задачи
+    """
+    if costs == None:
+        costs = [0]*len(args_list)
+    items = iter(zip(args_list, costs, groups if groups != None else range(len(args_list))))
+    item = next(items, None)
+    pending = collections.deque()    # Кортежи (Future, объем, номер группы)
+    buffered = 0
+    held = 0                         # Объем выданных результатов текущей группы
+    if stats != None:
+        stats.update({'peak_inflight': 0, 'peak_buffer': 0})
+    
+    def fill():
+        nonlocal item, buffered
+        while item != None and len(pending) < max_inflight and (len(pending) == 0 or max_buffer == None or buffered + item[1] <= max_buffer):
+            args, cost, group = item
+            pending.append((submit(*args), cost, group))
+            buffered += cost
+            item = next(items, None)
+        if stats != None:
+            stats['peak_inflight'] = max(stats['peak_inflight'], len(pending))
+            stats['peak_buffer'] = max(stats['peak_buffer'], buffered)
+    
+    try:
+        fill()
+        while pending:
+            future, cost, group = pending.popleft()
+            try:
+                result = future.result()
+            except Exception as exc:
+                if on_error == None:
+                    raise
+                result = on_error(exc)
+            next_group = pending[0][2] if pending else (item[2] if item != None else None)
+            if held == 0 and next_group != group:
+                buffered -= cost
+                # Новая задача передается до обработки результата, чтобы исполнитель не простаивал
+                fill()
+                yield result
+                continue
+            held += cost
+            if next_group == group:
+                fill()
+                yield result
+                continue
+            # Последний результат группы: объем освобождается после обработки всей группы
+            yield result
+            buffered -= held
+            held = 0
+            fill()
+    finally:
+        cancel_futures(future for future, _, _ in pending)
+
+def cancel_futures(futures):
+    """
+    Отмена задач, еще не начатых исполнителем (выполняющиеся задачи завершаются)
+    
+    Returns:
+        cancelled_count: количество отмененных задач
+    """
+    return sum(1 for future in list(futures) if future.cancel())
+
+def write_metrics(metrics, metrics_path):
+    """
+    Сохранение метрик объединения в JSON-файл
+    
+    Args:
+        metrics: метрики (см. compose_astra_html_tables)
+        metrics_path: путь к файлу
+    """
+    metrics_dir = os.path.dirname(metrics_path)
+    if metrics_dir and not os.path.exists(metrics_dir):
+        os.makedirs(metrics_dir)
+    with open(metrics_path, 'w', encoding="utf8") as file:
+        json.dump(metrics, file, ensure_ascii=False, indent=2)
+
+def run_profiled(fn, profile_path, *args, **kwargs):
+    """
+    Выполнение функции с профилированием (cProfile) и отслеживанием выделения памяти (tracemalloc).
+    Статистика cProfile сохраняется в profile_path (просмотр: python -m pstats), отчет о памяти - в profile_path + '.memory.txt'.
+    cProfile учитывает вызовы только в текущем потоке (для профиля обработки документов используется способ 'serial'),
+    tracemalloc - память только текущего процесса
+    
+    Args:
+        fn: функция
+        profile_path: путь к файлу статистики cProfile
+        
+    Returns:
+        tuple (result, profile)
+        result: результат fn
+        profile: {peak_memory_mb, top_allocations} - пиковый объем памяти и места наибольшего выделения памяти
+    """
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    try:
+        result = profiler.runcall(fn, *args, **kwargs)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        top_allocations = [str(stat) for stat in tracemalloc.take_snapshot().statistics('lineno')[:PROFILE_TOP_ALLOCATIONS]]
+    finally:
+        tracemalloc.stop()
+        profiler.dump_stats(profile_path)
+    with open(profile_path + '.memory.txt', 'w', encoding="utf8") as file:
+        file.write('Пиковый объем памяти: %.1f МБ\n' % (peak_memory/MB))
+        file.write('\n'.join(top_allocations))
+    return result, {'peak_memory_mb': peak_memory/MB, 'top_allocations': top_allocations}
+
+def write_combined_document(target_path, all_css_styles, documents, dedup=False, files_metrics=None, minify=False, class_usage=None):
+    """
+    Сборка и запись выходного документа в файл (см. write_combined_stream)
+    
+    Args:
+        target_path: путь к выходному файлу
+        
+    Returns:
+        tables_count: количество таблиц во всех документах
+    """
+    with open_output(target_path) as out_file:
+        return write_combined_stream(out_file, all_css_styles, documents, dedup, files_metrics, minify=minify, class_usage=class_usage)
+
+def write_combined_stream(out_file, all_css_styles, documents, dedup=False, files_metrics=None, prefix=None, layout=None, minify=False, class_usage=None, logger=None):
+    """
+    Сборка и запись выходного документа: шапка со стилями всех документов, затем таблицы документов по одному
+    
+    Args:
+        out_file: выходной поток, открытый в текстовом режиме в кодировке UTF-8 (например, файл или ответ сервера);
+            для потоков без позиционирования объем записанных таблиц (bytes_out) не определяется
+        all_css_styles: списки стилей документов (см. extract_styles)
+        documents: результаты обработки документов в порядке следования (см. parse_document);
+            итерируемый объект, может выдавать документы по мере их обработки
+        dedup (boolean): объединение одинаковых стилей всех документов в общие классы (см. dedup_styles)
+        files_metrics: список, в который добавляются метрики документов (см. parse_document), или None
+        prefix: tuple (prev_file, size, documents_count) - таблицы первых documents_count документов не собираются,
+            а копируются (size байт) из предыдущего выходного файла prev_file, открытого в двоичном режиме
+            и установленного на начало таблиц (см. watch_and_compose); None - все документы собираются
+        layout: словарь, в который записывается расположение таблиц в выходном файле (tables_start - начало
+            таблиц, sizes - объем таблиц каждого документа, для скопированных документов - None), или None
+        minify (boolean): сжатие выходного документа - объявляются только используемые классы с короткими именами
+            (см. minify_styles), лишние пробельные символы между тегами таблиц удаляются (см. minify_tables). Сокращение
+            объема таблиц документа записывается в метрики (minify_saved)
+        class_usage: использование классов каждого документа, подсчитанное заранее (см. read_class_usage), или None -
+            при сжатии документы обрабатываются полностью до записи шапки, т.к. требуется знать используемые классы
+        logger: объект для вывода в лог (logging.Logger), по умолчанию - общий логгер модуля
+        
+    Returns:
+        tables_count: количество таблиц во всех документах
+    """
+    if logger == None:
+        logger = log
+    if dedup:
+        unique_styles, all_class_nums = dedup_styles(all_css_styles)
+        styles_contents = [render_styles(unique_styles, 1)]
+        logger.info('Стилей после объединения одинаковых: %d из %d', len(unique_styles), sum(len(css_styles) for css_styles in all_css_styles))
+    else:
+        starts = class_num_starts([len(css_styles) for css_styles in all_css_styles])
+        all_class_nums = [range(starts[idx], starts[idx] + len(css_styles)) for idx, css_styles in enumerate(all_css_styles)]
+        # Описание стилей каждого документа формируется непосредственно перед записью
+        styles_contents = (render_styles(css_styles, starts[idx]) for idx, css_styles in enumerate(all_css_styles))
+    class_names = None
+    if minify:
+        if class_usage == None:
+            # Используемые классы известны только после обработки всех документов
+            documents = list(documents)
+        minified = minify_styles(all_css_styles, documents, all_class_nums, class_usage)
+        class_names = minified['class_names']
+        styles_contents = [minified['styles_content']]
+        logger.info('Сжатие: объявлено используемых классов %d из %d', len(class_names), len(unique_styles) if dedup else sum(len(css_styles) for css_styles in all_css_styles))
+    tables_count = 0  # Количество таблиц во всех файлах
+    seekable = out_file.seekable()
+    write_header(out_file, styles_contents)
+    if layout != None:
+        layout.update({'tables_start': out_file.tell(), 'sizes': []})
+    copied_count = 0
+    if prefix != None:
+        prev_file, size, copied_count = prefix
+        out_file.flush()
+        while size > 0:
+            data = prev_file.read(min(size, MB))
+            if len(data) == 0:
+                raise TablesComposerException('Предыдущий выходной файл короче ожидаемого')
+            out_file.buffer.write(data)
+            size -= len(data)
+        if layout != None:
+            layout['sizes'] += [None]*copied_count
+    # Документы собираются и записываются по одному
+    try:
+        for idx, document in enumerate(documents):
+            if 'error' in document:
+                # Документ пропущен (см. failed_document), номера классов и таблиц остальных документов не меняются
+                if files_metrics != None:
+                    files_metrics.append(document['metrics'])
+                if layout != None:
+                    layout['sizes'].append(0)
+                continue
+            if len(document['css_styles']) != len(all_css_styles[idx]):
+                raise DocumentException(document['file_name'], 'write', 'количество стилей не совпадает с количеством стилей в начале документа')
+            if idx < copied_count:
+                tables_count += len(document['tables'])
+                continue
+            document_metrics = document['metrics']
+            start = time.perf_counter()
+            tables_content = render_tables(document['tables'], all_class_nums[idx], idx+1, class_names)
+            if minify:
+                size = len(tables_content)
+                if not minified['keep_spaces']:
+                    tables_content = minify_tables(tables_content)
+                # Удаляются и сокращаются только символы ASCII, поэтому сокращение в символах равно сокращению в байтах
+                document_metrics['minify_saved'] = size - len(tables_content) + minified['names_saved'][idx]
+            document_metrics['render_time'] = time.perf_counter() - start
+            start = time.perf_counter()
+            position = out_file.tell() if seekable else None
+            write_document_tables(out_file, tables_content)
+            document_metrics['bytes_out'] = out_file.tell() - position if seekable else None
+            document_metrics['write_time'] = time.perf_counter() - start
+            if minify:
+                size = document_metrics['bytes_out'] if seekable else len(tables_content)
+                logger.info('Файл \'%s\': объем таблиц уменьшен на %d байт (%.1f%%)', document['file_name'], document_metrics['minify_saved'],
+                         100.0*document_metrics['minify_saved']/(size + document_metrics['minify_saved']) if size + document_metrics['minify_saved'] > 0 else 0.0)
+            if files_metrics != None:
+                files_metrics.append(document_metrics)
+            if layout != None:
+                layout['sizes'].append(document_metrics['bytes_out'])
+            tables_count += len(document['tables'])
+    except TablesComposerException:
+        raise
+    except Exception as exc:
+        raise TablesComposerException(exc)
+    out_file.write(HTML_FOOTER)
+    return tables_count
 
-def read_styles(file_name, input_dir):
+def estimate_table_size(parts, slot_size):
     """
-        Извлечение названий классов css-стилей из документа
+    Оценка объема HTML-кода таблицы по шаблону без сборки текста (см. plan_volumes)
+    
+    Args:
+        parts: шаблон таблицы (см. compile_table)
+        slot_size: наибольший объем подстановки (атрибута class или номера таблицы)
         
-        Args:
-            file_name: имя файла
-            input_dir: рабочая директория
-            
-        Returns:
-            css_styles (tuple): список стилей, содержит
-                class_label: имя класса
-                properties_text: свойства стиля
+    Returns:
+        size: объем таблицы в символах (для шаблонов в байтах - в байтах)
     """
+    return sum(map(len, parts[::2])) + slot_size*(len(parts)//2)
+
+def plan_volumes(documents, max_bytes=None, tables_per_volume=None, slot_size=0):
+    """
+    Распределение таблиц по томам выходного документа в порядке следования. Том заполняется, пока его
+    объем (оценка, см. estimate_table_size) не превысит max_bytes или количество таблиц не достигнет
+    tables_per_volume. Таблицы не разбиваются: таблица больше max_bytes занимает отдельный том
+    
+    Args:
+        documents: результаты обработки документов (см. parse_document)
+        max_bytes: максимальный объем таблиц тома или None
+        tables_per_volume: максимальное количество таблиц в томе или None
+        slot_size: см. estimate_table_size
+        
+    Returns:
+        volumes (list): для каждого тома - список частей [document_idx, start, end]: таблицы документа с номерами start...end-1
+    """
+    volumes = []
+    volume = None
+    for document_idx, document in enumerate(documents):
+        for table_idx, parts in enumerate(document['tables']):
+            table_size = estimate_table_size(parts, slot_size) if max_bytes != None else 0
+            if volume == None or (max_bytes != None and size + table_size > max_bytes and count > 0) or \
+               (tables_per_volume != None and count >= tables_per_volume):
+                volume = []
+                volumes.append(volume)
+                size = count = 0
+            if len(volume) > 0 and volume[-1][0] == document_idx:
+                volume[-1][2] = table_idx + 1
+            else:
+                volume.append([document_idx, table_idx, table_idx + 1])
+            size += table_size
+            count += 1
+    # Без таблиц создается один пустой том
+    return volumes if len(volumes) > 0 else [[]]
+
+def volume_path(target_path, volume_num):
+    """
+    Путь к тому выходного документа: <имя>_001.html, <имя>_002.html, ... (для сжатого файла - <имя>_001.html.gz, ...)
+    """
+    suffix = GZIP_SUFFIX if target_path.lower().endswith(GZIP_SUFFIX) else ''
+    stem, ext = os.path.splitext(target_path[:len(target_path) - len(suffix)])
+    return VOLUME_PATH_FORMAT % (stem, volume_num, ext) + target_path[len(target_path) - len(suffix):]
+
+def write_volume(volume_path, pieces, minify=False):
+    """
+    Запись тома выходного документа. В шапку тома записываются только стили, используемые в его таблицах;
+    имена классов и номера таблиц - те же, что в общем документе (при сжатии имена классов назначаются в пределах тома)
     
-    log.info('чтение стилей из файла \'%s\'' % (file_name))
-    file = open(input_dir + '/' + file_name, 'r', encoding="utf8")
-    # Объединение всех строк, считанных из файла
-    content = '\n'.join([line.strip() for line in file.readlines()])   
+    Args:
+        volume_path: путь к файлу тома
+        pieces: части тома по порядку, кортежи (css_styles, tables, class_nums, document_num, table_num_start):
+            стили документа, шаблоны таблиц части, номера классов документа в общем документе, номер документа
+            и номер первой таблицы части в документе
+        minify (boolean): сжатие тома (см. write_combined_stream)
+        
+    Returns:
+        dict {path, tables, classes, bytes_out, first_table, last_table}
+        tables, classes: количество таблиц и объявленных классов тома
+        bytes_out: размер файла тома, байт
+        first_table, last_table: номера первой и последней таблиц тома (T<документ>-<таблица>) или None
+    """
+    all_css_styles = [piece[0] for piece in pieces]
+    documents = [{'tables': piece[1]} for piece in pieces]
+    all_class_nums = [piece[2] for piece in pieces]
+    class_names = None
+    keep_spaces = True
+    if minify:
+        minified = minify_styles(all_css_styles, documents, all_class_nums)
+        class_names = minified['class_names']
+        styles_content = minified['styles_content']
+        keep_spaces = minified['keep_spaces']
+        classes_count = len(class_names)
+    else:
+        _, properties, _ = count_class_usage(all_css_styles, documents, all_class_nums)
+        styles_content = ''.join(['.s%d {%s}\n' % (class_num, properties[class_num]) for class_num in sorted(properties)])
+        classes_count = len(properties)
+    tables_count = 0
+    with open_output(volume_path) as out_file:
+        write_header(out_file, [styles_content])
+        for _, tables, class_nums, document_num, table_num_start in pieces:
+            tables_content = render_tables(tables, class_nums, document_num, class_names, table_num_start)
+            if not keep_spaces:
+                tables_content = minify_tables(tables_content)
+            write_document_tables(out_file, tables_content)
+            tables_count += len(tables)
+        out_file.write(HTML_FOOTER)
+    first_table = last_table = None
+    if tables_count > 0:
+        first_table = 'T%d-%d' % (pieces[0][3], pieces[0][4])
+        last_table = 'T%d-%d' % (pieces[-1][3], pieces[-1][4] + len(pieces[-1][1]) - 1)
+    return {'path': volume_path, 'tables': tables_count, 'classes': classes_count, 'bytes_out': os.path.getsize(volume_path),
+            'first_table': first_table, 'last_table': last_table}
+
+def write_volumes_index(target_path, volumes):
+    """
+    Запись оглавления томов выходного документа со ссылками на тома
     
-    # Считывание стилей
-    m = re.search(r'<style\s+type\s*=\s*"text/css">(.+)</style>', content, flags=re.DOTALL)
-    if m == None or len(m.groups()) < 1:
-        raise TablesComposerException('Ошибка при считывании стилей в analyze_styles_in_file для файла \'%s\'' % (file_name))
-    styles_content = m.group(1)
+    Args:
+        target_path: путь к файлу оглавления
+        volumes: результаты записи томов (см. write_volume)
+    """
+    with open_output(target_path) as out_file:
+        write_header(out_file, [])
+        for volume_num, volume in enumerate(volumes, 1):
+            volume_name = os.path.basename(volume['path'])
+            tables_range = 'таблицы %s - %s' % (volume['first_table'], volume['last_table']) if volume['tables'] > 0 else 'нет таблиц'
+            out_file.write('<p><a href="%s">Том %d (%s)</a>: %s, всего %d</p>\n' % (urllib.parse.quote(volume_name), volume_num,
+                           html.escape(volume_name), tables_range, volume['tables']))
+        out_file.write(HTML_FOOTER)
+
+def write_volumes(executor, target_path, all_css_styles, documents, dedup=False, files_metrics=None, minify=False, max_output_mb=None, tables_per_volume=None):
+    """
+    Запись выходного документа в виде нескольких томов ограниченного размера (см. plan_volumes) и оглавления.
+    Нумерация классов и таблиц - как в общем документе; тома записываются параллельно на исполнителе
     
-    css_styles = []
-    for m in re.finditer(r'\.(-?[_a-zA-Z]+[_a-zA-Z0-9-]*)\s*\{([^{]+)\}', styles_content, flags=re.DOTALL):
-        class_label = m.group(1)
-        properties_text = m.group(2)
-        if class_label == 'page_break':
-            continue
+    Args:
+        executor: исполнитель (concurrent.futures.Executor)
+        target_path: путь к файлу оглавления, тома записываются рядом с ним (см. volume_path)
+        all_css_styles, dedup, files_metrics: см. write_combined_stream
+        documents: результаты обработки документов в порядке следования (список)
+        minify (boolean): сжатие томов (см. write_volume)
+        max_output_mb: максимальный объем таблиц тома, МБ, или None
+        tables_per_volume: максимальное количество таблиц в томе или None
         
-        css_styles.append((class_label, properties_text))        
+    Returns:
+        volumes (list): результаты записи томов (см. write_volume)
+    """
+    if dedup:
+        _, all_class_nums = dedup_styles(all_css_styles)
+    else:
+        starts = class_num_starts([len(css_styles) for css_styles in all_css_styles])
+        all_class_nums = [range(starts[idx], starts[idx] + len(css_styles)) for idx, css_styles in enumerate(all_css_styles)]
+    for idx, document in enumerate(documents):
+        if 'error' not in document and len(document['css_styles']) != len(all_css_styles[idx]):
+            raise DocumentException(document['file_name'], 'write', 'количество стилей не совпадает с количеством стилей в начале документа')
+    # Наибольший объем подстановки - атрибут class с наибольшим номером класса
+    slot_size = len('class="s%d"' % (sum(len(css_styles) for css_styles in all_css_styles)))
+    volumes = plan_volumes(documents, None if max_output_mb == None else max_output_mb*MB, tables_per_volume, slot_size)
+    log.log(LOG_SUMMARY, 'Таблицы распределены по томам: %d', len(volumes))
+    futures = []
+    for volume_num, volume in enumerate(volumes, 1):
+        pieces = [(all_css_styles[idx], documents[idx]['tables'][start:end], all_class_nums[idx], idx + 1, start + 1) for idx, start, end in volume]
+        futures.append(executor.submit(write_volume, volume_path(target_path, volume_num), pieces, minify))
+    try:
+        results = [future.result() for future in futures]
+    except Exception as exc:
+        raise TablesComposerException(exc)
+    for result in results:
+        log.info('Том \'%s\': таблиц %d, классов %d, %.2f МБ', result['path'], result['tables'], result['classes'], result['bytes_out']/MB)
+    write_volumes_index(target_path, results)
+    if files_metrics != None:
+        files_metrics += [document['metrics'] for document in documents]
+    return results
+
+def find_input_files(input_dir):
+    """
+    Поиск HTML-документов в директории или zip-архиве (см. is_zip_input)
+    
+    Args:
+        input_dir: рабочая директория или путь к zip-архиву
         
-    file.close()
-    log.info('файл \'%s\' обработан' % (file_name))
-    return css_styles 
+    Returns:
+        files_list (list): имена файлов *.html, *.htm, *.txt (в том числе сжатых gzip: *.html.gz, ...),
+            отсортированные по номерам (предполагается, что названия файлов: 1.html, 2.html, 3.html, ...);
+            для архива - имена членов архива, номер берется из имени без директорий
+    """
+    if is_zip_input(input_dir):
+        names = [info.filename for info in get_zip_archive(input_dir).infolist() if not info.is_dir()]
+    else:
+        names = os.listdir(input_dir)
+    files_list = []
+    for pattern in INPUT_PATTERNS:
+        files_list += fnmatch.filter(names, pattern)
+    for pattern in INPUT_PATTERNS:
+        files_list += fnmatch.filter(names, pattern + GZIP_SUFFIX)
+    if not is_zip_input(input_dir):
+        # Убираем вложенные директории из списка
+        files_list = [file for file in files_list if os.path.isfile(input_dir + '/' + file)]
+    # Сортируем по номерам
+    def file_num(file_name):
+        base_name = file_name[file_name.rfind('/') + 1:]
+        try:
+            return int(base_name[:base_name.find('.')])
+        except ValueError:
+            raise TablesComposerException('Имя файла \'%s\' в \'%s\' не начинается с номера документа (ожидается 1.html, 2.html, ...); '
+                                          'передайте список файлов явно' % (file_name, input_dir))
+    return sorted(files_list, key=file_num)
 
-def parse_file(file_name, input_dir, css_styles, class_num_start, document_num=1):
+def scan_file(file_name, input_dir):
     """
-    Обработка одного HTML-документа. Выделение стилей и таблиц
+    Быстрый просмотр документа без обработки таблиц: поиск блока стилей и таблиц в байтах (см. iter_table_spans),
+    подсчет стилей и чтение номеров таблиц. Ошибки в документе не прерывают просмотр, а записываются в результат
     
     Args:
         file_name: имя файла
         input_dir: рабочая директория
-        class_num_start: номер класса стилей, с которого начинать нумерацию
-        document_num: номер документа (используется для нумерации таблиц)        
         
     Returns:
-        dict {styles_content, tables_content, tables_count}
-        styles_content: строка с описанием стилей CSS, подготовленная для вставки в общий документ
-        tables_content: строка с описанием HTML-таблиц из текущего документа с исправленными номерами стилей для вставки в общий документ
-        tables_count: количество таблиц в данном документе
+        dict {file_name, bytes_in, mtime_ns, style_span, styles, tables, labels, errors}
+        bytes_in, mtime_ns: размер и время изменения файла (для проверки актуальности индекса, см. load_scan_index)
+        style_span: границы блока стилей в байтах [start, end] или None
+        styles: количество классов стилей
+        tables: границы таблиц в байтах, список [start, end]
+        labels: номер каждой таблицы вида Т<документ>-<таблица> (первый в таблице) или None
+        errors: описания ошибок в документе, пустой список для корректного документа
     """
+    entry = {'file_name': file_name, 'bytes_in': None, 'mtime_ns': None, 'style_span': None, 'styles': 0, 'tables': [], 'labels': [], 'errors': []}
+    try:
+        entry['bytes_in'], entry['mtime_ns'] = input_signature(file_name, input_dir)
+        file = open_input(file_name, input_dir)
+    except OSError as exc:
+        entry['errors'].append('Ошибка при открытии файла: %s' % (exc))
+        return entry
+    with file:
+        # Сжатый документ распаковывается в память целиком
+        data = file.read() if is_compressed_input(file_name, input_dir) else map_file(file)
+        try:
+            # Блок стилей - от первого '<style' до последнего '</style>' (см. STYLE_BLOCK_RE)
+            style_start = data.find(b'<style')
+            style_end = data.rfind(b'</style>')
+            if style_start != -1 and style_end > style_start:
+                entry['style_span'] = [style_start, style_end + len(b'</style>')]
+            try:
+                css_styles = read_styles_bytes(data, file_name, 0 if entry['style_span'] == None else entry['style_span'][1])
+                entry['styles'] = len(css_styles)
+                class_nums = [int(label[1:]) for label, _ in css_styles if label[:1] == 's' and label[1:].isdigit()]
+                if class_nums != list(range(len(class_nums))):
+                    entry['errors'].append('Классы стилей пронумерованы не по порядку s0, s1, s2, ...')
+            except TablesComposerException:
+                entry['errors'].append('Блок стилей не найден')
+            except UnicodeDecodeError as exc:
+                entry['errors'].append('Блок стилей не в кодировке UTF-8: %s' % (exc))
+            for start, end in iter_table_spans(data):
+                entry['tables'].append([start, end])
+                label = TABLE_LABEL_BYTES_RE.search(data, start, end)
+                entry['labels'].append(None if label == None else label.group().decode('utf8'))
+            # Незавершенная таблица не попадает в выходной файл
+            tag = TABLE_TAG_BYTES_RE.search(data, entry['tables'][-1][1] if len(entry['tables']) > 0 else 0)
+            if tag != None:
+                entry['errors'].append('Незавершенная таблица (байт %d)' % (tag.start()))
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+    return entry
+
+def scan_directory(input_dir, files_list=[], workers=None, index_path=None):
+    """
+    Построение индекса директории без объединения: быстрый просмотр документов (см. scan_file)
+    в нескольких потоках, чтобы ожидание чтения файлов одного потока перекрывалось работой других
     
-    log.info('Начало обработки файла \'%s\'' % (file_name))
-    file = open(input_dir + '/' + file_name, 'r', encoding="utf8")
-    # Объединение всех строк, считанных из файла
-    content = '\n'.join([line.strip() for line in file.readlines()])
-    
-    # Считывание стилей
-    m = re.search(r'<style\s+type\s*=\s*"text/css">(.+)</style>', content, flags=re.DOTALL)
-    if m == None:
-        raise TablesComposerException('Ошибка при обработке регулярного выражения \'<style\s+type\s*=\s*"text/css">(.+)</style>\'')
-    styles_content = m.group(1)
-    
-    # Удаляем символы комментария        
-    m = re.search(r'<!--\n*(.+)\n*-->',styles_content,flags=re.DOTALL)
-    if(m != None):
-       styles_content = m.group(1)
-       
-    # Извлекаем названия классов
-    class_labels = [lab for lab, _ in css_styles]
-       
-    # Корректируем имена классов (продолжаем нумерацию относительно предыдущего документа)
-    # Формат имен классов: s1, s2, ...
-    css_styles_mod = []     # Измененный список стилей
-    for i, (_, css_props) in enumerate(css_styles):
-        css_styles_mod.append('.s%d {%s}\n'%(class_num_start + i, css_props))
-    styles_content = ''.join(css_styles_mod)            
-    
-    # Считывание таблиц
-    table_num = 0  # Номер таблицы
-    tables_content = ''
-    for m in re.finditer(r'(<table[^<]+>.+?</table>)', content, flags=re.DOTALL):  # Not greedy match '+?'
-        if m == None or len(m.groups()) < 1:
-            raise TablesComposerException('Ошибка при считывании таблиц в функции parse_file для файла \'%s\'' % (file_name))
-        tables_content_cur = m.group(1)
-        
-        # Корректировка имен классов стилей
-        classes_count = len(css_styles)
-        for i in range(classes_count-1, -1, -1):
-            tables_content_cur = re.sub(r'class\s*=\s*"%s"'%(class_labels[i]), 'class="s%d"'%(i+class_num_start), tables_content_cur)
-        
-        # Исправление номера таблицы  
-        table_num += 1
-        tables_content_cur = re.sub(r'Т\d+-\d+', 'T%d-%d'%(document_num, table_num), tables_content_cur)
+    Args:
+        input_dir: рабочая директория
+        files_list: список файлов, если пустой - все HTML-файлы из input_dir (см. find_input_files)
+        workers: количество потоков, по умолчанию - SCAN_WORKERS_FACTOR на ядро
+        index_path: путь к файлу для сохранения индекса (см. load_scan_index) или None
         
-        tables_content += tables_content_cur
-    tables_count = table_num  # Количество таблиц
-    
-    file.close()
-    log.info('Завершение обработки файла \'%s\'. Стилей: %d, таблиц: %d' % (file_name, len(class_labels), tables_count))
-    
-    return {'styles_content' : styles_content, 'tables_content': tables_content, 'tables_count': tables_count}    
+    Returns:
+        index (dict): {version, input_dir, files, totals}
+        files: результаты просмотра документов в порядке files_list
+        totals: количество документов, стилей, таблиц, документов с ошибками, общий объем (bytes_in) и время просмотра (scan_time)
+    """
+    start_time = time.time()
+    if files_list == None or len(files_list) == 0:
+        files_list = find_input_files(input_dir)
+    if workers == None:
+        workers = SCAN_WORKERS_FACTOR*multiprocessing.cpu_count()
+    log.info('Просмотр директории \'%s\': документов %d, потоков %d', input_dir, len(files_list), workers)
+    with create_executor('thread', workers) as executor:
+        entries = list(executor.map(scan_file, files_list, [input_dir]*len(files_list)))
+    for entry in entries:
+        if len(entry['errors']) > 0:
+            log.warning('Файл \'%s\': %s', entry['file_name'], '; '.join(entry['errors']))
+    scan_time = time.time() - start_time
+    index = {'version': SCAN_INDEX_VERSION, 'input_dir': input_dir, 'files': entries,
+             'totals': {'documents': len(entries),
+                        'styles': sum(entry['styles'] for entry in entries),
+                        'tables': sum(len(entry['tables']) for entry in entries),
+                        'failed': sum(1 for entry in entries if len(entry['errors']) > 0),
+                        'bytes_in': sum(entry['bytes_in'] or 0 for entry in entries),
+                        'scan_time': scan_time}}
+    log.log(LOG_SUMMARY, 'Просмотрено: документов %d, стилей %d, таблиц %d, с ошибками %d. Затраченное время: %5.2f сек',
+            index['totals']['documents'], index['totals']['styles'], index['totals']['tables'], index['totals']['failed'], scan_time)
+    if index_path != None:
+        write_scan_index(index, index_path)
+        log.info('Индекс сохранен в \'%s\'', index_path)
+    return index
+
+def default_index_path(input_dir):
+    """
+    Путь к индексу директории по умолчанию (для запуска из командной строки): SCAN_INDEX_FILE_NAME в рабочей директории,
+    для zip-архива - файл рядом с архивом (см. SCAN_INDEX_ZIP_SUFFIX)
+    """
+    if is_zip_input(input_dir):
+        return input_dir + SCAN_INDEX_ZIP_SUFFIX
+    return os.path.join(input_dir, SCAN_INDEX_FILE_NAME)
+
+def write_scan_index(index, index_path):
+    """
+    Сохранение индекса директории (см. scan_directory) в JSON-файл
+    """
+    index_dir = os.path.dirname(index_path)
+    if index_dir and not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+    # Границы таблиц занимают основную часть индекса, поэтому файл записывается без отступов
+    with open(index_path, 'w', encoding="utf8") as file:
+        json.dump(index, file, ensure_ascii=False)
+
+def load_scan_index(index_path, input_dir):
+    """
+    Загрузка индекса директории (см. scan_directory). Записи документов, измененных после просмотра, не используются
     
-def compose_astra_html_tables(input_dir, target_path, files_list=[], multithread=True):
+    Args:
+        index_path: путь к файлу индекса
+        input_dir: рабочая директория
+        
+    Returns:
+        entries (dict): {имя файла: результат просмотра (см. scan_file)} для неизмененных документов;
+            None, если индекса нет или он другой версии
+    """
+    try:
+        with open(index_path, 'r', encoding="utf8") as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(index, dict) or index.get('version') != SCAN_INDEX_VERSION:
+        return None
+    entries = {}
+    for entry in index['files']:
+        try:
+            signature = input_signature(entry['file_name'], input_dir)
+        except OSError:
+            continue
+        if signature == (entry['bytes_in'], entry['mtime_ns']):
+            entries[entry['file_name']] = entry
+    return entries
+
+def compose_astra_html_tables(input_dir, target_path, files_list=[], multithread=True, executor_type=None, workers=None, stream=False, cache_dir=None, cache_size_mb=DEFAULT_CACHE_SIZE_MB,
+                              dedup=False, metrics_path=None, use_mmap=False, split_mb=None, max_inflight=None, max_buffer_mb=None,
+                              minify=False, max_output_mb=None, tables_per_volume=None, scan_index=None, skip_bad=False):
     """
     Объединение набора HTML-таблиц сгенерированных с помощью FastReport
     Требования: классы во всех документах должны обозначаться s0,s1,s2,...,
@@ -145,108 +2133,729 @@ def compose_astra_html_tables(input_dir, target_path, files_list=[], multithread
         target_path: Имя файла с полным путем с объединенной таблицей 
         files_list: Список файлов для объединения, если пустой, то используются все HTML-файлы из input_dir         
         multithread (boolean): Флаг многопоточности        
+        executor_type: способ обработки документов (см. EXECUTOR_TYPES), по умолчанию 'thread';
+            процессы позволяют задействовать все ядра, т.к. обработка упирается в GIL
+        workers: количество потоков (процессов), по умолчанию - число ядер (1 без многопоточности)
+        stream (boolean): потоковый режим - после считывания стилей всех документов таблицы записываются
+            в выходной файл по мере обработки документов, в памяти хранится лишь несколько документов
+        cache_dir: директория кэша обработанных документов (см. DocumentCache), None - без кэша
+        cache_size_mb: максимальный размер кэша, МБ
+        dedup (boolean): объединение одинаковых стилей всех документов в общие классы (см. dedup_styles)
+        metrics_path: путь к JSON-файлу для сохранения метрик или None
+        use_mmap (boolean): отображение документов в память и обработка таблиц без декодирования
+            (см. scan_document_bytes), снижает затраты на больших документах
+        split_mb: документы больше этого размера (МБ) разбиваются на части по границам таблиц, которые
+            обрабатываются параллельно (см. split_document); None - без разбиения. Разбиение выполняется
+            при нескольких потоках (процессах), части обрабатываются в байтах, разбитые документы не кэшируются
+        max_inflight: максимальное количество документов (частей документов), переданных исполнителю и ожидающих
+            записи, по умолчанию - STREAM_INFLIGHT_FACTOR на поток (процесс)
+        max_buffer_mb: максимальный суммарный размер таких документов, МБ (None - без ограничения);
+            при задании max_inflight или max_buffer_mb включается потоковый режим, объем памяти не зависит от количества документов.
+            Части разбитого документа учитываются, пока документ не записан целиком, поэтому объем может превышать
+            ограничение лишь на размер одного такого документа
+        minify (boolean): сжатие выходного документа (см. write_combined_stream); в потоковом режиме используемые классы
+            подсчитываются при считывании стилей (см. read_class_usage), документы записываются по мере обработки
+        max_output_mb: максимальный объем таблиц одного тома выходного документа, МБ (оценка по шаблонам таблиц)
+        tables_per_volume: максимальное количество таблиц в одном томе; при задании max_output_mb или tables_per_volume
+            выходной документ записывается томами <имя>_001.html, <имя>_002.html, ... (см. write_volumes), а в target_path -
+            оглавление со ссылками на тома. Документы обрабатываются полностью до записи томов
+        scan_index: путь к индексу директории (см. scan_directory) или None; для неизмененных документов
+            размеры и границы таблиц берутся из индекса без поиска, о документах с ошибками выводятся предупреждения
+        skip_bad (boolean): пропускать документы, которые не удалось обработать (см. failed_document), номера таблиц
+            остальных документов сохраняются. Без этого флага первая ошибка документа прерывает объединение: задачи,
+            еще не начатые исполнителем, отменяются. Ошибка сообщается с именем файла и этапом (см. DocumentException)
+        
+    Returns:
+        metrics (dict): метрики объединения
+            phases: время этапов, сек (styles - считывание стилей в потоковом режиме, parse - обработка документов,
+                write - сборка и запись выходного файла, в потоковом режиме включает обработку документов; total - общее время)
+            totals: суммарные показатели (документы, таблицы, классы, объем на входе и выходе, пропускная способность)
+            files: метрики каждого документа (см. parse_document), дополнительно время сборки (render_time),
+                записи (write_time), объем записанных таблиц (bytes_out) и его сокращение при сжатии (minify_saved)
+            scheduler: в потоковом режиме - наибольшие количество (peak_inflight) и размер (peak_buffer_mb, МБ)
+                документов, одновременно находившихся в обработке
+            volumes: при записи томами - результаты записи томов (см. write_volume)
+            failed: пропущенные документы (file_name, phase, message)
     """
         
     # Если передан пустой список, берем все html-файлы из директории
     if files_list == None or len(files_list) == 0:
-        files_list = []
-        files_list += fnmatch.filter(os.listdir(input_dir), "*.html")
-        files_list += fnmatch.filter(os.listdir(input_dir), "*.htm")
-        files_list += fnmatch.filter(os.listdir(input_dir), "*.txt")
-        # Убираем вложенные директории из списка
-        files_list = [file for file in files_list if os.path.isfile(input_dir + '/' + file)]
-        # Сортируем по номерам (предполагается, что названия файлов: 1.html, 2.html, 3.html, ...)
-        files_list = sorted(files_list, key = lambda s : int(s[:s.find('.')]))
+        files_list = find_input_files(input_dir)
         
     files_count = len(files_list)    # Количество файлов
     
-    cores_used = 1 # Количество используемых ядер
-    if multithread:
-        cores_used = multiprocessing.cpu_count()           
+    executor_type, cores_used = resolve_executor(multithread, executor_type, workers)    # Способ обработки и количество используемых ядер
     
     start_time = time.time()
     log.info('++++++++++++++++++Объединение HTML-таблиц в один документ+++++++++++++++++++++++')
     log.info('Рабочая директория:')
     log.info(input_dir)    
-    log.info('Список файлов для обработки (количество: %d):' % (files_count))
-    log.info(files_list)
+    log.info('Список файлов для обработки (количество: %d):', files_count)
+    log.info('%s%s', files_list[:LOG_FILES_LIMIT], '' if files_count <= LOG_FILES_LIMIT else ' ... (еще %d)' % (files_count - LOG_FILES_LIMIT))
     log.info('Путь к выходному (объединенному) файлу:')
     log.info(target_path)
     
-    log.info('%s обработка. Доступно ядер: %d. Используется: %d ' % ('Многопоточная' if multithread else 'Однопоточная', multiprocessing.cpu_count(), cores_used))
+    log.info('Способ обработки: %s. Доступно ядер: %d. Используется: %d ', executor_type, multiprocessing.cpu_count(), cores_used)
+    
+    if not stream and (max_inflight != None or max_buffer_mb != None):
+        # Ограничение объема обработанных документов имеет смысл, только если они записываются по мере готовности
+        stream = True
+        log.info('Заданы ограничения количества и объема обрабатываемых документов, включен потоковый режим')
+    if max_inflight == None:
+        max_inflight = STREAM_INFLIGHT_FACTOR*cores_used
+    log.info('%s режим записи выходного файла', 'Потоковый' if stream else 'Обычный')
+    if stream:
+        log.info('Документов в обработке не более %d%s', max_inflight, '' if max_buffer_mb == None else ', общим размером не более %g МБ' % (max_buffer_mb))
+    if use_mmap:
+        log.info('Документы отображаются в память и обрабатываются без декодирования')
+    if minify:
+        log.info('Сжатие выходного файла: только используемые стили, короткие имена классов, без лишних пробельных символов')
+    cache = open_cache(cache_dir, cache_size_mb)
+    index_entries = {}  # Записи индекса директории для неизмененных документов (см. load_scan_index)
+    if scan_index != None:
+        index_entries = load_scan_index(scan_index, input_dir)
+        if index_entries == None:
+            index_entries = {}
+            log.info('Индекс директории \'%s\' не найден или имеет другую версию', scan_index)
+        else:
+            log.info('Индекс директории \'%s\': актуальных записей %d из %d', scan_index, sum(1 for file_name in files_list if file_name in index_entries), files_count)
+            for file_name in files_list:
+                if file_name in index_entries and len(index_entries[file_name]['errors']) > 0:
+                    log.warning('Файл \'%s\': %s', file_name, '; '.join(index_entries[file_name]['errors']))
+    metrics = {'input_dir': input_dir, 'target_path': target_path, 'executor': executor_type, 'workers': cores_used,
+               'stream': stream, 'dedup': dedup, 'cache_dir': cache_dir, 'mmap': use_mmap, 'split_mb': split_mb,
+               'max_inflight': max_inflight if stream else None, 'max_buffer_mb': max_buffer_mb, 'minify': minify,
+               'phases': {}, 'totals': {}, 'files': []}
+    
+    skipped = {}    # Первая ошибка каждого пропущенного документа (при skip_bad)
     
-    # Определение количества классов css-стилей в каждом из документов, сохранения названий классов в список
-    log.info('-------Подсчет числа классов во всех документах-------')
-    css_styles = [[]]*files_count   # Стили
+    def skip_document(exc):
+        # Ошибка документа при skip_bad пропускает документ, остальные ошибки прерывают объединение
+        if not skip_bad or not isinstance(exc, DocumentException):
+            raise exc
+        if exc.file_name not in skipped:
+            skipped[exc.file_name] = exc
+            log.warning('[ОШИБКА] Документ пропущен: %s', exc)
+        return failed_document(skipped[exc.file_name])
     
-    with confu.ThreadPoolExecutor(max_workers = cores_used) as executor:
-        futures_to_idx = {executor.submit(read_styles, file_name, input_dir) : idx for idx,file_name in enumerate(files_list)}
-    for future in confu.as_completed(futures_to_idx):
-        idx = futures_to_idx[future]        
+    def input_size(file_name):
+        # Размер документа из индекса или файла; недоступный документ обрабатывается как пустой, ошибка сообщается при обработке
+        if file_name in index_entries:
+            return index_entries[file_name]['bytes_in']
         try:
-            css_styles[idx] = future.result()
-        except Exception as exc:
-            raise TablesComposerException(exc)
-    log.info(BREAKING_LINE)
-#    class_labels = [[lab for lab,_ in entry] for entry in css_styles]    
-    
-    all_styles_content = [[]]*files_count    # Список строк с описанием стилей для всех документов
-    all_tables_content = [[]]*files_count     # Список строк с HTML-кодом таблиц по всем документам
-#    max_class_num_prev = 0   # Максимальный номер класса в предыдущем обработанном файле
-#    tables_count = 0    
-    log.info('-------Начало обработки файлов-------')
-    with confu.ThreadPoolExecutor(max_workers = cores_used) as executor:
-        class_num_start = 1
-        futures_to_idx = {}
-        for idx,file_name in enumerate(files_list):
-            # TODO Преобразовать в вызов функции для устранения повтора кода
-            futures_to_idx[executor.submit(parse_file, file_name, input_dir, css_styles[idx], class_num_start, idx+1)] = idx
-            class_num_start += len(css_styles[idx])
+            return input_signature(file_name, input_dir)[0]
+        except OSError:
+            return 0
     
-    tables_count = 0  # Количество таблиц во всех файлах
-    for future in confu.as_completed(futures_to_idx):
-        idx = futures_to_idx[future]        
+    # Большие документы разбиваются на части по границам таблиц, чтобы время обработки
+    # определялось общим объемом документов, а не самым большим из них
+    splits = [None]*files_count
+    if split_mb != None and split_mb > 0 and cores_used > 1:
+        for idx, file_name in enumerate(files_list):
+            file_size = input_size(file_name)
+            # Сжатые документы читаются только последовательно
+            if file_size <= split_mb*MB or is_compressed_input(file_name, input_dir):
+                continue
+            try:
+                split = run_document_task('split', split_document, file_name, input_dir, min(split_mb*MB, -(-file_size // cores_used)), index_entries.get(file_name))
+            except DocumentException as exc:
+                # Документ обрабатывается целиком, ошибка повторится и будет обработана на этапе обработки
+                if not skip_bad:
+                    raise
+                log.info('Файл \'%s\' не разбит на части: %s', file_name, exc)
+                continue
+            if len(split['chunks']) > 1:
+                splits[idx] = split
+                log.info('Файл \'%s\' разбит на части для параллельной обработки: %d', file_name, len(split['chunks']))
+    # Задачи обработки: функция, аргументы, именованные аргументы
+    tasks = []
+    costs = []    # Оценка объема результата задачи - размер документа (части документа), байт
+    groups = []   # Номер документа для каждой задачи (части документа собираются вместе, см. iter_ordered)
+    for idx, file_name in enumerate(files_list):
+        if splits[idx] == None:
+            tasks.append((parse_document, (file_name, input_dir, cache), {'use_mmap': use_mmap}))
+            costs.append(input_size(file_name))
+            groups.append(idx)
+        else:
+            tasks += [(parse_document_chunk, (file_name, input_dir, start, end, splits[idx]['css_styles']), {}) for start, end in splits[idx]['chunks']]
+            costs += [end - start for start, end in splits[idx]['chunks']]
+            groups += [idx]*len(splits[idx]['chunks'])
+    
+    scheduler_stats = {}    # Наибольшие количество и объем документов в обработке (см. iter_ordered)
+    with create_executor(executor_type, cores_used) as executor:
+        def submit_task(fn, args, kwargs):
+            return executor.submit(run_document_task, 'parse', fn, *args, submit_time=time.time(), **kwargs)
+        
+        ordered = None  # Задачи обработки документов в потоковом режиме (см. iter_ordered)
+        class_usage = None  # Использование классов документов, подсчитанное при считывании стилей (см. read_class_usage)
+        if stream:
+            # Стили считываются из начала каждого документа до обработки таблиц,
+            # чтобы записать шапку выходного файла до готовности всех документов
+            log.info('-------Считывание стилей-------')
+            try:
+                if minify:
+                    # Для шапки сжатого документа нужны используемые классы: они подсчитываются без построения шаблонов таблиц
+                    usage_results = list(iter_ordered(functools.partial(executor.submit, run_document_task, 'styles', read_class_usage),
+                                                      [(file_name, input_dir) for file_name in files_list], max_inflight,
+                                                      on_error=lambda exc: (skip_document(exc)['css_styles'], collections.Counter())))
+                    all_css_styles = [css_styles for css_styles, _ in usage_results]
+                    class_usage = [usage for _, usage in usage_results]
+                else:
+                    all_css_styles = list(iter_ordered(functools.partial(executor.submit, run_document_task, 'styles', read_style_block),
+                                                       [(file_name, input_dir) for file_name in files_list], max_inflight,
+                                                       on_error=lambda exc: skip_document(exc)['css_styles']))
+            except TablesComposerException:
+                raise
+            except Exception as exc:
+                raise TablesComposerException(exc)
+            styles_time = time.time()
+            metrics['phases']['styles'] = styles_time - start_time
+            log.info('Время считывания стилей: %5.2f сек', styles_time - start_time)
+            # Документы записываются по порядку по мере готовности, новые задачи передаются исполнителю
+            # только после записи предыдущих документов при превышении ограничений
+            ordered = iter_ordered(submit_task, tasks, max_inflight, None if max_buffer_mb == None else max_buffer_mb*MB,
+                                   costs, scheduler_stats, skip_document, groups)
+            documents = iter_documents(ordered, splits)
+        else:
+            # Стили и таблицы каждого документа считываются за один проход,
+            # номера классов и таблиц подставляются после обработки всех документов
+            log.info('-------Начало обработки файлов-------')
+            task_results = [None]*len(tasks)    # Результаты обработки документов и частей документов
+            # В дочерние процессы передаются только имена файлов, обратно - шаблоны таблиц без повторной сборки текста
+            futures_to_idx = {submit_task(*task) : idx for idx, task in enumerate(tasks)}
+            try:
+                for future in confu.as_completed(futures_to_idx):
+                    idx = futures_to_idx[future]        
+                    try:
+                        task_results[idx] = future.result()
+                    except Exception as exc:
+                        task_results[idx] = skip_document(exc)
+            except Exception as exc:
+                # Задачи, еще не начатые исполнителем, отменяются, чтобы не ожидать их при выходе из with
+                log.info('Объединение прервано, отменено задач: %d', cancel_futures(futures_to_idx))
+                if isinstance(exc, TablesComposerException):
+                    raise
+                raise TablesComposerException(exc)
+            documents = list(iter_documents(task_results, splits))
+            all_css_styles = [document['css_styles'] for document in documents]
+            styles_time = time.time()
+            metrics['phases']['parse'] = styles_time - start_time
+            log.info('Время обработки документов: %5.2f сек', styles_time - start_time)
+        
+        log.info('Генерация выходного файла')
+        if stream:
+            log.info('-------Начало обработки файлов-------')
         try:
-            data = future.result()
-            all_styles_content[idx] = data['styles_content']
-            all_tables_content[idx] = data['tables_content']
-            tables_count += data['tables_count']
-        except Exception as exc:
-            raise TablesComposerException(exc)
+            if max_output_mb != None or tables_per_volume != None:
+                # Распределение таблиц по томам известно только после обработки всех документов
+                metrics['volumes'] = write_volumes(executor, target_path, all_css_styles, list(documents), dedup, metrics['files'], minify,
+                                                   max_output_mb, tables_per_volume)
+                tables_count = sum(volume['tables'] for volume in metrics['volumes'])
+            else:
+                tables_count = write_combined_document(target_path, all_css_styles, documents, dedup, metrics['files'], minify, class_usage)
+        finally:
+            if ordered != None:
+                # При ошибке записи задачи, еще не начатые исполнителем, отменяются
+                ordered.close()
+        cached_count = sum(document_metrics['cached'] for document_metrics in metrics['files'])
+    metrics['phases']['write'] = time.time() - styles_time
+    log.info('Время %sзаписи выходного файла: %5.2f сек', 'обработки документов и ' if stream else '', metrics['phases']['write'])
+    if stream:
+        metrics['scheduler'] = {'peak_inflight': scheduler_stats['peak_inflight'], 'peak_buffer_mb': scheduler_stats['peak_buffer']/MB}
+        log.info('Наибольшее количество документов в обработке: %d, общим размером %.1f МБ', scheduler_stats['peak_inflight'], scheduler_stats['peak_buffer']/MB)
         
     log.info('Завершение обработки всех файлов')
-    log.info('Обработано: документов %d, таблиц %d' % (len(files_list), tables_count))
+    metrics['failed'] = [{'file_name': document_metrics['file_name'], 'phase': document_metrics['error']['phase'], 'message': document_metrics['error']['message']}
+                         for document_metrics in metrics['files'] if 'error' in document_metrics]
+    log.log(LOG_SUMMARY, 'Обработано: документов %d, таблиц %d', len(files_list) - len(metrics['failed']), tables_count)
+    if len(metrics['failed']) > 0:
+        log.warning('Пропущено документов с ошибками: %d (%s)', len(metrics['failed']), ', '.join(failed['file_name'] for failed in metrics['failed'][:LOG_FILES_LIMIT]))
+    if minify and 'volumes' not in metrics:
+        log.log(LOG_SUMMARY, 'Сжатие: объем таблиц уменьшен на %.2f МБ', sum(document_metrics['minify_saved'] for document_metrics in metrics['files'])/MB)
+    if cache != None:
+        log.log(LOG_SUMMARY, 'Взято из кэша: документов %d из %d. Удалено устаревших записей кэша: %d', cached_count, files_count, cache.evict())
     log.info(BREAKING_LINE)
     
-    log.info('Генерация выходного файла')
-    output_lines = []
-    output_lines.append('<!DOCTYPE html PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN">\n')
-    output_lines.append('<html>\n')
-    output_lines.append('<head>\n')
-    output_lines.append('<meta http-equiv="Content-Type" content="text/html; charset=UTF-8">\n')
-    output_lines.append('<meta name="Generator" content="FastReport 5.0 http://www.fast-report.com">\n')    
-    output_lines.append('<title></title>\n')
-    output_lines.append('<style type="text/css">\n')
-    for style_content in all_styles_content:
-        output_lines.append(style_content+'\n')
-    output_lines.append('</style>\n')
-    output_lines.append('</head>\n')
-    
-    output_lines.append('<body text="#000000" bgcolor="#FFFFFF">\n')
-    
-    for table_content in all_tables_content:
-        output_lines.append(table_content+'<br>\n')
-    
-    output_lines.append('</body>\n')
-    output_lines.append('</html>\n')
-
-    out_file = open(target_path, 'w', encoding="utf8")
-    out_file.writelines(output_lines)
-    out_file.close()        
     log.info('Выходной файл создан')
     finish_time = time.time()
-    log.info('Затраченное время: %5.2f сек' % (finish_time - start_time))
-    return
+    log.log(LOG_SUMMARY, 'Затраченное время: %5.2f сек', finish_time - start_time)
+    
+    metrics['phases']['total'] = finish_time - start_time
+    bytes_in = sum(document_metrics['bytes_in'] for document_metrics in metrics['files'])
+    metrics['totals'] = {'documents': files_count,
+                         'tables': tables_count,
+                         'classes': sum(len(css_styles) for css_styles in all_css_styles),
+                         'cached': cached_count,
+                         'failed': len(metrics['failed']),
+                         'bytes_in': bytes_in,
+                         'bytes_out': os.path.getsize(target_path) + sum(volume['bytes_out'] for volume in metrics.get('volumes', [])),
+                         'throughput_mb_s': bytes_in/MB/metrics['phases']['total'] if metrics['phases']['total'] > 0 else None}
+    if metrics_path != None:
+        write_metrics(metrics, metrics_path)
+        log.info('Метрики сохранены в \'%s\'', metrics_path)
+    return metrics
+
+def parse_source(source, name, submit_time=None):
+    """
+    Обработка документа, переданного в памяти (см. parse_document): выделение стилей и таблиц.
+    Текст разбирается так же, как файл, открытый в текстовом режиме (см. scan_document), байты в UTF-8 -
+    без декодирования (см. scan_document_bytes)
+    
+    Args:
+        source: содержимое документа - строка или байты в UTF-8
+        name: имя документа (для сообщений об ошибках и метрик)
+        submit_time: время передачи задачи исполнителю (time.time())
+        
+    Returns:
+        dict {file_name, css_styles, tables, cached, metrics}, см. parse_document
+    """
+    metrics = {'file_name': name,
+               'queue_wait': 0.0 if submit_time == None else max(0.0, time.time() - submit_time),
+               'read_time': 0.0, 'styles_time': 0.0, 'tables_time': 0.0, 'rewrite_time': 0.0, 'cache_time': 0.0}
+    if isinstance(source, str):
+        metrics['bytes_in'] = len(source.encode('utf8'))
+        # Переводы строк преобразуются так же, как при чтении файла в текстовом режиме
+        css_styles, tables = scan_document(io.StringIO(source, newline=None), name, metrics)
+    else:
+        metrics['bytes_in'] = len(source)
+        css_styles, tables = scan_document_bytes(source, name, metrics)
+    metrics.update({'tables': len(tables), 'classes': len(css_styles), 'cached': False})
+    return {'file_name': name, 'css_styles': css_styles, 'tables': tables, 'cached': False, 'metrics': metrics}
+
+def read_source(source):
+    """
+    Получение содержимого документа для parse_source
+    
+    Args:
+        source: строка, байты (bytes, bytearray, memoryview) или файловый объект, открытый
+            в текстовом или двоичном режиме (считывается целиком)
+        
+    Returns:
+        content: строка или bytes
+    """
+    if hasattr(source, 'read'):
+        source = source.read()
+    if isinstance(source, (bytearray, memoryview)):
+        source = bytes(source)
+    if not isinstance(source, (str, bytes)):
+        raise TablesComposerException('Неподдерживаемый тип документа: %s' % (type(source).__name__))
+    return source
+
+def compose_stream(sources, out_file, names=None, dedup=False, executor=None, logger=None):
+    """
+    Объединение документов, переданных в памяти, с записью результата в поток - для встраивания
+    в сервисы без записи временных файлов. Результат тот же, что у compose_astra_html_tables для файлов
+    с тем же содержимым
+    
+    Args:
+        sources: итерируемый объект с документами в порядке следования - строки, байты в UTF-8
+            или файловые объекты (см. read_source)
+        out_file: выходной поток - текстовый (io.TextIOBase, например, io.StringIO) или двоичный
+            (например, io.BytesIO, сокет через makefile('wb')); двоичный поток после записи не закрывается
+        names: имена документов (для сообщений об ошибках и метрик), по умолчанию - '1', '2', ...
+        dedup (boolean): объединение одинаковых стилей всех документов в общие классы (см. dedup_styles)
+        executor: исполнитель для обработки документов (concurrent.futures.Executor), None - обработка
+            в вызывающем потоке. Исполнитель не завершается, его можно использовать для нескольких вызовов
+        logger: объект для вывода в лог (logging.Logger), по умолчанию - общий логгер модуля
+        
+    Returns:
+        metrics (dict): метрики объединения (phases: parse, write, total; totals; files), см. compose_astra_html_tables
+    """
+    if logger == None:
+        logger = log
+    start_time = time.time()
+    contents = [read_source(source) for source in sources]
+    if names == None:
+        names = [str(idx) for idx in range(1, len(contents) + 1)]
+    if len(names) != len(contents):
+        raise TablesComposerException('Количество имен документов (%d) не совпадает с количеством документов (%d)' % (len(names), len(contents)))
+    metrics = {'dedup': dedup, 'phases': {}, 'totals': {}, 'files': []}
+    
+    own_executor = executor == None
+    if own_executor:
+        executor = SerialExecutor()
+    try:
+        futures = [executor.submit(parse_source, content, name, submit_time=time.time()) for content, name in zip(contents, names)]
+        try:
+            documents = [future.result() for future in futures]
+        except Exception as exc:
+            for future in futures:
+                future.cancel()
+            raise TablesComposerException(exc)
+    finally:
+        if own_executor:
+            executor.shutdown()
+    for document in documents:
+        logger.debug('Документ \'%s\' обработан. Стилей: %d, таблиц: %d', document['file_name'], len(document['css_styles']), len(document['tables']))
+    parse_time = time.time()
+    metrics['phases']['parse'] = parse_time - start_time
+    
+    all_css_styles = [document['css_styles'] for document in documents]
+    text_file = out_file if isinstance(out_file, io.TextIOBase) else io.TextIOWrapper(out_file, encoding="utf8")
+    try:
+        tables_count = write_combined_stream(text_file, all_css_styles, documents, dedup, metrics['files'], logger=logger)
+    finally:
+        if text_file is not out_file:
+            # Поток вызывающего кода не закрывается вместе с оберткой
+            text_file.flush()
+            text_file.detach()
+    finish_time = time.time()
+    metrics['phases']['write'] = finish_time - parse_time
+    metrics['phases']['total'] = finish_time - start_time
+    
+    bytes_in = sum(document_metrics['bytes_in'] for document_metrics in metrics['files'])
+    metrics['totals'] = {'documents': len(documents),
+                         'tables': tables_count,
+                         'classes': sum(len(css_styles) for css_styles in all_css_styles),
+                         'bytes_in': bytes_in,
+                         'throughput_mb_s': bytes_in/MB/metrics['phases']['total'] if metrics['phases']['total'] > 0 else None}
+    logger.info('Объединено документов: %d, таблиц: %d, %5.3f сек', len(documents), tables_count, metrics['phases']['total'])
+    return metrics
+
+def compose_bytes(sources, names=None, dedup=False, executor=None, logger=None):
+    """
+    Объединение документов, переданных в памяти (см. compose_stream)
+    
+    Returns:
+        content: объединенный документ, bytes в UTF-8
+    """
+    out_file = io.BytesIO()
+    compose_stream(sources, out_file, names, dedup, executor, logger)
+    return out_file.getvalue()
+
+async def compose_async(sources, out_file=None, names=None, dedup=False, executor=None, logger=None):
+    """
+    Асинхронный вариант compose_stream для вызова из asyncio: объединение выполняется в пуле потоков
+    цикла событий и не блокирует его. Документы обрабатываются исполнителем executor (например,
+    пулом процессов), запись в out_file выполняется в потоке пула
+    
+    Args:
+        out_file: выходной поток (см. compose_stream) или None - объединенный документ возвращается
+        sources, names, dedup, executor, logger: см. compose_stream
+        
+    Returns:
+        content (bytes), если out_file не передан, иначе metrics (см. compose_stream)
+    """
+    loop = asyncio.get_running_loop()
+    if out_file == None:
+        return await loop.run_in_executor(None, functools.partial(compose_bytes, sources, names, dedup, executor, logger))
+    return await loop.run_in_executor(None, functools.partial(compose_stream, sources, out_file, names, dedup, executor, logger))
+
+def load_manifest(manifest_path):
+    """
+    Считывание списка заданий пакетного объединения (см. compose_batch)
+    
+    Формат файла (JSON): список заданий или {"jobs": [...]}, задание - {"input_dir": ..., "files": [...], "output": ...};
+    files можно не указывать (берутся все HTML-файлы директории). Относительные пути отсчитываются от директории манифеста
+    
+    Args:
+        manifest_path: путь к файлу манифеста
+        
+    Returns:
+        jobs (list): задания, элемент - dict {input_dir, files, output}
+    """
+    with open(manifest_path, 'r', encoding="utf8") as file:
+        manifest = json.load(file)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+    for job_num, job in enumerate(manifest['jobs'] if isinstance(manifest, dict) else manifest, 1):
+        if 'input_dir' not in job or 'output' not in job:
+            raise TablesComposerException('В задании %d манифеста \'%s\' не указаны input_dir и output' % (job_num, manifest_path))
+        jobs.append({'input_dir': os.path.join(base_dir, job['input_dir']),
+                     'files': job.get('files') or [],
+                     'output': os.path.join(base_dir, job['output'])})
+    return jobs
+
+def compose_batch(jobs, multithread=True, executor_type=None, workers=None, cache_dir=None, cache_size_mb=DEFAULT_CACHE_SIZE_MB, dedup=False, use_mmap=False, metrics_path=None):
+    """
+    Пакетное объединение: несколько выходных документов за один запуск с общим исполнителем.
+    Документы всех заданий обрабатываются вперемешку, начиная с самых больших; выходной файл задания
+    записывается сразу после обработки всех его документов. Ошибка в одном задании не прерывает остальные
+    
+    Args:
+        jobs: задания, элемент - dict {input_dir, files, output} (см. load_manifest)
+        multithread, executor_type, workers, cache_dir, cache_size_mb, dedup, use_mmap, metrics_path: см. compose_astra_html_tables
+        
+    Returns:
+        metrics (dict): метрики пакетного объединения
+            jobs: результаты заданий - input_dir, target_path, status ('ok' или 'error'), error (описание ошибки),
+                documents, tables, cached, bytes_in, bytes_out, parse_time (время от начала запуска до обработки
+                всех документов задания), write_time (время записи), finish_time (время от начала запуска до записи), сек
+            phases: total - общее время, сек
+            totals: суммарные показатели (задания, ошибки, документы, объем на входе, пропускная способность)
+    """
+    executor_type, cores_used = resolve_executor(multithread, executor_type, workers)
+    
+    start_time = time.time()
+    log.info('++++++++++++++++++Пакетное объединение HTML-таблиц+++++++++++++++++++++++')
+    log.info('Заданий: %d. Способ обработки: %s. Используется ядер: %d', len(jobs), executor_type, cores_used)
+    cache = open_cache(cache_dir, cache_size_mb)
+    
+    results = []      # Результаты заданий
+    states = []       # Состояние заданий: список файлов, результаты обработки документов, количество необработанных документов
+    tasks = []        # Документы всех заданий: (размер файла, номер задания, номер документа)
+    for job_idx, job in enumerate(jobs):
+        result = {'input_dir': job['input_dir'], 'target_path': job['output'], 'status': None, 'error': None}
+        results.append(result)
+        states.append(None)
+        try:
+            files_list = job['files'] if len(job['files']) > 0 else find_input_files(job['input_dir'])
+            sizes = [input_signature(file_name, job['input_dir'])[0] for file_name in files_list]
+        except Exception as exc:
+            result.update({'status': 'error', 'error': str(exc)})
+            log.error('[ОШИБКА] Задание \'%s\': %s', job['output'], exc)
+            continue
+        states[job_idx] = {'files_list': files_list, 'documents': [None]*len(files_list), 'remaining': len(files_list), 'futures': []}
+        tasks += [(size, job_idx, idx) for idx, size in enumerate(sizes)]
+    tasks.sort(key=lambda task: -task[0])
+    
+    def finish_job(job_idx):
+        # Запись выходного файла задания, результаты обработки документов задания освобождаются
+        result, state = results[job_idx], states[job_idx]
+        result['parse_time'] = time.time() - start_time
+        start = time.time()
+        files_metrics = []
+        try:
+            documents = state['documents']
+            tables_count = write_combined_document(result['target_path'], [document['css_styles'] for document in documents], documents, dedup, files_metrics)
+            result.update({'status': 'ok', 'documents': len(documents), 'tables': tables_count,
+                           'cached': sum(document_metrics['cached'] for document_metrics in files_metrics),
+                           'bytes_in': sum(document_metrics['bytes_in'] for document_metrics in files_metrics),
+                           'bytes_out': os.path.getsize(result['target_path'])})
+        except Exception as exc:
+            result.update({'status': 'error', 'error': str(exc)})
+        state['documents'] = None
+        result['write_time'] = time.time() - start
+        result['finish_time'] = time.time() - start_time
+        if result['status'] == 'ok':
+            log.info('Задание \'%s\' выполнено: документов %d, таблиц %d, запись %5.2f сек', result['target_path'], result['documents'], result['tables'], result['write_time'])
+        else:
+            log.error('[ОШИБКА] Задание \'%s\': %s', result['target_path'], result['error'])
+    
+    with create_executor(executor_type, cores_used) as executor:
+        futures_to_task = {}
+        for _, job_idx, idx in tasks:
+            future = executor.submit(parse_document, states[job_idx]['files_list'][idx], jobs[job_idx]['input_dir'], cache, submit_time=time.time(), use_mmap=use_mmap)
+            futures_to_task[future] = (job_idx, idx)
+            states[job_idx]['futures'].append(future)
+        # Задания без документов
+        for job_idx, state in enumerate(states):
+            if state != None and state['remaining'] == 0:
+                finish_job(job_idx)
+        for future in confu.as_completed(futures_to_task):
+            job_idx, idx = futures_to_task[future]
+            result, state = results[job_idx], states[job_idx]
+            if result['status'] != None:
+                # Задание уже завершилось с ошибкой
+                continue
+            try:
+                state['documents'][idx] = future.result()
+            except Exception as exc:
+                result.update({'status': 'error', 'error': 'файл \'%s\': %s' % (state['files_list'][idx], exc), 'parse_time': time.time() - start_time})
+                log.error('[ОШИБКА] Задание \'%s\': %s', result['target_path'], result['error'])
+                # Оставшиеся документы задания не обрабатываются
+                for job_future in state['futures']:
+                    job_future.cancel()
+                state['documents'] = None
+                continue
+            state['remaining'] -= 1
+            if state['remaining'] == 0:
+                finish_job(job_idx)
+    
+    finish_time = time.time()
+    if cache != None:
+        log.info('Удалено устаревших записей кэша: %d', cache.evict())
+    bytes_in = sum(result.get('bytes_in', 0) for result in results)
+    metrics = {'executor': executor_type, 'workers': cores_used, 'dedup': dedup, 'cache_dir': cache_dir, 'mmap': use_mmap,
+               'jobs': results,
+               'phases': {'total': finish_time - start_time},
+               'totals': {'jobs': len(jobs),
+                          'failed': sum(result['status'] != 'ok' for result in results),
+                          'documents': sum(result.get('documents', 0) for result in results),
+                          'bytes_in': bytes_in,
+                          'throughput_mb_s': bytes_in/MB/(finish_time - start_time) if finish_time > start_time else None}}
+    log.info(BREAKING_LINE)
+    for result in results:
+        if result['status'] == 'ok':
+            log.info('[ok] %s: документов %d, таблиц %d, обработка %5.2f сек, запись %5.2f сек', result['target_path'], result['documents'], result['tables'], result['parse_time'], result['write_time'])
+        else:
+            log.info('[ошибка] %s: %s', result['target_path'], result['error'])
+    log.log(LOG_SUMMARY, 'Выполнено заданий: %d из %d. Затраченное время: %5.2f сек', len(jobs) - metrics['totals']['failed'], len(jobs), metrics['phases']['total'])
+    if metrics_path != None:
+        write_metrics(metrics, metrics_path)
+        log.info('Метрики сохранены в \'%s\'', metrics_path)
+    return metrics
+
+def snapshot_input_files(input_dir, files_list=[]):
+    """
+    Состояние входных файлов для режима наблюдения (см. watch_and_compose)
+    
+    Args:
+        input_dir: рабочая директория
+        files_list: список файлов; если пустой, то используются все HTML-файлы из input_dir (см. find_input_files)
+        
+    Returns:
+        snapshot (dict): {имя файла: (размер, время изменения)} в порядке объединения; отсутствующие файлы пропускаются
+    """
+    snapshot = {}
+    for file_name in (files_list if len(files_list) > 0 else find_input_files(input_dir)):
+        try:
+            snapshot[file_name] = input_signature(file_name, input_dir)
+        except FileNotFoundError:
+            continue
+    return snapshot
+
+def file_signature(file_path):
+    """
+    Размер и время изменения файла (None, если файла нет)
+    """
+    try:
+        file_stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (file_stat.st_size, file_stat.st_mtime_ns)
+
+def watch_and_compose(input_dir, target_path, files_list=[], multithread=True, executor_type=None, workers=None, dedup=False, use_mmap=False,
+                      poll_interval=DEFAULT_POLL_INTERVAL, debounce=DEFAULT_DEBOUNCE, stop_event=None):
+    """
+    Режим наблюдения: объединение документов и повторное объединение при создании, изменении или удалении входных файлов
+    (опрос директории раз в poll_interval секунд). Повторно обрабатываются только измененные документы; таблицы документов
+    до первого измененного копируются из предыдущего выходного файла, номера классов и таблиц пересчитываются только
+    для последующих документов. Выходной файл заменяется атомарно (os.replace), при ошибке остается прежним
+    
+    Args:
+        input_dir, target_path, files_list, multithread, executor_type, workers, dedup, use_mmap: см. compose_astra_html_tables
+        poll_interval: период проверки изменений, сек
+        debounce: серия изменений считается завершенной, если за это время файлы не менялись, сек
+        stop_event: threading.Event для остановки наблюдения или None (остановка по Ctrl+C)
+    """
+    if target_path.lower().endswith(GZIP_SUFFIX):
+        # Таблицы неизмененных документов копируются из предыдущего выходного файла без распаковки
+        raise TablesComposerException('В режиме наблюдения выходной файл не может быть сжатым: \'%s\'' % (target_path))
+    executor_type, cores_used = resolve_executor(multithread, executor_type, workers)
+    
+    def wait(seconds):
+        # Возвращает True, если наблюдение нужно остановить
+        if stop_event == None:
+            time.sleep(seconds)
+            return False
+        return stop_event.wait(seconds)
+    
+    last_error = None
+    def take_snapshot():
+        # Ошибка просмотра директории (временная недоступность, файл с именем без номера) не прерывает наблюдение;
+        # возвращает None, о повторяющейся ошибке сообщается один раз
+        nonlocal last_error
+        try:
+            current = snapshot_input_files(input_dir, files_list)
+        except Exception as exc:
+            if str(exc) != last_error:
+                log.error('[ОШИБКА] Ошибка при просмотре директории: %s', exc)
+                last_error = str(exc)
+            return None
+        last_error = None
+        return current
+    
+    log.info('++++++++++++++++++Наблюдение за директорией \'%s\'+++++++++++++++++++++++', input_dir)
+    log.info('Выходной файл: %s. Период проверки: %.1f сек. Для остановки нажмите Ctrl+C', target_path, poll_interval)
+    documents = {}     # {имя файла: (размер и время изменения, результат обработки)}
+    previous = None    # Список документов и расположение таблиц в текущем выходном файле
+    snapshot = None
+    try:
+        with create_executor(executor_type, cores_used) as executor:
+            while stop_event == None or not stop_event.is_set():
+                current = take_snapshot()
+                if current == None or current == snapshot:
+                    if wait(poll_interval):
+                        break
+                    continue
+                if snapshot != None:
+                    # Ожидание окончания серии изменений
+                    while True:
+                        if wait(debounce):
+                            return
+                        settled = take_snapshot()
+                        if settled == None:
+                            continue
+                        if settled == current:
+                            break
+                        current = settled
+                try:
+                    previous = recompose(executor, input_dir, target_path, current, documents, previous, dedup, use_mmap)
+                except Exception as exc:
+                    log.error('[ОШИБКА] Ошибка при объединении: %s. Выходной файл не изменен', exc)
+                snapshot = current
+    except KeyboardInterrupt:
+        pass
+    log.info('Наблюдение остановлено')
+
+def recompose(executor, input_dir, target_path, snapshot, documents, previous, dedup=False, use_mmap=False):
+    """
+    Повторное объединение в режиме наблюдения (см. watch_and_compose)
+    
+    Args:
+        executor: исполнитель для обработки документов
+        input_dir: рабочая директория
+        target_path: путь к выходному файлу
+        snapshot: состояние входных файлов (см. snapshot_input_files)
+        documents: результаты обработки документов {имя файла: (размер и время изменения, результат)}, обновляется
+            только после успешной записи выходного файла (иначе при следующем объединении документы, обработанные
+            до ошибки, считались бы неизмененными и их таблицы копировались бы из прежнего выходного файла)
+        previous: результат предыдущего объединения (см. возвращаемое значение) или None
+        dedup, use_mmap: см. compose_astra_html_tables
+        
+    Returns:
+        dict {files, layout, signature}: список документов, расположение таблиц (см. write_combined_stream)
+            и размер и время изменения выходного файла
+    """
+    start_time = time.time()
+    files = list(snapshot)
+    changed = [file_name for file_name in files if file_name not in documents or documents[file_name][0] != snapshot[file_name]]
+    for file_name in list(documents):
+        if file_name not in snapshot:
+            del documents[file_name]
+    parsed = {}    # Результаты обработки измененных документов
+    futures_to_file = {executor.submit(parse_document, file_name, input_dir, submit_time=time.time(), use_mmap=use_mmap): file_name for file_name in changed}
+    for future in confu.as_completed(futures_to_file):
+        file_name = futures_to_file[future]
+        try:
+            parsed[file_name] = (snapshot[file_name], future.result())
+        except Exception as exc:
+            for pending in futures_to_file:
+                pending.cancel()
+            raise TablesComposerException('файл \'%s\': %s' % (file_name, exc))
+    
+    # Документы до первого измененного (и их номера классов и таблиц) не изменились; при объединении
+    # одинаковых стилей номера классов зависят от всех документов, поэтому собираются все документы
+    copied_count = 0
+    if previous != None and not dedup and file_signature(target_path) == previous['signature']:
+        changed_set = set(changed)
+        while (copied_count < min(len(files), len(previous['files'])) and files[copied_count] == previous['files'][copied_count]
+               and files[copied_count] not in changed_set):
+            copied_count += 1
+    merged = [parsed[file_name][1] if file_name in parsed else documents[file_name][1] for file_name in files]
+    all_css_styles = [document['css_styles'] for document in merged]
+    layout = {}
+    temp_path = target_path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding="utf8") as out_file:
+            if copied_count > 0:
+                with open(target_path, 'rb') as prev_file:
+                    prev_file.seek(previous['layout']['tables_start'])
+                    prefix = (prev_file, sum(previous['layout']['sizes'][:copied_count]), copied_count)
+                    tables_count = write_combined_stream(out_file, all_css_styles, merged, dedup, prefix=prefix, layout=layout)
+            else:
+                tables_count = write_combined_stream(out_file, all_css_styles, merged, dedup, layout=layout)
+        os.replace(temp_path, target_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    documents.update(parsed)
+    layout['sizes'][:copied_count] = previous['layout']['sizes'][:copied_count] if copied_count > 0 else []
+    log.log(LOG_SUMMARY, 'Выходной файл обновлен: документов %d (обработано заново %d, скопировано без изменений %d), таблиц %d, %5.2f сек',
+            len(files), len(changed), copied_count, tables_count, time.time() - start_time)
+    return {'files': files, 'layout': layout, 'signature': file_signature(target_path)}
 
 def parse_args():
     """
@@ -262,30 +2871,81 @@ def parse_args():
         'output': путь к выходному файлу
         'files': список HTML-файлов
         'multithread': флаг многопоточной обработки
+        'executor': способ обработки документов
+        'workers': количество потоков (процессов)
+        'stream': флаг потоковой записи выходного файла
+        'cache_dir': директория кэша обработанных документов (None - без кэша, по умолчанию)
+        'cache_size_mb': максимальный размер кэша, МБ
+        'dedup': флаг объединения одинаковых стилей
+        'metrics_json': путь к JSON-файлу для сохранения метрик
+        'profile': путь к файлу статистики профилирования
+        'mmap': флаг отображения документов в память
+        'split_mb': размер документа для обработки по частям, МБ (None - без разбиения)
+        'minify': флаг сжатия выходного файла
+        'max_inflight': максимальное количество документов в обработке (None - по умолчанию)
+        'max_buffer_mb': максимальный размер документов в обработке, МБ (None - без ограничения)
+        'max_output_mb': максимальный объем тома выходного файла, МБ (None - без разбиения на тома)
+        'tables_per_volume': максимальное количество таблиц в томе (None - без ограничения)
+        'scan': флаг построения индекса директории без объединения
+        'index': путь к индексу директории (None - по умолчанию)
+        'manifest': путь к манифесту пакетного объединения (None - одно объединение по -d, -o)
+        'watch': флаг режима наблюдения за директорией
+        'poll_interval': период проверки изменений в режиме наблюдения, сек
+        'debounce': время ожидания окончания серии изменений, сек
+        'quiet': флаг вывода только итоговых сообщений
+        'skip_bad': флаг пропуска документов с ошибками
         }
     """
     
     try:
         parser = argparse.ArgumentParser(description='Склеивание сводных таблиц в HTML')
-        parser.add_argument('-d', '--dir', type=str, help='директория с HTML-файлами')
+        parser.add_argument('-d', '--dir', type=str, help='директория с HTML-файлами (в том числе *.html.gz) или zip-архив с ними')
         parser.add_argument('-f', '--file', type=str, nargs='+', help='список HTML-файлов')
-        parser.add_argument('-o', '--output', type=str, help='путь к выходному файлу')
+        parser.add_argument('-o', '--output', type=str, help='путь к выходному файлу (*.gz - со сжатием gzip)')
+        parser.add_argument('--manifest', '--batch', dest='manifest', type=str, help='JSON-файл со списком заданий пакетного объединения (input_dir, files, output) вместо -d, -o')
         parser.add_mutually_exclusive_group(required=False)
         parser.add_argument('--mthread', dest='mthread', action='store_true', help='использовать многопоточность')
         parser.add_argument('--no-mthread', dest='mthread', action='store_false', help='однопоточный режим')
 #        parser.set_defaults(mthread=True)
+        parser.add_argument('--executor', type=str, choices=EXECUTOR_TYPES, help='способ обработки документов: потоки, процессы или последовательно')
+        parser.add_argument('--workers', type=int, help='количество потоков (процессов)')
+        parser.add_argument('--stream', dest='stream', action='store_true', help='потоковая запись выходного файла по мере обработки документов')
+        parser.add_argument('--cache', dest='cache', action='store_true', help='использовать кэш обработанных документов в пользовательской директории кэшей')
+        parser.add_argument('--cache-dir', dest='cache_dir', type=str, help='использовать кэш обработанных документов в указанной директории')
+        parser.add_argument('--no-cache', dest='no_cache', action='store_true', help='не использовать кэш обработанных документов (по умолчанию)')
+        parser.add_argument('--dedup-styles', dest='dedup', action='store_true', help='объединять одинаковые стили всех документов в общие классы')
+        parser.add_argument('--cache-size-mb', dest='cache_size_mb', type=int, default=DEFAULT_CACHE_SIZE_MB, help='максимальный размер кэша, МБ')
+        parser.add_argument('--metrics-json', dest='metrics_json', type=str, help='путь к JSON-файлу для сохранения метрик по этапам и файлам')
+        parser.add_argument('--profile', dest='profile', type=str, help='путь к файлу статистики cProfile (также сохраняется отчет tracemalloc); для профиля обработки документов использовать --executor serial')
+        parser.add_argument('--mmap', dest='mmap', action='store_true', help='отображать документы в память и обрабатывать таблицы без декодирования (для больших документов)')
+        parser.add_argument('--split-mb', dest='split_mb', type=int, default=DEFAULT_SPLIT_MB, help='обрабатывать документы больше этого размера (МБ) по частям параллельно, 0 - без разбиения')
+        parser.add_argument('--minify', dest='minify', action='store_true', help='сжатие выходного файла: только используемые стили, короткие имена классов, без лишних пробелов')
+        parser.add_argument('--max-inflight', dest='max_inflight', type=int, help='максимальное количество документов в обработке (включает потоковый режим)')
+        parser.add_argument('--max-buffer-mb', dest='max_buffer_mb', type=int, help='максимальный суммарный размер документов в обработке, МБ (включает потоковый режим)')
+        parser.add_argument('--max-output-mb', dest='max_output_mb', type=int, help='записывать выходной файл томами не больше этого размера, МБ, с оглавлением')
+        parser.add_argument('--tables-per-volume', dest='tables_per_volume', type=int, help='записывать выходной файл томами не больше чем по столько таблиц, с оглавлением')
+        parser.add_argument('--scan', dest='scan', action='store_true', help='только просмотреть документы и сохранить индекс директории (-o не требуется)')
+        parser.add_argument('--index', dest='index', type=str, help='путь к индексу директории (по умолчанию %s в директории с HTML-файлами, для zip-архива - <архив>%s)' % (SCAN_INDEX_FILE_NAME, SCAN_INDEX_ZIP_SUFFIX))
+        parser.add_argument('--watch', dest='watch', action='store_true', help='наблюдать за директорией и обновлять выходной файл при изменении документов')
+        parser.add_argument('--poll-interval', dest='poll_interval', type=float, default=DEFAULT_POLL_INTERVAL, help='период проверки изменений в режиме наблюдения, сек')
+        parser.add_argument('--debounce', dest='debounce', type=float, default=DEFAULT_DEBOUNCE, help='время без изменений, после которого выполняется объединение, сек')
         parser.add_argument('--debug', dest='debug', action='store_true', required=False, help='режим отладки')
+        parser.add_argument('--skip-bad', dest='skip_bad', action='store_true', help='пропускать документы с ошибками (номера таблиц остальных документов сохраняются)')
+        parser.add_argument('--quiet', dest='quiet', action='store_true', help='выводить в журнал только итоговые сообщения, предупреждения и ошибки')
         parser.set_defaults(debug=False)
         
         args_parser_result = parser.parse_args()
     
         # Словарь с результатами обработки
         args = {}
-        if(args_parser_result.dir and args_parser_result.output):
+        args['manifest'] = args_parser_result.manifest
+        if(args_parser_result.dir and (args_parser_result.output or args_parser_result.scan)):
             args['dir'] = args_parser_result.dir
             args['output'] = args_parser_result.output
+        elif args['manifest']:
+            args['dir'] = args['output'] = None
         else:
-            raise ArgsParserException('Не переданы необходимые аргументы: -d, -o')
+            raise ArgsParserException('Не переданы необходимые аргументы: -d, -o (или --manifest)')
         
         # Парсинг списка файлов
         if (args_parser_result.file):
@@ -305,9 +2965,65 @@ def parse_args():
         
         # Многопоточность
         args['multithread'] = args_parser_result.mthread    
+        args['executor'] = args_parser_result.executor
+        if args_parser_result.workers != None and args_parser_result.workers < 1:
+            raise ArgsParserException('Количество потоков (процессов) должно быть положительным')
+        args['workers'] = args_parser_result.workers
+        args['stream'] = args_parser_result.stream
+        
+        # Кэш обработанных документов (только по явному запросу)
+        args['cache_dir'] = args_parser_result.cache_dir
+        if args['cache_dir'] == None and args_parser_result.cache:
+            args['cache_dir'] = default_cache_dir()
+        if args_parser_result.no_cache:
+            args['cache_dir'] = None
+        args['cache_size_mb'] = args_parser_result.cache_size_mb
+        
+        # Объединение одинаковых стилей
+        args['dedup'] = args_parser_result.dedup
+        
+        # Метрики и профилирование
+        args['metrics_json'] = args_parser_result.metrics_json
+        args['profile'] = args_parser_result.profile
+        
+        # Отображение документов в память
+        args['mmap'] = args_parser_result.mmap
+        
+        # Обработка больших документов по частям
+        if args_parser_result.split_mb < 0:
+            raise ArgsParserException('Размер документа для обработки по частям не может быть отрицательным')
+        args['split_mb'] = args_parser_result.split_mb if args_parser_result.split_mb > 0 else None
+        
+        # Сжатие выходного файла
+        args['minify'] = args_parser_result.minify
+        
+        # Ограничение количества и объема документов в обработке
+        if (args_parser_result.max_inflight != None and args_parser_result.max_inflight < 1) or (args_parser_result.max_buffer_mb != None and args_parser_result.max_buffer_mb < 1):
+            raise ArgsParserException('Количество и размер документов в обработке должны быть положительными')
+        args['max_inflight'] = args_parser_result.max_inflight
+        args['max_buffer_mb'] = args_parser_result.max_buffer_mb
+        
+        # Разбиение выходного файла на тома
+        if (args_parser_result.max_output_mb != None and args_parser_result.max_output_mb < 1) or (args_parser_result.tables_per_volume != None and args_parser_result.tables_per_volume < 1):
+            raise ArgsParserException('Объем и количество таблиц тома должны быть положительными')
+        args['max_output_mb'] = args_parser_result.max_output_mb
+        args['tables_per_volume'] = args_parser_result.tables_per_volume
+        
+        # Индекс директории
+        args['scan'] = args_parser_result.scan
+        args['index'] = args_parser_result.index
+        
+        # Режим наблюдения
+        args['watch'] = args_parser_result.watch
+        if args_parser_result.poll_interval <= 0 or args_parser_result.debounce < 0:
+            raise ArgsParserException('Период проверки должен быть положительным, время ожидания - неотрицательным')
+        args['poll_interval'] = args_parser_result.poll_interval
+        args['debounce'] = args_parser_result.debounce
     
         # Режим вывода ошибок
         args['debug'] = args_parser_result.debug
+        args['quiet'] = args_parser_result.quiet
+        args['skip_bad'] = args_parser_result.skip_bad
 
     except Exception as e:
         print(e)
@@ -315,40 +3031,76 @@ def parse_args():
         
     return args
     
-def configure_logging(debug=False):
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Передача записей журнала в очередь без форматирования: сообщение формируется потоком записи
+    (см. configure_logging), а не рабочим потоком
+    """
+    def prepare(self, record):
+        return record
+
+def configure_logging(debug=False, summary=False, queued=True):
     """
     Инициализация логирования
     
     Args:
         debug: флаг отладки
+        summary: выводить только итоговые сообщения (уровень LOG_SUMMARY), предупреждения и ошибки
+        queued: записи передаются через очередь одному потоку записи (QueueListener), рабочие потоки
+            не ожидают вывода в консоль и файл; поток останавливается в stop_logging
     Returns:
         logger: объект для вывода в лог
     
     """
+    global _log_listener
     try:
         logger = logging.getLogger(LOGGER_NAME)
 
         # Вывод в консоль        
         console_log_handler = logging.StreamHandler()
-        logger.addHandler(console_log_handler)
         
         # Вывод в файл
         if not os.path.exists('log'):
             os.makedirs('log')
         file_log_handler = logging.FileHandler(LOG_FILE_NAME, mode='w')
-        logger.addHandler(file_log_handler)
         
         formatter = logging.Formatter('%(message)s')
         file_log_handler.setFormatter(formatter)
         console_log_handler.setFormatter(formatter)
         
-        logger.setLevel('DEBUG' if debug else 'INFO')
+        if queued:
+            stop_logging()
+            log_queue = queue.SimpleQueue()
+            _log_listener = logging.handlers.QueueListener(log_queue, console_log_handler, file_log_handler)
+            _log_listener.start()
+            atexit.register(stop_logging)
+            logger.addHandler(DeferredQueueHandler(log_queue))
+        else:
+            logger.addHandler(console_log_handler)
+            logger.addHandler(file_log_handler)
+        
+        logger.setLevel('DEBUG' if debug else (LOG_SUMMARY if summary else 'INFO'))
         
         logger.propagate = False
         
     except Exception as e:
         raise LoggerException(e)
     return logger
+
+def stop_logging():
+    """
+    Остановка потока записи журнала (см. configure_logging) после вывода всех записей из очереди, закрытие файла журнала
+    """
+    global _log_listener
+    if _log_listener != None:
+        listener = _log_listener
+        _log_listener = None
+        for handler in list(logging.getLogger(LOGGER_NAME).handlers):
+            if isinstance(handler, logging.handlers.QueueHandler) and handler.queue == listener.queue:
+                logging.getLogger(LOGGER_NAME).removeHandler(handler)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
     
 def run_from_command_line():
     """
@@ -358,8 +3110,39 @@ def run_from_command_line():
     try:
 #        sys.stdout = open(LOG_FILE_NAME, "w")
         args = parse_args()
-        log = configure_logging(args['debug'])
-        compose_astra_html_tables(args['dir'], args['output'], args['files'], args['multithread'])
+        log = configure_logging(args['debug'], args['quiet'])
+        if args['manifest']:
+            batch_metrics = compose_batch(load_manifest(args['manifest']), args['multithread'], args['executor'], args['workers'],
+                                          args['cache_dir'], args['cache_size_mb'], args['dedup'], args['mmap'], args['metrics_json'])
+            if batch_metrics['totals']['failed'] > 0:
+                raise TablesComposerException('Заданий с ошибками: %d' % (batch_metrics['totals']['failed']))
+            return
+        index_path = args['index'] if args['index'] else default_index_path(args['dir'])
+        if args['scan']:
+            scan_directory(args['dir'], args['files'], args['workers'], index_path)
+            return
+        if args['watch']:
+            watch_and_compose(args['dir'], args['output'], args['files'], args['multithread'], args['executor'], args['workers'], args['dedup'], args['mmap'],
+                              args['poll_interval'], args['debounce'])
+            return
+        compose_args = (args['dir'], args['output'], args['files'], args['multithread'], args['executor'], args['workers'], args['stream'],
+                        args['cache_dir'], args['cache_size_mb'], args['dedup'])
+        # Индекс по умолчанию используется, только если он был сохранен ранее
+        scan_index = index_path if args['index'] or os.path.exists(index_path) else None
+        if args['profile']:
+            metrics, profile = run_profiled(compose_astra_html_tables, args['profile'], *compose_args, use_mmap=args['mmap'], split_mb=args['split_mb'],
+                                            max_inflight=args['max_inflight'], max_buffer_mb=args['max_buffer_mb'], minify=args['minify'],
+                                            max_output_mb=args['max_output_mb'], tables_per_volume=args['tables_per_volume'],
+                                            scan_index=scan_index, skip_bad=args['skip_bad'])
+            log.log(LOG_SUMMARY, 'Профилирование: пиковый объем памяти %.1f МБ, статистика сохранена в \'%s\'', profile['peak_memory_mb'], args['profile'])
+            if args['metrics_json']:
+                metrics['profile'] = profile
+                write_metrics(metrics, args['metrics_json'])
+        else:
+            compose_astra_html_tables(*compose_args, metrics_path=args['metrics_json'], use_mmap=args['mmap'], split_mb=args['split_mb'],
+                                      max_inflight=args['max_inflight'], max_buffer_mb=args['max_buffer_mb'], minify=args['minify'],
+                                      max_output_mb=args['max_output_mb'], tables_per_volume=args['tables_per_volume'],
+                                      scan_index=scan_index, skip_bad=args['skip_bad'])
     except ArgsParserException as e:
         print('[ОШИБКА] Ошибка при парсинге аргументов командной строки')
         if DEFAULT_DEBUG_MODE:
@@ -370,14 +3153,14 @@ def run_from_command_line():
         if args['debug']:
             logging.exception(e)
     except TablesComposerException as e:
-        log.error('[ОШИБКА] Ошибка при обработке таблиц')
-        log.debug(e)
+        log.error('[ОШИБКА] Ошибка при обработке таблиц: %s', e)
     
     except Exception as e:
         log.error('[ОШИБКА] Ошибка обшего содержания')
         log.debug(e)
     finally:
-        # Очистка обработчиков у логгера
+        # Вывод оставшихся записей и очистка обработчиков у логгера
+        stop_logging()
         if log != None:
             handlers = log.handlers[:]
             for handler in handlers:
@@ -388,6 +3171,20 @@ def run_from_command_line():
 # Исключения    
 class TablesComposerException(Exception):
     pass
+class DocumentException(TablesComposerException):
+    """
+    Ошибка обработки отдельного документа: имя файла, этап (см. DOCUMENT_PHASES) и описание ошибки
+    """
+    def __init__(self, file_name, phase, message):
+        # Исходное исключение передается текстом: оно может не передаваться между процессами
+        super().__init__(file_name, phase, str(message))
+        self.file_name = file_name
+        self.phase = phase
+        self.message = str(message)
+    
+    def __str__(self):
+        return 'файл \'%s\', этап \'%s\': %s' % (self.file_name, DOCUMENT_PHASES.get(self.phase, self.phase), self.message)
+    
 class ArgsParserException(Exception):
     pass
 class LoggerException(Exception):
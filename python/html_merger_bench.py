@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+#### Измерение производительности объединения HTML-таблиц (html_merger)
+#### на сгенерированном (см. html_merger_corpus) или реальном наборе документов
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import os.path
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource     # Только Unix: максимальный объем памяти дочерних процессов
+except ImportError:
+    resource = None
+
+import html_merger
+import html_merger_corpus
+import html_merger_legacy
+
+## Константы
+DEFAULT_RESULTS_PATH = 'bench_results.json'      # Файл для сохранения результатов
+DEFAULT_REPEAT = 3                               # Количество повторов каждого измерения (берется лучшее время)
+BENCH_LOGGER_NAME = html_merger.LOGGER_NAME + '.bench'
+MB = 1024*1024
+
+def configure_logging():
+    """
+    Настройка логгера html_merger: во время измерений выводятся только предупреждения и ошибки
+    """
+    logger = logging.getLogger(BENCH_LOGGER_NAME)
+    logger.setLevel('WARNING')
+    html_merger.log = logger
+
+def best_time(fn, repeat):
+    """
+    Лучшее время выполнения функции из нескольких повторов
+
+    Args:
+        fn: функция без аргументов
+        repeat: количество повторов
+
+    Returns:
+        seconds: время, сек
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def peak_memory(fn):
+    """
+    Пиковый объем памяти, выделенной интерпретатором в текущем процессе при выполнении функции
+
+    Returns:
+        peak_mb: пиковый объем, МБ
+    """
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]/MB
+    finally:
+        tracemalloc.stop()
+
+def children_max_rss():
+    """
+    Максимальный резидентный объем памяти завершенных дочерних процессов, МБ (None, если недоступно)
+    """
+    if resource == None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # В macOS значение в байтах, в Linux - в килобайтах
+    return max_rss/MB if platform.system() == 'Darwin' else max_rss/1024
+
+def measure_phases(input_dir, files_list, executor_type, workers, target_path, use_mmap=False):
+    """
+    Измерение времени отдельных этапов объединения: считывание стилей, обработка документов, запись
+
+    Returns:
+        phases (dict): {styles, parse, write} - время этапов, сек
+    """
+    phases = {}
+    dirs = [input_dir]*len(files_list)
+    with html_merger.create_executor(executor_type, workers) as executor:
+        start = time.perf_counter()
+        all_css_styles = list(executor.map(html_merger.read_style_block, files_list, dirs))
+        phases['styles'] = time.perf_counter() - start
+        start = time.perf_counter()
+        documents = list(executor.map(html_merger.parse_document, files_list, dirs, [None]*len(files_list), [None]*len(files_list), [use_mmap]*len(files_list)))
+        phases['parse'] = time.perf_counter() - start
+    start = time.perf_counter()
+    starts = html_merger.class_num_starts([len(css_styles) for css_styles in all_css_styles])
+    with open(target_path, 'w', encoding="utf8") as out_file:
+        html_merger.write_header(out_file, [html_merger.render_styles(css_styles, starts[idx]) for idx, css_styles in enumerate(all_css_styles)])
+        for idx, document in enumerate(documents):
+            class_nums = range(starts[idx], starts[idx] + len(document['css_styles']))
+            html_merger.write_document_tables(out_file, html_merger.render_tables(document['tables'], class_nums, idx+1))
+        out_file.write(html_merger.HTML_FOOTER)
+    phases['write'] = time.perf_counter() - start
+    return phases
+
+def run_legacy(input_dir, files_list, target_path):
+    """
+    Объединение документов исходной однопоточной реализацией (html_merger_legacy), вывод в консоль подавляется
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        html_merger_legacy.compose_astra_HTML_tables(input_dir, target_path, list(files_list))
+
+def run_benchmark(input_dir, files_list, executor_types, workers, repeat=DEFAULT_REPEAT, legacy=True, use_mmap=False):
+    """
+    Измерение производительности объединения для каждого способа обработки документов
+
+    Args:
+        input_dir: директория с документами
+        files_list: список документов
+        executor_types: способы обработки (см. html_merger.EXECUTOR_TYPES)
+        workers: количество потоков (процессов)
+        repeat: количество повторов каждого измерения
+        legacy (boolean): измерять также исходную реализацию (html_merger_legacy)
+        use_mmap (boolean): отображение документов в память (см. html_merger.scan_document_bytes)
+
+    Returns:
+        results (dict): результаты измерений, см. описание полей в коде
+    """
+    input_bytes = sum(os.path.getsize(os.path.join(input_dir, file_name)) for file_name in files_list)
+    results = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpu_count': multiprocessing.cpu_count(),
+               'workers': workers,
+               'repeat': repeat,
+               'mmap': use_mmap,
+               'corpus': {'input_dir': input_dir, 'documents': len(files_list), 'input_mb': input_bytes/MB},
+               'modes': {}}
+    work_dir = tempfile.mkdtemp(prefix='html_merger_bench_')
+    target_path = os.path.join(work_dir, 'CombinedTable.html')
+    try:
+        for executor_type in executor_types:
+            print('Измерение: %s' % (executor_type))
+            runs = []
+            for _ in range(repeat):
+                runs.append(measure_phases(input_dir, files_list, executor_type, workers, target_path, use_mmap))
+            phases = {phase: min(run[phase] for run in runs) for phase in runs[0]}
+            total = best_time(lambda: html_merger.compose_astra_html_tables(input_dir, target_path, files_list,
+                                                                            executor_type=executor_type, workers=workers, use_mmap=use_mmap), repeat)
+            total_stream = best_time(lambda: html_merger.compose_astra_html_tables(input_dir, target_path, files_list,
+                                                                                   executor_type=executor_type, workers=workers, stream=True, use_mmap=use_mmap), repeat)
+            output_bytes = os.path.getsize(target_path)
+            # Для процессов учитывается только память родительского процесса, см. children_max_rss_mb
+            memory = peak_memory(lambda: html_merger.compose_astra_html_tables(input_dir, target_path, files_list,
+                                                                               executor_type=executor_type, workers=workers, use_mmap=use_mmap))
+            memory_stream = peak_memory(lambda: html_merger.compose_astra_html_tables(input_dir, target_path, files_list,
+                                                                                      executor_type=executor_type, workers=workers, stream=True, use_mmap=use_mmap))
+            results['modes'][executor_type] = {'phases': phases,
+                                               'total': total,
+                                               'total_stream': total_stream,
+                                               'throughput_mb_s': input_bytes/MB/total,
+                                               'output_mb': output_bytes/MB,
+                                               'peak_memory_mb': memory,
+                                               'peak_memory_stream_mb': memory_stream,
+                                               'children_max_rss_mb': children_max_rss()}
+        if legacy:
+            print('Измерение: legacy')
+            try:
+                total = best_time(lambda: run_legacy(input_dir, files_list, target_path), repeat)
+                results['legacy'] = {'total': total,
+                                     'throughput_mb_s': input_bytes/MB/total,
+                                     'peak_memory_mb': peak_memory(lambda: run_legacy(input_dir, files_list, target_path))}
+            except Exception as exc:
+                results['legacy'] = {'error': str(exc)}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def print_results(results, baseline=None):
+    """
+    Вывод результатов измерений (и сравнения с предыдущими результатами) в консоль
+
+    Args:
+        results: результаты run_benchmark
+        baseline: результаты предыдущего запуска или None
+    """
+    corpus = results['corpus']
+    print(html_merger.BREAKING_LINE)
+    print('Документов: %d, объем: %.1f МБ, ядер: %d, потоков (процессов): %d' % (corpus['documents'], corpus['input_mb'], results['cpu_count'], results['workers']))
+    print('%-8s %8s %8s %8s %8s %8s %8s %9s %9s' % ('режим', 'стили', 'обраб.', 'запись', 'всего', 'поток.', 'МБ/с', 'память', 'пот.пам.'))
+    for executor_type, mode in results['modes'].items():
+        phases = mode['phases']
+        line = '%-8s %8.3f %8.3f %8.3f %8.3f %8.3f %8.1f %9.1f %9.1f' % (executor_type, phases['styles'], phases['parse'], phases['write'], mode['total'],
+                                                                 mode['total_stream'], mode['throughput_mb_s'], mode['peak_memory_mb'], mode['peak_memory_stream_mb'])
+        if baseline != None and executor_type in baseline.get('modes', {}):
+            line += '   x%.2f к базовому' % (baseline['modes'][executor_type]['total']/mode['total'])
+        print(line)
+    legacy = results.get('legacy')
+    if legacy != None:
+        if 'error' in legacy:
+            print('legacy: ошибка: %s' % (legacy['error']))
+        else:
+            print('%-8s %8s %8s %8s %8.3f %8s %8.1f %9.1f' % ('legacy', '-', '-', '-', legacy['total'], '-', legacy['throughput_mb_s'], legacy['peak_memory_mb']))
+    print(html_merger.BREAKING_LINE)
+
+def parse_args():
+    """
+    Считывание аргументов командной строки
+
+    Returns:
+        argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description='Измерение производительности объединения HTML-таблиц')
+    parser.add_argument('-d', '--dir', type=str, help='директория с документами (по умолчанию документы генерируются)')
+    parser.add_argument('--documents', type=int, default=html_merger_corpus.DEFAULT_DOCUMENTS, help='количество генерируемых документов')
+    parser.add_argument('--tables', type=int, default=html_merger_corpus.DEFAULT_TABLES, help='количество таблиц в документе')
+    parser.add_argument('--rows', type=int, default=html_merger_corpus.DEFAULT_ROWS, help='количество строк в таблице')
+    parser.add_argument('--columns', type=int, default=html_merger_corpus.DEFAULT_COLUMNS, help='количество столбцов в таблице')
+    parser.add_argument('--classes', type=int, default=html_merger_corpus.DEFAULT_CLASSES, help='количество классов стилей в документе')
+    parser.add_argument('--seed', type=int, default=html_merger_corpus.DEFAULT_SEED, help='начальное значение генератора случайных чисел')
+    parser.add_argument('--executors', type=str, nargs='+', choices=html_merger.EXECUTOR_TYPES, default=list(html_merger.EXECUTOR_TYPES),
+                        help='способы обработки документов')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='количество потоков (процессов)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='количество повторов каждого измерения')
+    parser.add_argument('--mmap', dest='mmap', action='store_true', help='отображать документы в память (обработка без декодирования)')
+    parser.add_argument('--no-legacy', dest='legacy', action='store_false', help='не измерять исходную реализацию')
+    parser.add_argument('-o', '--output', type=str, default=DEFAULT_RESULTS_PATH, help='файл для сохранения результатов (JSON)')
+    parser.add_argument('--baseline', type=str, help='файл с результатами предыдущего запуска для сравнения')
+    return parser.parse_args()
+
+def run_from_command_line():
+    """
+    Запуск из командной строки
+    """
+    args = parse_args()
+    configure_logging()
+    corpus_dir = None
+    try:
+        if args.dir:
+            input_dir = args.dir
+            files_list = html_merger.find_input_files(input_dir)
+        else:
+            corpus_dir = tempfile.mkdtemp(prefix='html_merger_corpus_')
+            input_dir = corpus_dir
+            files_list = html_merger_corpus.generate_corpus(corpus_dir, args.documents, args.tables, args.rows, args.columns, args.classes, args.seed)
+        results = run_benchmark(input_dir, files_list, args.executors, args.workers, args.repeat, args.legacy, args.mmap)
+        if corpus_dir != None:
+            results['corpus'].update({'generated': True, 'tables': args.tables, 'rows': args.rows, 'columns': args.columns,
+                                      'classes': args.classes, 'seed': args.seed})
+    finally:
+        if corpus_dir != None:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding="utf8") as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    with open(args.output, 'w', encoding="utf8") as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+    print('Результаты сохранены в \'%s\'' % (args.output))
+
+if __name__ == '__main__':
+    run_from_command_line()
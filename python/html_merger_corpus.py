@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#### Генерация набора HTML-документов в формате FastReport
+#### для проверки и измерения производительности html_merger
+
+import argparse
+import os
+import random
+
+## Константы
+DEFAULT_DOCUMENTS = 20      # Количество документов
+DEFAULT_TABLES = 10         # Количество таблиц в документе
+DEFAULT_ROWS = 50           # Количество строк в таблице
+DEFAULT_COLUMNS = 6         # Количество столбцов в таблице
+DEFAULT_CLASSES = 100       # Количество классов стилей в документе
+DEFAULT_SEED = 2017         # Начальное значение генератора случайных чисел
+
+# Значения свойств стилей (набор ограничен, чтобы стили разных документов повторялись, как в реальных выгрузках)
+FONT_SIZES = ('9px', '10px', '11px', '13px')
+FONT_WEIGHTS = ('normal', 'bold')
+TEXT_ALIGNS = ('Left', 'Center', 'Right')
+BACKGROUND_COLORS = ('Transparent', '#FFFFFF', '#D8D8D8')
+BORDER_WIDTHS = ('0px 1px 1px 0px', '1px 1px 1px 1px', '0px 0px 1px 0px')
+
+# Заголовки таблиц
+TABLE_TITLES = ('Максимальные напряжения в отводах',
+                'Максимальные напряжения в тройниках',
+                'Максимальные напряжения в прямых трубах',
+                'Нагрузки на патрубки арматуры',
+                'Нагрузки на оборудование и конструкции')
+COLUMN_TITLES = ('Узел', 'Элемент', 'Режим', 'σ, МПа', '[σ], МПа', 'σ/[σ]', 'Fx, Н', 'Fy, Н', 'Fz, Н', 'Mx, Н·м')
+
+def generate_style(rnd):
+    """
+    Генерация свойств одного стиля
+
+    Args:
+        rnd: генератор случайных чисел
+
+    Returns:
+        properties_text: свойства стиля
+    """
+    return ('font-family: Arial; font-size: %s; font-weight: %s; color: #000000; background-color: %s; '
+            'text-align: %s; vertical-align: Middle; border-style: solid; border-width: %s; border-color: #000000; ' % (
+            rnd.choice(FONT_SIZES), rnd.choice(FONT_WEIGHTS), rnd.choice(BACKGROUND_COLORS), rnd.choice(TEXT_ALIGNS), rnd.choice(BORDER_WIDTHS)))
+
+def generate_table(rnd, document_num, table_num, rows, columns, classes_count):
+    """
+    Генерация HTML-кода одной таблицы
+
+    Args:
+        rnd: генератор случайных чисел
+        document_num: номер документа (используется в метке таблицы Т<документ>-<таблица>)
+        table_num: номер таблицы в документе
+        rows: количество строк
+        columns: количество столбцов
+        classes_count: количество классов стилей в документе
+
+    Returns:
+        lines (list): строки HTML-кода таблицы
+    """
+    widths = [rnd.randint(60, 160) for _ in range(columns)]
+    lines = ['<a name="PageN%d"></a>' % (table_num),
+             '<table width="%d" border="0" cellspacing="0" cellpadding="0">' % (sum(widths)),
+             '<tr style="height: 1px">%s</tr>' % (''.join('<td width="%d"/>' % (width) for width in widths)),
+             '<tr style="height:20px">',
+             '    <td class="s%d" colspan="%d">Т%d-%d. %s</td>' % (rnd.randrange(classes_count), columns, document_num, table_num, rnd.choice(TABLE_TITLES)),
+             '</tr>',
+             '<tr style="height:18px">']
+    for column in range(columns):
+        lines.append('    <td class="s%d">%s</td>' % (rnd.randrange(classes_count), COLUMN_TITLES[column % len(COLUMN_TITLES)]))
+    lines.append('</tr>')
+    for row in range(rows):
+        lines.append('<tr style="height:18px">  ')
+        lines.append('    <td class="s%d">%d</td>' % (rnd.randrange(classes_count), row + 1))
+        for _ in range(columns - 1):
+            lines.append('    <td class="s%d">%.2f</td>' % (rnd.randrange(classes_count), rnd.uniform(-1000, 1000)))
+        lines.append('</tr>')
+    lines.append('</table>')
+    lines.append('<div class="page_break">&nbsp;</div>')
+    return lines
+
+def generate_document(rnd, document_num, tables, rows, columns, classes_count):
+    """
+    Генерация HTML-документа в формате FastReport
+
+    Args:
+        rnd: генератор случайных чисел
+        document_num: номер документа
+        tables: количество таблиц
+        rows: количество строк в таблице
+        columns: количество столбцов в таблице
+        classes_count: количество классов стилей
+
+    Returns:
+        content: содержимое документа
+    """
+    lines = ['<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN">',
+             '<html>',
+             '<head>',
+             '<meta http-equiv="Content-Type" content="text/html; charset=utf-8">',
+             '<meta name=Generator content="FastReport 5.0 http://www.fast-report.com">',
+             '<title></title>',
+             '<style type="text/css"><!-- ',
+             '.page_break {page-break-before: always;}']
+    for class_num in range(classes_count):
+        lines.append('.s%d {%s}' % (class_num, generate_style(rnd)))
+    lines += ['--></style>',
+              '</head>',
+              '<body bgcolor="#FFFFFF" text="#000000">']
+    for table_num in range(1, tables + 1):
+        lines += generate_table(rnd, document_num, table_num, rows, columns, classes_count)
+    lines += ['</body>',
+              '</html>',
+              '']
+    # FastReport сохраняет документы с переводами строк Windows
+    return '\r\n'.join(lines)
+
+def generate_corpus(output_dir, documents=DEFAULT_DOCUMENTS, tables=DEFAULT_TABLES, rows=DEFAULT_ROWS, columns=DEFAULT_COLUMNS,
+                    classes=DEFAULT_CLASSES, seed=DEFAULT_SEED):
+    """
+    Генерация набора документов 1.html, 2.html, ... в директории output_dir
+
+    Args:
+        output_dir: директория для документов (создается при необходимости)
+        documents: количество документов
+        tables: количество таблиц в документе
+        rows: количество строк в таблице
+        columns: количество столбцов в таблице
+        classes: количество классов стилей в документе (в отдельных документах - немного больше)
+        seed: начальное значение генератора случайных чисел
+
+    Returns:
+        files_list (list): имена созданных файлов в порядке номеров документов
+    """
+    rnd = random.Random(seed)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    files_list = []
+    for document_num in range(1, documents + 1):
+        file_name = '%d.html' % (document_num)
+        content = generate_document(rnd, document_num, tables, rows, columns, classes + rnd.randint(0, max(1, classes//10)))
+        with open(os.path.join(output_dir, file_name), 'w', encoding="utf8", newline='') as file:
+            file.write(content)
+        files_list.append(file_name)
+    return files_list
+
+def parse_args():
+    """
+    Считывание аргументов командной строки
+
+    Returns:
+        argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description='Генерация набора HTML-документов в формате FastReport')
+    parser.add_argument('-o', '--output', type=str, required=True, help='директория для документов')
+    parser.add_argument('--documents', type=int, default=DEFAULT_DOCUMENTS, help='количество документов')
+    parser.add_argument('--tables', type=int, default=DEFAULT_TABLES, help='количество таблиц в документе')
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help='количество строк в таблице')
+    parser.add_argument('--columns', type=int, default=DEFAULT_COLUMNS, help='количество столбцов в таблице')
+    parser.add_argument('--classes', type=int, default=DEFAULT_CLASSES, help='количество классов стилей в документе')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='начальное значение генератора случайных чисел')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    files_list = generate_corpus(args.output, args.documents, args.tables, args.rows, args.columns, args.classes, args.seed)
+    print('Создано документов: %d в директории \'%s\'' % (len(files_list), args.output))
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+#### Сверка результатов и производительности объединения HTML-таблиц (html_merger)
+#### с исходной реализацией (html_merger_legacy) на сгенерированном и реальных наборах документов
+
+import argparse
+import hashlib
+import html.parser
+import json
+import multiprocessing
+import os
+import os.path
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import html_merger
+import html_merger_bench
+import html_merger_corpus
+
+## Константы
+DEFAULT_BASELINE_PATH = 'harness_baseline.json'    # Файл с базовыми результатами (хэши выходных документов и пропускная способность)
+DEFAULT_REPEAT = 3                               # Количество повторов каждого измерения (берется лучшее время)
+DEFAULT_TOLERANCE = 0.2                          # Допустимое снижение пропускной способности относительно базовой (доля)
+DIFF_CONTEXT = 3                                 # Количество элементов до и после первого расхождения в отчете
+REFERENCE_MODE = 'legacy'                        # Имя режима исходной реализации в результатах
+ANY_TABLE_LABEL_RE = re.compile(r'[TТ]\d+-\d+')  # Номер таблицы (латинская или кириллическая Т): исходная реализация нумерует таблицы T<n>-1
+OUTPUT_TABLE_LABEL_RE = re.compile(r'T(\d+)-(\d+)')    # Номер таблицы в выходном документе html_merger: T<документ>-<таблица>
+MB = html_merger.MB
+
+class TableTokenizer(html.parser.HTMLParser):
+    """
+    Разбор выходного документа в последовательность элементов таблиц для структурного сравнения.
+    Учитывается только содержимое таблиц (исходная реализация захватывает текст между таблицами документа,
+    html_merger добавляет <br> после документа), пробельный текст между тегами пропускается, пробелы в тексте
+    сокращаются до одного, классы заменяются свойствами стилей (нумерация классов, кавычки, общие классы и
+    короткие имена не влияют на результат), номера таблиц - меткой T#
+    """
+    def __init__(self, styles):
+        """
+        Args:
+            styles (dict): свойства стилей выходного документа по именам классов (см. read_output_styles)
+        """
+        super().__init__(convert_charrefs=True)
+        self.styles = styles
+        self.depth = 0              # Глубина вложенности таблиц
+        self.tokens = []            # Элементы таблиц: ('start', тег, атрибуты), ('end', тег), ('text', текст)
+        self.table_labels = []      # Номера таблиц, найденные в каждой таблице верхнего уровня (до нормализации)
+
+    def normalize_attr(self, name, value):
+        if name == 'class' and value != None:
+            return (name, self.styles.get(value, 'не объявлен: %s' % (value)))
+        return (name, value)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            if self.depth == 0:
+                self.table_labels.append([])
+            self.depth += 1
+        if self.depth > 0:
+            self.tokens.append(('start', tag, tuple(self.normalize_attr(name, value) for name, value in attrs)))
+
+    def handle_endtag(self, tag):
+        if self.depth > 0:
+            self.tokens.append(('end', tag))
+            if tag == 'table':
+                self.depth -= 1
+
+    def handle_data(self, data):
+        if self.depth > 0:
+            text = ' '.join(data.split())
+            if text:
+                self.table_labels[-1] += ANY_TABLE_LABEL_RE.findall(text)
+                self.tokens.append(('text', ANY_TABLE_LABEL_RE.sub('T#', text)))
+
+def read_output_styles(content):
+    """
+    Свойства стилей выходного документа в каноническом виде (см. html_merger.normalize_css_properties)
+
+    Returns:
+        styles (dict): {имя класса: свойства}
+    """
+    m = html_merger.STYLE_BLOCK_RE.search(content)
+    if m == None:
+        return {}
+    return {class_name: html_merger.normalize_css_properties(properties_text)
+            for class_name, properties_text in html_merger.CSS_RULE_RE.findall(m.group(1))}
+
+def tokenize_output(target_path):
+    """
+    Разбор выходного документа для структурного сравнения (см. TableTokenizer)
+
+    Returns:
+        tokens (list): элементы таблиц
+        table_labels (list): номера таблиц, найденные в каждой таблице
+    """
+    with open(target_path, 'r', encoding="utf8") as file:
+        content = file.read()
+    tokenizer = TableTokenizer(read_output_styles(content))
+    tokenizer.feed(content)
+    tokenizer.close()
+    return tokenizer.tokens, tokenizer.table_labels
+
+def check_labels(table_labels):
+    """
+    Проверка нумерации таблиц html_merger: в таблице не больше одного номера, номера T<документ>-<таблица>
+    возрастают (номера пропущенных документов и таблиц без номера не проверяются)
+
+    Returns:
+        error: описание первого нарушения или None
+    """
+    prev = None
+    for table_idx, labels in enumerate(table_labels):
+        if len(set(labels)) > 1:
+            return 'таблица %d: несколько номеров %s' % (table_idx + 1, sorted(set(labels)))
+        if len(labels) == 0:
+            continue
+        m = OUTPUT_TABLE_LABEL_RE.fullmatch(labels[0])
+        if m == None:
+            return 'таблица %d: номер \'%s\' не исправлен' % (table_idx + 1, labels[0])
+        label = (int(m.group(1)), int(m.group(2)))
+        if prev != None and label <= prev:
+            return 'таблица %d: номер \'%s\' после T%d-%d' % (table_idx + 1, labels[0], prev[0], prev[1])
+        prev = label
+    return None
+
+def diff_tokens(reference, tokens, context=DIFF_CONTEXT):
+    """
+    Поиск первого расхождения последовательностей элементов таблиц
+
+    Returns:
+        diff (dict): {index - номер элемента, reference, actual - элементы вокруг расхождения,
+            reference_count, actual_count - количество элементов} или None, если расхождений нет
+    """
+    if reference == tokens:
+        return None
+    index = next((idx for idx, (expected, actual) in enumerate(zip(reference, tokens)) if expected != actual),
+                 min(len(reference), len(tokens)))
+    start = max(0, index - context)
+    return {'index': index,
+            'reference': [repr(token) for token in reference[start:index + context + 1]],
+            'actual': [repr(token) for token in tokens[start:index + context + 1]],
+            'reference_count': len(reference),
+            'actual_count': len(tokens)}
+
+def file_digest(path):
+    """
+    SHA-256 содержимого файла
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(MB), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def build_modes(executor_types, stream):
+    """
+    Режимы объединения html_merger: способ обработки документов, при stream - также потоковый режим
+
+    Returns:
+        modes (dict): {имя режима: параметры compose_astra_html_tables}
+    """
+    modes = {}
+    for executor_type in executor_types:
+        modes[executor_type] = {'executor_type': executor_type}
+        if stream:
+            modes[executor_type + '-stream'] = {'executor_type': executor_type, 'stream': True}
+    return modes
+
+def run_harness(input_dir, files_list, modes, workers, repeat=DEFAULT_REPEAT, legacy=True, options={}):
+    """
+    Объединение документов исходной реализацией и html_merger в каждом режиме, сверка результатов и измерение
+    пропускной способности
+
+    Args:
+        input_dir: директория с документами
+        files_list: список документов
+        modes: режимы html_merger (см. build_modes)
+        workers: количество потоков (процессов)
+        repeat: количество повторов каждого измерения
+        legacy (boolean): сверять с исходной реализацией (html_merger_legacy)
+        options: общие параметры compose_astra_html_tables для всех режимов (dedup, minify, use_mmap)
+
+    Returns:
+        results (dict): результаты, см. описание полей в коде
+    """
+    input_bytes = sum(html_merger.input_signature(file_name, input_dir)[0] for file_name in files_list)
+    results = {'input_dir': input_dir,
+               'documents': len(files_list),
+               'input_mb': input_bytes/MB,
+               'tables': None,
+               'digest': None,
+               'modes': {},
+               'failures': []}
+    work_dir = tempfile.mkdtemp(prefix='html_merger_harness_')
+    try:
+        reference_tokens = None
+        if legacy:
+            print('Эталон: %s' % (REFERENCE_MODE))
+            target_path = os.path.join(work_dir, REFERENCE_MODE + '.html')
+            if any(html_merger.is_compressed_input(file_name, input_dir) for file_name in files_list):
+                # Исходная реализация читает только несжатые файлы из директории
+                results['modes'][REFERENCE_MODE] = {'skipped': 'сжатые документы'}
+            else:
+                try:
+                    total = html_merger_bench.best_time(lambda: html_merger_bench.run_legacy(input_dir, files_list, target_path), repeat)
+                    reference_tokens = tokenize_output(target_path)[0]
+                    results['modes'][REFERENCE_MODE] = {'total': total, 'throughput_mb_s': input_bytes/MB/total}
+                except Exception as exc:
+                    results['modes'][REFERENCE_MODE] = {'error': str(exc)}
+                    results['failures'].append('%s: ошибка: %s' % (REFERENCE_MODE, exc))
+        bytes_digest = None
+        for mode_name, params in modes.items():
+            print('Режим: %s' % (mode_name))
+            target_path = os.path.join(work_dir, mode_name + '.html')
+            params = dict(options, workers=workers, **params)
+            runs = []
+            try:
+                total = html_merger_bench.best_time(lambda: runs.append(html_merger.compose_astra_html_tables(input_dir, target_path, files_list, **params)), repeat)
+            except Exception as exc:
+                results['modes'][mode_name] = {'error': str(exc)}
+                results['failures'].append('%s: ошибка: %s' % (mode_name, exc))
+                continue
+            tables = runs[-1]['totals']['tables']
+            digest = file_digest(target_path)
+            tokens, table_labels = tokenize_output(target_path)
+            mode = {'total': total,
+                    'throughput_mb_s': input_bytes/MB/total,
+                    'tables_s': tables/total,
+                    'output_mb': os.path.getsize(target_path)/MB,
+                    'digest': digest,
+                    'labels_error': check_labels(table_labels),
+                    'diff': None if reference_tokens == None else diff_tokens(reference_tokens, tokens)}
+            results['modes'][mode_name] = mode
+            if results['tables'] == None:
+                results['tables'] = tables
+            if mode['labels_error'] != None:
+                results['failures'].append('%s: нумерация таблиц: %s' % (mode_name, mode['labels_error']))
+            if mode['diff'] != None:
+                results['failures'].append('%s: таблицы отличаются от эталона, элемент %d' % (mode_name, mode['diff']['index']))
+            # Все режимы с одинаковыми параметрами должны давать один и тот же выходной документ
+            if bytes_digest == None:
+                bytes_digest = digest
+                results['digest'] = digest
+            elif digest != bytes_digest:
+                results['failures'].append('%s: выходной документ отличается от режима %s' % (mode_name, next(iter(modes))))
+        reference = results['modes'].get(REFERENCE_MODE)
+        if reference != None and 'total' in reference and results['tables'] != None:
+            reference['tables_s'] = results['tables']/reference['total']
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def corpus_key(corpus, options):
+    """
+    Ключ набора документов в файле базовых результатов: хэш выходного документа зависит от параметров объединения
+    """
+    flags = [name for name in ('dedup', 'minify') if options.get(name)]
+    return ','.join([corpus] + flags)
+
+def compare_with_baseline(key, results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Сравнение с базовыми результатами: выходной документ не должен меняться, пропускная способность каждого
+    режима html_merger - снижаться больше допустимого
+
+    Args:
+        key: ключ набора документов (см. corpus_key)
+        results: результаты run_harness (дополняются описаниями расхождений)
+        baseline: базовые результаты {ключ: {digest, modes: {режим: {throughput_mb_s}}}}
+        tolerance: допустимое снижение пропускной способности (доля)
+    """
+    corpus_baseline = baseline.get(key)
+    if corpus_baseline == None:
+        return
+    if results['digest'] != None and corpus_baseline.get('digest') not in (None, results['digest']):
+        results['failures'].append('выходной документ отличается от базового (%s, было %s)' % (results['digest'][:12], corpus_baseline['digest'][:12]))
+    for mode_name, mode in results['modes'].items():
+        mode_baseline = corpus_baseline.get('modes', {}).get(mode_name)
+        if mode_name == REFERENCE_MODE or mode_baseline == None or 'throughput_mb_s' not in mode:
+            continue
+        mode['baseline_ratio'] = mode['throughput_mb_s']/mode_baseline['throughput_mb_s']
+        if mode['baseline_ratio'] < 1 - tolerance:
+            results['failures'].append('%s: пропускная способность %.1f МБ/с ниже базовой %.1f МБ/с' % (
+                mode_name, mode['throughput_mb_s'], mode_baseline['throughput_mb_s']))
+
+def baseline_entry(results):
+    """
+    Базовые результаты набора документов для сохранения (см. compare_with_baseline)
+    """
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'digest': results['digest'],
+            'documents': results['documents'],
+            'tables': results['tables'],
+            'input_mb': results['input_mb'],
+            'modes': {mode_name: {'throughput_mb_s': mode['throughput_mb_s'], 'tables_s': mode.get('tables_s')}
+                      for mode_name, mode in results['modes'].items() if 'throughput_mb_s' in mode}}
+
+def print_results(key, results):
+    """
+    Вывод результатов сверки и измерений набора документов в консоль
+    """
+    print(html_merger.BREAKING_LINE)
+    print('Набор: %s' % (key))
+    print('Документов: %d, таблиц: %s, объем: %.1f МБ' % (results['documents'], results['tables'], results['input_mb']))
+    reference = results['modes'].get(REFERENCE_MODE, {})
+    print('%-16s %8s %8s %9s %9s %9s  %s' % ('режим', 'всего', 'МБ/с', 'табл/с', 'x эталон', 'x базов.', 'сверка'))
+    for mode_name, mode in results['modes'].items():
+        if 'skipped' in mode:
+            print('%-16s пропущен: %s' % (mode_name, mode['skipped']))
+            continue
+        if 'error' in mode:
+            print('%-16s ошибка: %s' % (mode_name, mode['error']))
+            continue
+        speedup = '-' if mode_name == REFERENCE_MODE or 'total' not in reference else '%.2f' % (reference['total']/mode['total'])
+        ratio = '%.2f' % (mode['baseline_ratio']) if 'baseline_ratio' in mode else '-'
+        if mode_name == REFERENCE_MODE:
+            check = 'эталон'
+        elif mode['labels_error'] != None:
+            check = 'нумерация таблиц'
+        elif mode['diff'] != None:
+            check = 'расхождение'
+        else:
+            check = 'совпадает' if 'total' in reference else 'без эталона'
+        tables_s = '%9.0f' % (mode['tables_s']) if mode.get('tables_s') != None else '%9s' % ('-')
+        print('%-16s %8.3f %8.1f %s %9s %9s  %s' % (mode_name, mode['total'], mode['throughput_mb_s'], tables_s, speedup, ratio, check))
+    for mode_name, mode in results['modes'].items():
+        diff = mode.get('diff')
+        if diff != None:
+            print('%s: первое расхождение с эталоном - элемент %d (элементов: эталон %d, %s %d)' % (
+                mode_name, diff['index'], diff['reference_count'], mode_name, diff['actual_count']))
+            print('  эталон:   %s' % (' '.join(diff['reference'])))
+            print('  %-9s %s' % (mode_name + ':', ' '.join(diff['actual'])))
+    for failure in results['failures']:
+        print('ОШИБКА: %s' % (failure))
+    print(html_merger.BREAKING_LINE)
+
+def parse_args():
+    """
+    Считывание аргументов командной строки
+
+    Returns:
+        argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description='Сверка результатов и производительности объединения HTML-таблиц с исходной реализацией')
+    parser.add_argument('-d', '--dir', type=str, nargs='+', default=[], help='директории (zip-архивы) с реальными документами')
+    parser.add_argument('--no-generated', dest='generated', action='store_false', help='не проверять сгенерированный набор документов')
+    parser.add_argument('--documents', type=int, default=html_merger_corpus.DEFAULT_DOCUMENTS, help='количество генерируемых документов')
+    parser.add_argument('--tables', type=int, default=html_merger_corpus.DEFAULT_TABLES, help='количество таблиц в документе')
+    parser.add_argument('--rows', type=int, default=html_merger_corpus.DEFAULT_ROWS, help='количество строк в таблице')
+    parser.add_argument('--columns', type=int, default=html_merger_corpus.DEFAULT_COLUMNS, help='количество столбцов в таблице')
+    parser.add_argument('--classes', type=int, default=html_merger_corpus.DEFAULT_CLASSES, help='количество классов стилей в документе')
+    parser.add_argument('--seed', type=int, default=html_merger_corpus.DEFAULT_SEED, help='начальное значение генератора случайных чисел')
+    parser.add_argument('--executors', type=str, nargs='+', choices=html_merger.EXECUTOR_TYPES, default=list(html_merger.EXECUTOR_TYPES),
+                        help='способы обработки документов')
+    parser.add_argument('--no-stream', dest='stream', action='store_false', help='не проверять потоковый режим')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='количество потоков (процессов)')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='количество повторов каждого измерения')
+    parser.add_argument('--mmap', dest='mmap', action='store_true', help='отображать документы в память (обработка без декодирования)')
+    parser.add_argument('--dedup', dest='dedup', action='store_true', help='объединять одинаковые стили документов')
+    parser.add_argument('--minify', dest='minify', action='store_true', help='сжимать выходной документ')
+    parser.add_argument('--no-legacy', dest='legacy', action='store_false', help='не сверять с исходной реализацией')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE_PATH, help='файл с базовыми результатами (JSON)')
+    parser.add_argument('--update-baseline', dest='update_baseline', action='store_true', help='сохранить результаты как базовые')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='допустимое снижение пропускной способности (доля)')
+    return parser.parse_args()
+
+def run_from_command_line():
+    """
+    Запуск из командной строки. Код завершения 1, если выходной документ отличается от эталона или от базового,
+    либо пропускная способность ниже базовой
+    """
+    args = parse_args()
+    html_merger_bench.configure_logging()
+    options = {'dedup': args.dedup, 'minify': args.minify, 'use_mmap': args.mmap}
+    modes = build_modes(args.executors, args.stream)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding="utf8") as file:
+            baseline = json.load(file)
+    elif not args.update_baseline:
+        print('Файл базовых результатов \'%s\' не найден (см. --update-baseline)' % (args.baseline))
+    corpora = [('dir:%s' % (os.path.abspath(input_dir)), input_dir) for input_dir in args.dir]
+    if args.generated:
+        corpora.insert(0, ('generated:documents=%d,tables=%d,rows=%d,columns=%d,classes=%d,seed=%d' % (
+            args.documents, args.tables, args.rows, args.columns, args.classes, args.seed), None))
+    failed = False
+    for corpus, input_dir in corpora:
+        key = corpus_key(corpus, options)
+        corpus_dir = None
+        try:
+            if input_dir == None:
+                corpus_dir = tempfile.mkdtemp(prefix='html_merger_corpus_')
+                input_dir = corpus_dir
+                files_list = html_merger_corpus.generate_corpus(corpus_dir, args.documents, args.tables, args.rows, args.columns, args.classes, args.seed)
+            else:
+                files_list = html_merger.find_input_files(input_dir)
+            results = run_harness(input_dir, files_list, modes, args.workers, args.repeat, args.legacy, options)
+        finally:
+            if corpus_dir != None:
+                shutil.rmtree(corpus_dir, ignore_errors=True)
+        if args.update_baseline and len(results['failures']) == 0:
+            baseline[key] = baseline_entry(results)
+        else:
+            compare_with_baseline(key, results, baseline, args.tolerance)
+        print_results(key, results)
+        failed = failed or len(results['failures']) > 0
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding="utf8") as file:
+            json.dump(baseline, file, ensure_ascii=False, indent=2)
+        print('Базовые результаты сохранены в \'%s\'' % (args.baseline))
+    print('Сверка: %s' % ('ОШИБКА' if failed else 'успешно'))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    run_from_command_line()
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+#### Сервер объединения HTML-таблиц (html_merger) для интерактивного использования:
+#### постоянно запущенный исполнитель и кэш обработанных документов в памяти,
+#### запросы принимаются по HTTP на localhost, объединенный документ передается в ответе
+####
+#### Запуск сервера:  python html_merger_server.py serve --port 8765 --executor process
+#### Запрос:          python html_merger_server.py merge -d ../test/input -o ../test/CombinedTable.html
+#### Статистика:      python html_merger_server.py status
+
+import argparse
+import collections
+import concurrent.futures as confu
+import hashlib
+import http.client
+import http.server
+import io
+import json
+import multiprocessing
+import os
+import os.path
+import shutil
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import html_merger
+
+## Константы
+DEFAULT_HOST = '127.0.0.1'           # Сервер принимает запросы только с локальной машины
+DEFAULT_PORT = 8765
+DEFAULT_MEMORY_CACHE_MB = 512        # Максимальный объем кэша в памяти (по размеру исходных документов), МБ
+LATENCY_WINDOW = 1000                # Количество последних запросов для статистики времени ответа
+RESPONSE_CHUNK_KB = 64               # Размер части ответа на объединение (Transfer-Encoding: chunked), КБ
+MERGE_PARAMS = ('input_dir', 'files_list', 'dedup', 'use_mmap')    # Параметры запроса (см. compose_astra_html_tables)
+MB = html_merger.MB
+
+class MemoryDocumentCache:
+    """
+    Кэш обработанных документов в памяти (LRU) с ключом директория (zip-архив) и имя файла + хэш содержимого.
+    Повторное вычисление хэша не выполняется, пока не изменились размер и время изменения файла (см. html_merger.input_signature).
+    Объем кэша ограничивается суммарным размером исходных документов
+    """
+    def __init__(self, max_size_mb=DEFAULT_MEMORY_CACHE_MB):
+        """
+        Args:
+            max_size_mb: максимальный объем кэша, МБ
+        """
+        self.max_size = max_size_mb*MB
+        self.entries = collections.OrderedDict()    # {(директория, имя файла): {stat, digest, document, size}}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, file_name, input_dir):
+        """
+        Поиск документа в кэше
+
+        Args:
+            file_name: имя файла (для zip-архива - имя члена архива)
+            input_dir: директория с документами или путь к zip-архиву
+
+        Returns:
+            tuple (document, signature)
+            document: результат обработки документа (см. html_merger.parse_document) или None
+            signature: (key, stat, digest) - для сохранения результата обработки в кэш (см. store)
+        """
+        key = (os.path.abspath(input_dir), file_name)
+        stat = html_merger.input_signature(file_name, input_dir)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry != None and entry['stat'] == stat:
+                return self._hit(key, entry), (key, stat, entry['digest'])
+        digest = hashlib.sha1()
+        with html_merger.open_input(file_name, input_dir) as file:
+            for chunk in iter(lambda: file.read(MB), b''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry != None and entry['digest'] == digest:
+                entry['stat'] = stat
+                return self._hit(key, entry), (key, stat, digest)
+            self.misses += 1
+        return None, (key, stat, digest)
+
+    def _hit(self, key, entry):
+        self.hits += 1
+        self.entries.move_to_end(key)
+        document = entry['document']
+        # Метрики дополняются при записи, поэтому каждому запросу передается их копия
+        return dict(document, cached=True, metrics=dict(document['metrics'], cached=True, queue_wait=0.0))
+
+    def store(self, signature, document):
+        """
+        Сохранение результата обработки документа с вытеснением давно не использованных записей
+
+        Args:
+            signature: см. lookup
+            document: результат обработки документа
+        """
+        key, stat, digest = signature
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry != None:
+                self.size -= entry['size']
+            self.entries[key] = {'stat': stat, 'digest': digest, 'document': document, 'size': stat[0]}
+            self.size += stat[0]
+            while self.size > self.max_size and len(self.entries) > 1:
+                _, entry = self.entries.popitem(last=False)
+                self.size -= entry['size']
+
+    def stats(self):
+        """
+        Статистика кэша: количество записей, объем, попадания и промахи
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {'entries': len(self.entries), 'size_mb': self.size/MB, 'max_size_mb': self.max_size/MB,
+                    'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits/requests if requests > 0 else None}
+
+class MergeService:
+    """
+    Объединение документов с общим исполнителем и кэшем в памяти для всех запросов
+    """
+    def __init__(self, executor_type='thread', workers=None, cache_size_mb=DEFAULT_MEMORY_CACHE_MB):
+        """
+        Args:
+            executor_type: способ обработки документов (см. html_merger.EXECUTOR_TYPES)
+            workers: количество потоков (процессов)
+            cache_size_mb: объем кэша в памяти, МБ
+        """
+        if workers == None:
+            workers = 1 if executor_type == 'serial' else multiprocessing.cpu_count()
+        self.executor_type = executor_type
+        self.workers = workers
+        self.executor = html_merger.create_executor(executor_type, workers)
+        self.cache = MemoryDocumentCache(cache_size_mb)
+        self.start_time = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def parse_documents(self, input_dir, files_list, use_mmap=False):
+        """
+        Обработка документов: результаты берутся из кэша, остальные документы обрабатываются исполнителем
+
+        Returns:
+            documents (list): результаты обработки документов (см. html_merger.parse_document)
+        """
+        documents = [None]*len(files_list)
+        futures_to_idx = {}
+        for idx, file_name in enumerate(files_list):
+            document, signature = self.cache.lookup(file_name, input_dir)
+            if document != None:
+                documents[idx] = document
+                continue
+            future = self.executor.submit(html_merger.parse_document, file_name, input_dir, submit_time=time.time(), use_mmap=use_mmap)
+            futures_to_idx[future] = (idx, signature)
+        try:
+            for future in confu.as_completed(futures_to_idx):
+                idx, signature = futures_to_idx[future]
+                documents[idx] = future.result()
+                self.cache.store(signature, documents[idx])
+        except Exception as exc:
+            for future in futures_to_idx:
+                future.cancel()
+            raise html_merger.TablesComposerException(exc)
+        return documents
+
+    def merge(self, params, out_file):
+        """
+        Объединение документов по параметрам запроса с записью в выходной поток
+
+        Args:
+            params: dict {input_dir, files_list, dedup, use_mmap} (см. compose_astra_html_tables)
+            out_file: функция без аргументов, возвращающая выходной поток в текстовом режиме;
+                вызывается после обработки всех документов
+
+        Returns:
+            metrics (dict): количество документов, таблиц, взятых из кэша документов, время ответа
+        """
+        start = time.perf_counter()
+        try:
+            input_dir = params['input_dir']
+            files_list = params.get('files_list') or html_merger.find_input_files(input_dir)
+            documents = self.parse_documents(input_dir, files_list, params.get('use_mmap', False))
+            tables_count = html_merger.write_combined_stream(out_file(), [document['css_styles'] for document in documents], documents, params.get('dedup', False))
+        except Exception:
+            with self.lock:
+                self.requests += 1
+                self.errors += 1
+            raise
+        latency = time.perf_counter() - start
+        with self.lock:
+            self.requests += 1
+            self.latencies.append(latency)
+        metrics = {'documents': len(documents), 'tables': tables_count, 'cached': sum(document['cached'] for document in documents), 'latency': latency}
+        html_merger.log.info('Объединение \'%s\': документов %d (из кэша %d), таблиц %d, %5.3f сек', input_dir, metrics['documents'], metrics['cached'], tables_count, latency)
+        return metrics
+
+    def status(self):
+        """
+        Состояние сервера: количество запросов, статистика кэша и времени ответа (по последним LATENCY_WINDOW запросам)
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            requests, errors = self.requests, self.errors
+        latency = None
+        if len(latencies) > 0:
+            latency = {'count': len(latencies),
+                       'mean': sum(latencies)/len(latencies),
+                       'p50': latencies[len(latencies)//2],
+                       'p95': latencies[min(len(latencies) - 1, int(len(latencies)*0.95))],
+                       'max': latencies[-1]}
+        return {'uptime': time.time() - self.start_time, 'executor': self.executor_type, 'workers': self.workers,
+                'requests': requests, 'errors': errors, 'cache': self.cache.stats(), 'latency': latency}
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+class ChunkedResponseStream(io.RawIOBase):
+    """
+    Поток записи тела ответа HTTP/1.1 частями (Transfer-Encoding: chunked). Ответ завершается
+    частью нулевой длины (см. finish); после abort записанные данные отбрасываются, и ответ остается
+    незавершенным - клиент определяет это по отсутствию последней части
+    """
+    def __init__(self, wfile):
+        """
+        Args:
+            wfile: поток записи в соединение (BaseHTTPRequestHandler.wfile)
+        """
+        super().__init__()
+        self.wfile = wfile
+        self.aborted = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if len(data) > 0 and not self.aborted:
+            self.wfile.write(b'%x\r\n' % (len(data)))
+            self.wfile.write(data)
+            self.wfile.write(b'\r\n')
+        return len(data)
+
+    def finish(self):
+        self.wfile.write(b'0\r\n\r\n')
+
+    def abort(self):
+        self.aborted = True
+
+class MergeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Обработка HTTP-запросов: POST /merge - объединение (параметры в JSON, ответ - объединенный документ),
+    GET /status - состояние сервера (JSON). Объединенный документ передается частями по мере записи документов
+    (см. ChunkedResponseStream); об ошибке при обработке документов сообщается кодом 500, при ошибке во время
+    передачи ответ не завершается и соединение закрывается
+    """
+    server_version = 'AstraTablesComposer'
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_json(404, {'error': 'Неизвестный адрес: %s' % (self.path)})
+            return
+        self.send_json(200, self.server.service.status())
+
+    def do_POST(self):
+        if self.path != '/merge':
+            self.send_json(404, {'error': 'Неизвестный адрес: %s' % (self.path)})
+            return
+        try:
+            params = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf8'))
+            unknown = [key for key in params if key not in MERGE_PARAMS]
+            if len(unknown) > 0 or 'input_dir' not in params:
+                raise ValueError('Параметры запроса: %s (обязательный - input_dir); неизвестные: %s' % (', '.join(MERGE_PARAMS), ', '.join(unknown)))
+        except ValueError as exc:
+            self.send_json(400, {'error': str(exc)})
+            return
+        body = None
+        out_file = None
+
+        def open_body():
+            # Заголовки отправляются после обработки всех документов, перед записью выходного документа
+            nonlocal body, out_file
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            body = ChunkedResponseStream(self.wfile)
+            # Переводы строк преобразуются так же, как при записи в файл (см. html_merger.write_document_tables)
+            out_file = io.TextIOWrapper(io.BufferedWriter(body, RESPONSE_CHUNK_KB*1024), encoding='utf8')
+            return out_file
+
+        try:
+            self.server.service.merge(params, open_body)
+            out_file.flush()
+            body.finish()
+        except Exception as exc:
+            html_merger.log.error('[ОШИБКА] Ошибка при объединении \'%s\': %s', params.get('input_dir'), exc)
+            if body == None:
+                self.send_json(500, {'error': str(exc)})
+                return
+            body.abort()
+            self.close_connection = True
+        finally:
+            if out_file != None:
+                # Соединение закрывается сервером, а не оберткой
+                out_file.detach()
+
+    def send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False, indent=2).encode('utf8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        html_merger.log.debug('%s - ' + format, self.address_string(), *args)
+
+def serve(host, port, service):
+    """
+    Запуск сервера до прерывания (Ctrl+C)
+    """
+    server = http.server.ThreadingHTTPServer((host, port), MergeRequestHandler)
+    server.service = service
+    html_merger.log.info('Сервер объединения запущен: http://%s:%d (исполнитель %s, потоков (процессов) %d)', host, port, service.executor_type, service.workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        html_merger.log.info('Сервер объединения остановлен')
+
+def request_merge(url, params, target_path):
+    """
+    Клиент: запрос объединения у сервера с сохранением ответа в файл. Ответ записывается во временный файл,
+    который заменяет выходной, только если получен полностью (с последней частью, см. ChunkedResponseStream)
+
+    Args:
+        url: адрес сервера, например http://127.0.0.1:8765
+        params: параметры объединения (см. MERGE_PARAMS)
+        target_path: путь к выходному файлу
+    """
+    request = urllib.request.Request(url.rstrip('/') + '/merge', data=json.dumps(params).encode('utf8'),
+                                     headers={'Content-Type': 'application/json'})
+    temp_path = target_path + '.tmp'
+    try:
+        with urllib.request.urlopen(request) as response, open(temp_path, 'wb') as out_file:
+            shutil.copyfileobj(response, out_file)
+        os.replace(temp_path, target_path)
+    except urllib.error.HTTPError as exc:
+        raise html_merger.TablesComposerException(json.loads(exc.read().decode('utf8')).get('error'))
+    except (http.client.IncompleteRead, ConnectionError) as exc:
+        raise html_merger.TablesComposerException('Ответ сервера получен не полностью: %s' % (exc))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def request_status(url):
+    """
+    Клиент: запрос состояния сервера
+
+    Returns:
+        status (dict): см. MergeService.status
+    """
+    with urllib.request.urlopen(url.rstrip('/') + '/status') as response:
+        return json.loads(response.read().decode('utf8'))
+
+def parse_args():
+    """
+    Считывание аргументов командной строки
+
+    Returns:
+        argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description='Сервер объединения HTML-таблиц')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help='запуск сервера')
+    serve_parser.add_argument('--host', type=str, default=DEFAULT_HOST, help='адрес сервера')
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='порт сервера')
+    serve_parser.add_argument('--executor', type=str, choices=html_merger.EXECUTOR_TYPES, default='thread', help='способ обработки документов')
+    serve_parser.add_argument('--workers', type=int, help='количество потоков (процессов)')
+    serve_parser.add_argument('--cache-size-mb', dest='cache_size_mb', type=int, default=DEFAULT_MEMORY_CACHE_MB, help='объем кэша документов в памяти, МБ')
+    serve_parser.add_argument('--debug', dest='debug', action='store_true', help='режим отладки')
+    merge_parser = subparsers.add_parser('merge', help='запрос объединения у сервера')
+    merge_parser.add_argument('-d', '--dir', type=str, required=True, help='директория с HTML-файлами (на сервере)')
+    merge_parser.add_argument('-f', '--file', type=str, nargs='+', help='список HTML-файлов')
+    merge_parser.add_argument('-o', '--output', type=str, required=True, help='путь к выходному файлу')
+    merge_parser.add_argument('--dedup-styles', dest='dedup', action='store_true', help='объединять одинаковые стили всех документов в общие классы')
+    merge_parser.add_argument('--mmap', dest='mmap', action='store_true', help='отображать документы в память')
+    status_parser = subparsers.add_parser('status', help='состояние сервера')
+    for subparser in (merge_parser, status_parser):
+        subparser.add_argument('--url', type=str, default='http://%s:%d' % (DEFAULT_HOST, DEFAULT_PORT), help='адрес сервера')
+    return parser.parse_args()
+
+def run_from_command_line():
+    """
+    Запуск из командной строки
+    """
+    args = parse_args()
+    if args.command == 'serve':
+        html_merger.log = html_merger.configure_logging(args.debug)
+        serve(args.host, args.port, MergeService(args.executor, args.workers, args.cache_size_mb))
+    elif args.command == 'merge':
+        # Директория передается серверу как абсолютный путь, т.к. рабочие директории клиента и сервера могут различаться
+        params = {'input_dir': os.path.abspath(args.dir), 'files_list': args.file or [], 'dedup': args.dedup, 'use_mmap': args.mmap}
+        try:
+            request_merge(args.url, params, args.output)
+        except html_merger.TablesComposerException as exc:
+            print('[ОШИБКА] %s' % (exc))
+            sys.exit(1)
+    else:
+        print(json.dumps(request_status(args.url), ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    run_from_command_line()
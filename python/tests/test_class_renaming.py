@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#### Регрессионная проверка переименования классов стилей и номеров таблиц:
+#### результат должен совпадать побайтно с исходной заменой каждого класса отдельным re.sub
+
+import io
+import os
+import random
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import html_merger
+
+## Константы
+SEEDS = range(20)            # Начальные значения генератора случайных чисел (по одному документу на значение)
+CLASS_NUM_STARTS = (1, 57)   # Номер первого класса документа в общем документе
+# Варианты записи атрибута class; исходная замена учитывает только двойные кавычки и пробельные символы вокруг '='
+CLASS_ATTR_FORMATS = ('class="%s"', 'class = "%s"', 'class=\t"%s"', 'class\n=\n"%s"', "class='%s'", 'class="%s x"')
+
+def generate_document(rnd, document_num):
+    """
+    Генерация документа: много классов s<N> (в том числе повторно объявленный и не объявленные),
+    класс с именем не вида s<N>, разные варианты записи атрибута class, номера таблиц Т<документ>-<таблица>
+
+    Returns:
+        content: содержимое документа (строки без пробельных символов по краям, см. html_merger.join_lines)
+    """
+    classes_count = rnd.randint(1, 300)
+    class_labels = ['s%d' % (class_num) for class_num in range(classes_count)] + ['page_break']
+    if rnd.random() < 0.5:
+        class_labels.append('s%d' % (rnd.randrange(classes_count)))
+    lines = ['<html>', '<head>', '<style type="text/css"><!--']
+    lines += ['.%s {font-size: %dpx; text-align: Center;}' % (class_label, rnd.randint(8, 14)) for class_label in class_labels]
+    lines += ['--></style>', '</head>', '<body>']
+    used_labels = class_labels + ['s%d' % (classes_count + rnd.randint(0, 100)), 's']
+    for table_num in range(1, rnd.randint(1, 8) + 1):
+        lines.append('<table width="%d" border="0">' % (rnd.randint(100, 900)))
+        lines.append('<tr><td %s>Т%d-%d. Заголовок</td></tr>' % (rnd.choice(CLASS_ATTR_FORMATS) % (rnd.choice(used_labels)), document_num, table_num))
+        for _ in range(rnd.randint(0, 30)):
+            cells = ['<td %s>%.2f</td>' % (rnd.choice(CLASS_ATTR_FORMATS) % (rnd.choice(used_labels)), rnd.uniform(-1000, 1000))
+                     for _ in range(rnd.randint(1, 6))]
+            lines.append('<tr>%s</tr>' % (''.join(cells)))
+        lines.append('</table>')
+        lines.append('<div class="page_break">&nbsp;</div>')
+    lines += ['</body>', '</html>']
+    return '\n'.join(lines)
+
+def reference_tables(content, class_num_start, document_num):
+    """
+    Исходная реализация: замена каждого класса отдельным re.sub (с конца списка) и номера таблицы в каждой таблице
+    """
+    class_labels = [class_label for class_label, _ in html_merger.extract_styles(content, 'test')]
+    tables_content = ''
+    for table_num, m in enumerate(re.finditer(r'(<table[^<]+>.+?</table>)', content, flags=re.DOTALL), 1):
+        tables_content_cur = m.group(1)
+        for i in range(len(class_labels)-1, -1, -1):
+            tables_content_cur = re.sub(r'class\s*=\s*"%s"'%(class_labels[i]), 'class="s%d"'%(i+class_num_start), tables_content_cur)
+        tables_content_cur = re.sub(r'Т\d+-\d+', 'T%d-%d'%(document_num, table_num), tables_content_cur)
+        tables_content += tables_content_cur
+    return tables_content
+
+def parse_content(content):
+    return html_merger.extract_styles(content, 'test'), html_merger.extract_tables(content, html_merger.extract_styles(content, 'test'))
+
+def parse_text_file(content):
+    return html_merger.scan_document(io.TextIOWrapper(io.BytesIO(content.encode('utf8')), encoding='utf8'), 'test')
+
+def parse_bytes(content):
+    return html_merger.scan_document_bytes(content.encode('utf8'), 'test')
+
+@pytest.mark.parametrize('parse', [parse_content, parse_text_file, parse_bytes], ids=['extract_tables', 'scan_document', 'scan_document_bytes'])
+@pytest.mark.parametrize('class_num_start', CLASS_NUM_STARTS)
+@pytest.mark.parametrize('seed', SEEDS)
+def test_rendered_tables_match_reference(parse, class_num_start, seed):
+    rnd = random.Random(seed)
+    document_num = rnd.randint(1, 50)
+    content = generate_document(rnd, document_num)
+    css_styles, tables = parse(content)
+    class_nums = range(class_num_start, class_num_start + len(css_styles))
+    rendered = html_merger.render_tables(tables, class_nums, document_num)
+    if isinstance(rendered, bytes):
+        rendered = rendered.decode('utf8')
+    assert rendered == reference_tables(content, class_num_start, document_num)
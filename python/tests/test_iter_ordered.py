@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#### Проверка выполнения задач с ограничением количества и объема (html_merger.iter_ordered):
+#### порядок результатов, соблюдение ограничений, учет объема группы задач до ее обработки
+
+import concurrent.futures as confu
+import os
+import random
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import html_merger
+
+## Константы
+SEEDS = range(30)          # Начальные значения генератора случайных чисел (по одному набору задач на значение)
+MAX_COST = 10              # Наибольший объем результата задачи
+MAX_GROUP_SIZE = 3         # Наибольшее количество задач в группе
+MAX_DELAY = 0.002          # Наибольшее время выполнения задачи, сек (задачи завершаются не по порядку)
+
+class FakeSubmit:
+    """
+    Передача задач исполнителю с записью номеров переданных задач. Задача возвращает свой номер
+    """
+    def __init__(self, executor=None, delays=None):
+        """
+        Args:
+            executor: исполнитель или None - задача выполняется при передаче
+            delays: время выполнения каждой задачи, сек, или None
+        """
+        self.executor = executor
+        self.delays = delays
+        self.submitted = []
+
+    def run(self, task_idx):
+        if self.delays != None:
+            time.sleep(self.delays[task_idx])
+        return task_idx
+
+    def __call__(self, task_idx):
+        self.submitted.append(task_idx)
+        if self.executor != None:
+            return self.executor.submit(self.run, task_idx)
+        future = confu.Future()
+        future.set_result(self.run(task_idx))
+        return future
+
+def generate_groups(rnd, tasks_count):
+    """
+    Номера групп задач: группы из 1..MAX_GROUP_SIZE задач подряд
+    """
+    groups = []
+    while len(groups) < tasks_count:
+        groups += [len(groups)]*rnd.randint(1, MAX_GROUP_SIZE)
+    return groups[:tasks_count]
+
+def held_cost(task_idx, submitted_count, costs, groups):
+    """
+    Объем задач, результаты которых еще используются при обработке результата task_idx: переданные, но не выданные задачи
+    и для группы из нескольких задач - выданные задачи этой группы (включая task_idx)
+    """
+    cost = sum(costs[task_idx + 1:submitted_count])
+    group_tasks = [idx for idx in range(len(groups)) if groups[idx] == groups[task_idx]]
+    if len(group_tasks) > 1:
+        cost += sum(costs[idx] for idx in group_tasks if idx <= task_idx)
+    return cost
+
+def test_results_in_order():
+    rnd = random.Random(0)
+    tasks_count = 100
+    delays = [rnd.uniform(0, MAX_DELAY) for _ in range(tasks_count)]
+    with confu.ThreadPoolExecutor(max_workers=8) as executor:
+        submit = FakeSubmit(executor, delays)
+        results = list(html_merger.iter_ordered(submit, [(idx,) for idx in range(tasks_count)], 8))
+    assert results == list(range(tasks_count))
+    assert submit.submitted == list(range(tasks_count))
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_limits(seed):
+    rnd = random.Random(seed)
+    tasks_count = rnd.randint(1, 60)
+    max_inflight = rnd.randint(1, 6)
+    max_buffer = MAX_COST*MAX_GROUP_SIZE
+    costs = [rnd.randint(1, MAX_COST) for _ in range(tasks_count)]
+    groups = generate_groups(rnd, tasks_count) if rnd.random() < 0.7 else None
+    delays = [rnd.uniform(0, MAX_DELAY) for _ in range(tasks_count)]
+    stats = {}
+    results = []
+    with confu.ThreadPoolExecutor(max_workers=4) as executor:
+        submit = FakeSubmit(executor, delays)
+        for result in html_merger.iter_ordered(submit, [(idx,) for idx in range(tasks_count)], max_inflight, max_buffer, costs, stats, groups=groups):
+            # Задачи, переданные до выдачи текущего результата, - в порядке следования, без пропусков
+            assert submit.submitted == list(range(len(submit.submitted)))
+            assert len(submit.submitted) - len(results) - 1 <= max_inflight
+            assert held_cost(result, len(submit.submitted), costs, groups or list(range(tasks_count))) <= max_buffer
+            results.append(result)
+    assert results == list(range(tasks_count))
+    assert stats['peak_inflight'] <= max_inflight
+    assert stats['peak_buffer'] <= max_buffer
+
+def test_group_cost_held_until_consumed():
+    # Группа 1 из трех задач занимает весь допустимый объем: следующая задача передается только после
+    # обработки последнего результата группы (при продолжении перебора)
+    groups = [0, 1, 1, 1, 2, 3, 4]
+    costs = [10]*len(groups)
+    submit = FakeSubmit()
+    stats = {}
+    tasks = html_merger.iter_ordered(submit, [(idx,) for idx in range(len(groups))], 10, 30, costs, stats, groups=groups)
+    submitted_counts = []
+    for result in tasks:
+        submitted_counts.append(len(submit.submitted))
+    assert submitted_counts == [4, 4, 4, 4, 7, 7, 7]
+    assert stats['peak_buffer'] == 30
+
+def test_single_task_released_before_yield():
+    # Объем задачи вне группы освобождается до выдачи результата: следующая задача передается сразу
+    costs = [10]*5
+    submit = FakeSubmit()
+    submitted_counts = [len(submit.submitted) for _ in html_merger.iter_ordered(submit, [(idx,) for idx in range(len(costs))], 10, 20, costs)]
+    assert submitted_counts == [3, 4, 5, 5, 5]